@@ -1,287 +1,131 @@
 import datetime
-import hashlib
-from abc import ABC, abstractmethod
+import uuid
+from bank import ATM, User, SavingsAccount, CurrentAccount, CurrencyConverter, METRICS
+from transaction_log import DEPOSIT, WITHDRAWAL, LOAN_TAKEN, LOAN_PAYMENT, NO_LOAN, CURRENCIES
+from journal import JournalStorage
+from metrics import serve as serve_metrics
+from money import SCALE, fmt
+from rates import RateService
 import streamlit as st
 
 
 # ======================================================
-# CURRENCY CONVERTER
-# ======================================================
-class CurrencyConverter:
-    RATES_TO_PKR = {"PKR": 1, "USD": 280, "EUR": 300}
-
-    @classmethod
-    def to_pkr(cls, amount, currency):
-        currency = currency.upper()
-        if currency not in cls.RATES_TO_PKR:
-            raise ValueError("Unsupported currency.")
-        return amount * cls.RATES_TO_PKR[currency]
-
-
-# ======================================================
-# USER CLASS
-# ======================================================
-class User:
-    MAX_ATTEMPTS = 3
-    LOCK_TIME_MINUTES = 2
-
-    def __init__(self, user_id, name, pin, is_admin=False):
-        self.user_id = user_id
-        self.name = name
-        self.is_admin = is_admin
-        self.__pin_hash = self.__hash_pin(pin)
-        self.failed_attempts = 0
-        self.locked_until = None
-        self.daily_withdrawals = {"PKR": 0, "USD": 0, "EUR": 0}
-        self.last_withdrawal_date = datetime.date.today()
-
-    def __hash_pin(self, pin):
-        return hashlib.sha256(pin.encode()).hexdigest()
-
-    def is_locked(self):
-        return (
-            self.locked_until is not None
-            and datetime.datetime.now() < self.locked_until
-        )
-
-    def verify_pin(self, pin):
-        if self.is_locked():
-            return False, "Account is locked. Try later."
-        if self.__pin_hash == self.__hash_pin(pin):
-            self.failed_attempts = 0
-            return True, ""
-        self.failed_attempts += 1
-        if self.failed_attempts >= self.MAX_ATTEMPTS:
-            self.locked_until = datetime.datetime.now() + datetime.timedelta(minutes=self.LOCK_TIME_MINUTES)
-            return False, "Account locked for 2 minutes."
-        return False, "Incorrect PIN."
-
-    def change_pin(self, old_pin, new_pin):
-        if len(new_pin) != 4 or not new_pin.isdigit():
-            return False, "PIN must be 4 digits."
-        success, msg = self.verify_pin(old_pin)
-        if success:
-            self.__pin_hash = self.__hash_pin(new_pin)
-            return True, "PIN changed successfully."
-        else:
-            return False, msg
-
-    def reset_daily_withdrawals(self):
-        if self.last_withdrawal_date != datetime.date.today():
-            self.daily_withdrawals = {"PKR": 0, "USD": 0, "EUR": 0}
-            self.last_withdrawal_date = datetime.date.today()
-
-
-# ======================================================
-# LOAN CLASS
-# ======================================================
-class Loan:
-    def __init__(self, principal, currency, duration_years, start_date, interest_rate=0.03):
-        self.principal = principal
-        self.currency = currency
-        self.duration_years = duration_years
-        self.start_date = start_date
-        self.interest_rate = interest_rate
-        self.remaining_amount = principal * (1 + interest_rate * duration_years)
-
-    def __str__(self):
-        return (f"Loan: {self.principal} {self.currency}, "
-                f"Duration: {self.duration_years:.2f} years, "
-                f"Remaining: {self.remaining_amount:.2f} {self.currency}")
-
-
-# ======================================================
-# ABSTRACT ACCOUNT CLASS
-# ======================================================
-class Account(ABC):
-    DAILY_LIMITS = {"PKR": 20000, "USD": 500, "EUR": 600}
-
-    def __init__(self, balance_pkr):
-        self._balance_pkr = balance_pkr
-        self.transactions = []
-        self.loans = []
-
-    @property
-    def balance(self):
-        return self._balance_pkr
-
-    def _log_transaction(self, message):
-        timestamp = datetime.datetime.now()
-        self.transactions.append(f"{timestamp} - {message}")
-
-    def deposit(self, amount, currency):
-        try:
-            if amount <= 0:
-                return "Deposit amount must be positive."
-            currency = currency.upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            self._balance_pkr += amount_pkr
-            self._log_transaction(f"Deposited {amount} {currency} (PKR {amount_pkr})")
-            return f"Deposit successful. PKR {amount_pkr} added."
-        except ValueError:
-            return "Invalid input or unsupported currency."
-
-    @abstractmethod
-    def withdraw(self, amount, currency, user):
-        pass
-
-    def take_loan(self, amount, currency, duration_type, duration):
-        try:
-            if amount <= 0:
-                return "Loan amount must be positive."
-            currency = currency.upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            if duration <= 0:
-                return "Duration must be positive."
-            years = duration / 12 if duration_type == "months" else duration
-            interest = amount_pkr * 0.03 * years
-
-            # Create loan
-            loan = Loan(principal=amount, currency=currency, duration_years=years,
-                        start_date=datetime.date.today())
-            self.loans.append(loan)
-            self._balance_pkr += amount_pkr
-            self._log_transaction(f"Loan taken: {amount} {currency} (PKR {amount_pkr}), Duration: {duration} {duration_type}, Interest: PKR {interest:.2f}")
-            return f"Loan granted! PKR {amount_pkr} added. Interest: PKR {interest:.2f}"
-        except ValueError:
-            return "Invalid input."
-
-    def get_loans(self):
-        return self.loans
-
-    def pay_loan(self, loan_index, amount):
-        if not self.loans:
-            return "No loans to pay."
-        if loan_index < 0 or loan_index >= len(self.loans):
-            return "Invalid loan selection."
-        loan = self.loans[loan_index]
-        if amount <= 0:
-            return "Amount must be positive."
-        amount_pkr = CurrencyConverter.to_pkr(amount, loan.currency)
-        if amount_pkr > self._balance_pkr:
-            return "Insufficient balance to pay this amount."
-        if amount > loan.remaining_amount:
-            amount = loan.remaining_amount
-            amount_pkr = CurrencyConverter.to_pkr(amount, loan.currency)
-        self._balance_pkr -= amount_pkr
-        loan.remaining_amount -= amount
-        self._log_transaction(f"Loan payment: {amount} {loan.currency} (PKR {amount_pkr})")
-        message = f"Payment successful. Remaining loan: {loan.remaining_amount:.2f} {loan.currency}"
-        if loan.remaining_amount <= 0:
-            message += " Loan fully paid!"
-            self.loans.remove(loan)
-        return message
-
-    def get_transactions(self):
-        return self.transactions[-10:]
-
-
-# ======================================================
-# SAVINGS ACCOUNT
-# ======================================================
-class SavingsAccount(Account):
-    MIN_BALANCE_PKR = 1000
-
-    def withdraw(self, amount, currency, user):
-        try:
-            if amount <= 0:
-                return "Withdrawal must be positive."
-            currency = currency.upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            user.reset_daily_withdrawals()
-
-            if user.daily_withdrawals[currency] + amount > Account.DAILY_LIMITS[currency]:
-                return f"Daily withdrawal limit exceeded for {currency}."
-            if self._balance_pkr - amount_pkr < self.MIN_BALANCE_PKR:
-                return "Minimum balance requirement not met."
-
-            self._balance_pkr -= amount_pkr
-            user.daily_withdrawals[currency] += amount
-            self._log_transaction(f"Withdrew {amount} {currency} (PKR {amount_pkr})")
-            return f"Withdrawal successful. PKR {amount_pkr} deducted."
-        except ValueError:
-            return "Invalid input."
-
-
-# ======================================================
-# CURRENT ACCOUNT
+# STREAMLIT APP
 # ======================================================
-class CurrentAccount(Account):
-    def withdraw(self, amount, currency, user):
+DATA_DIR = "atm_data"
+TRANSACTION_TYPES = {"Any": None, "Deposit": DEPOSIT, "Withdrawal": WITHDRAWAL,
+                     "Loan taken": LOAN_TAKEN, "Loan payment": LOAN_PAYMENT}
+TYPE_NAMES = {kind: name for name, kind in TRANSACTION_TYPES.items() if kind is not None}
+TRANSACTION_COLUMNS = ["Time", "Type", "Amount", "Currency", "Amount (PKR)", "Loan", "Rate version"]
+PAGE_SIZE = 25
+RATES_PATH = "rates.json"
+RATES_HISTORY_PATH = "rates_history.jsonl"
+METRICS_PORT = 9108   # Prometheus scrape endpoint on localhost; None turns it off
+
+
+@st.cache_resource
+def get_atm():
+    # One engine per server process, shared by every browser session.
+    CurrencyConverter.rates = RateService(RATES_PATH, RATES_HISTORY_PATH)
+    CurrencyConverter.rates.watch(User.scheduler)
+    atm = ATM.from_storage(JournalStorage(DATA_DIR))
+    if not atm.users:
+        # Admin
+        atm.add_user(User("admin", "Bank Admin", "9999", is_admin=True), None)
+        # Users
+        atm.add_user(User("101", "Anzar", "1234"), SavingsAccount(10000))
+        atm.add_user(User("102", "Ali", "4321"), CurrentAccount(20000))
+    if METRICS_PORT:
         try:
-            if amount <= 0:
-                return "Withdrawal must be positive."
-            currency = currency.upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            user.reset_daily_withdrawals()
-
-            if user.daily_withdrawals[currency] + amount > Account.DAILY_LIMITS[currency]:
-                return f"Daily withdrawal limit exceeded for {currency}."
-            if self._balance_pkr - amount_pkr < 0:
-                return "Insufficient balance."
-
-            self._balance_pkr -= amount_pkr
-            user.daily_withdrawals[currency] += amount
-            self._log_transaction(f"Withdrew {amount} {currency} (PKR {amount_pkr})")
-            return f"Withdrawal successful. PKR {amount_pkr} deducted."
-        except ValueError:
-            return "Invalid input."
-
-
-# ======================================================
-# ATM CLASS
-# ======================================================
-class ATM:
-    def __init__(self):
-        self.users = {}
-        self.accounts = {}
-
-    def add_user(self, user: User, account: Account):
-        self.users[user.user_id] = user
-        self.accounts[user.user_id] = account
-
-    def login(self, user_id, pin):
-        if user_id not in self.users:
-            return None, "User not found."
-        user = self.users[user_id]
-        success, msg = user.verify_pin(pin)
-        if success:
-            return user, ""
-        else:
-            return None, msg
-
-    def get_users(self):
-        return [(u.user_id, u.name) for u in self.users.values()]
-
-    def get_all_transactions(self):
-        return {uid: account.get_transactions() if account else [] for uid, account in self.accounts.items()}
-
-    def freeze_user(self, uid):
-        if uid in self.users:
-            self.users[uid].locked_until = datetime.datetime.now() + datetime.timedelta(days=365)
-            return "User account frozen."
-        else:
-            return "User not found."
+            serve_metrics(METRICS, port=METRICS_PORT)
+        except OSError:
+            pass  # port taken, e.g. by the terminal version
+    return atm
+
+
+def form_key(form):
+    # Idempotency key of the form's next request. It is kept until a response
+    # to a submit has been shown (rotate_key), so a submit whose call raised,
+    # or whose run was cut short by a rerun before the response was drawn (a
+    # double click), is sent again under the same key and answered from the
+    # bank's idempotency cache. Every submit after a shown response is a new
+    # request, even with the same details.
+    return st.session_state.setdefault(f"{form}_key", uuid.uuid4().hex)
+
+
+def rotate_key(form):
+    st.session_state[f"{form}_key"] = uuid.uuid4().hex
+
+
+# ---------------- TRANSACTION GRID ----------------
+# The full table of an account is built once per account version and shared
+# (cache_resource, so it is not copied on every hit); sorted orders and pages
+# are cached on top of it. Reruns that did not change the ledger reuse all
+# three.
+def transaction_frame(rows):
+    import pandas as pd
+    kinds, amounts, currencies, amounts_pkr, timestamps, loan_ids, rate_versions = (
+        zip(*rows) if rows else ([],) * 7)
+    return pd.DataFrame({
+        "Time": pd.to_datetime(pd.Series(timestamps, dtype="int64"), unit="s"),
+        "Type": pd.Categorical([TYPE_NAMES[k] for k in kinds]),
+        "Amount": pd.Series(amounts, dtype="int64") / SCALE,
+        "Currency": pd.Categorical([CURRENCIES[c] for c in currencies]),
+        "Amount (PKR)": pd.Series(amounts_pkr, dtype="int64") / SCALE,
+        "Loan": pd.Series([i if i != NO_LOAN else None for i in loan_ids], dtype="Int64"),
+        "Rate version": pd.Series(rate_versions, dtype="int64"),
+    }, columns=TRANSACTION_COLUMNS)
+
+
+@st.cache_resource(max_entries=64)
+def account_table(_account, account_key, version):
+    return transaction_frame(_account.transaction_rows())
+
+
+@st.cache_resource(max_entries=64)
+def sorted_account_table(_account, account_key, version, sort_by, ascending):
+    table = account_table(_account, account_key, version)
+    return table.sort_values(sort_by, ascending=ascending, kind="stable", ignore_index=True)
+
+
+@st.cache_data(max_entries=256)
+def account_page(_account, account_key, version, sort_by, ascending, page, page_size):
+    table = sorted_account_table(_account, account_key, version, sort_by, ascending)
+    return table.iloc[page * page_size:(page + 1) * page_size]
+
+
+@st.cache_data(max_entries=256)
+def query_page(_atm, query, cursor, index_version):
+    # index_version: rows in the transaction index; new rows invalidate pages.
+    hits, next_cursor = _atm.query_transactions(cursor=cursor, **dict(query))
+    rows = [(t.kind, t.amount, CURRENCIES.index(t.currency), t.amount_pkr, t.timestamp, t.loan_id,
+             t.rate_version) for _, t in hits]
+    table = transaction_frame(rows)
+    table.insert(0, "User", [uid for uid, _ in hits])
+    return table, next_cursor
+
+
+def transaction_grid(account):
+    key = f"{id(account)}:{account.owner_id}"
+    sort_col, order_col, page_col = st.columns(3)
+    sort_by = sort_col.selectbox("Sort by", TRANSACTION_COLUMNS, key="grid_sort")
+    ascending = order_col.selectbox("Order", ["Descending", "Ascending"], key="grid_order") == "Ascending"
+    pages = max(1, -(-len(account.transactions) // PAGE_SIZE))
+    page = page_col.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key="grid_page")
+    table = account_page(account, key, account.version, sort_by, ascending, page - 1, PAGE_SIZE)
+    if table.empty:
+        st.write("No transactions found.")
+    else:
+        st.dataframe(table, hide_index=True)
 
 
-# ======================================================
-# STREAMLIT APP
-# ======================================================
 def main():
     st.title("ATM System")
 
-    if 'atm' not in st.session_state:
-        st.session_state.atm = ATM()
-        # Admin
-        st.session_state.atm.add_user(User("admin", "Bank Admin", "9999", is_admin=True), None)
-        # Users
-        st.session_state.atm.add_user(User("101", "Anzar", "1234"), SavingsAccount(10000))
-        st.session_state.atm.add_user(User("102", "Ali", "4321"), CurrentAccount(20000))
-
     if 'user' not in st.session_state:
         st.session_state.user = None
 
-    atm = st.session_state.atm
+    atm = get_atm()
 
     if st.session_state.user is None:
         st.header("Login")
@@ -313,85 +157,137 @@ def user_menu(atm, user):
 
     st.header("User Menu")
 
+    # Each panel is a fragment: a widget inside it reruns only that panel,
+    # not the whole page.
     col1, col2 = st.columns(2)
 
     with col1:
-        if st.button("Check Balance"):
-            st.info(f"Balance: PKR {account.balance}")
-
-        if st.button("View Transactions"):
-            transactions = account.get_transactions()
-            if transactions:
-                for t in transactions:
-                    st.write(t)
-            else:
-                st.write("No transactions found.")
-
-        if st.button("Check Loans"):
-            loans = account.get_loans()
-            if loans:
-                for idx, loan in enumerate(loans, 1):
-                    st.write(f"{idx}. {loan}")
-            else:
-                st.write("No loans taken yet.")
+        cash_panel(account, user)
+        history_panel(account)
 
     with col2:
-        with st.expander("Deposit"):
-            with st.form("deposit_form"):
-                amount = st.number_input("Amount", min_value=0.0)
-                currency = st.selectbox("Currency", ["PKR", "USD", "EUR"])
-                submitted = st.form_submit_button("Deposit")
-                if submitted:
-                    msg = account.deposit(amount, currency)
+        loan_panel(account)
+        pin_panel(user)
+
+
+@st.fragment
+def cash_panel(account, user):
+    # The balance is filled in last so it already reflects this run's form.
+    balance = st.empty()
+
+    with st.expander("Deposit"):
+        with st.form("deposit_form"):
+            amount = st.number_input("Amount", min_value=0.0, key="deposit_amount")
+            currency = st.selectbox("Currency", ["PKR", "USD", "EUR"], key="deposit_currency")
+            submitted = st.form_submit_button("Deposit")
+            key = form_key("deposit")
+            if submitted:
+                msg = account.deposit(amount, currency, idempotency_key=key)
+                st.success(msg)
+                rotate_key("deposit")
+
+    with st.expander("Withdraw"):
+        with st.form("withdraw_form"):
+            amount = st.number_input("Amount", min_value=0.0, key="withdraw_amount")
+            currency = st.selectbox("Currency", ["PKR", "USD", "EUR"], key="withdraw_currency")
+            submitted = st.form_submit_button("Withdraw")
+            key = form_key("withdraw")
+            if submitted:
+                msg = account.withdraw(amount, currency, user, idempotency_key=key)
+                if "successful" in msg:
                     st.success(msg)
+                else:
+                    st.error(msg)
+                rotate_key("withdraw")
 
-        with st.expander("Withdraw"):
-            with st.form("withdraw_form"):
-                amount = st.number_input("Amount", min_value=0.0)
-                currency = st.selectbox("Currency", ["PKR", "USD", "EUR"])
-                submitted = st.form_submit_button("Withdraw")
-                if submitted:
-                    msg = account.withdraw(amount, currency, user)
-                    if "successful" in msg:
-                        st.success(msg)
-                    else:
-                        st.error(msg)
-
-        with st.expander("Change PIN"):
-            with st.form("change_pin_form"):
-                old_pin = st.text_input("Old PIN", type="password")
-                new_pin = st.text_input("New PIN", type="password")
-                submitted = st.form_submit_button("Change PIN")
-                if submitted:
-                    success, msg = user.change_pin(old_pin, new_pin)
-                    if success:
-                        st.success(msg)
-                    else:
-                        st.error(msg)
-
-        with st.expander("Take a Loan"):
-            with st.form("loan_form"):
-                amount = st.number_input("Amount", min_value=0.0)
-                currency = st.selectbox("Currency", ["PKR", "USD", "EUR"])
-                duration_type = st.selectbox("Duration Type", ["months", "years"])
-                duration = st.number_input("Duration", min_value=1, step=1)
-                submitted = st.form_submit_button("Take Loan")
+    balance.metric("Balance (PKR)", str(account.balance))
+
+
+@st.fragment
+def history_panel(account):
+    with st.expander("Transactions"):
+        transaction_grid(account)
+
+
+def loan_label(loan):
+    # Only fields that never change, so a payment does not reset the widget.
+    return f"#{loan.loan_id} - {fmt(loan.principal)} {loan.currency} from {loan.start_date}"
+
+
+@st.fragment
+def loan_panel(account):
+    balance = st.empty()
+
+    with st.expander("Take a Loan"):
+        with st.form("loan_form"):
+            amount = st.number_input("Amount", min_value=0.0, key="loan_amount")
+            currency = st.selectbox("Currency", ["PKR", "USD", "EUR"], key="loan_currency")
+            duration_type = st.selectbox("Duration Type", ["months", "years"])
+            duration = st.number_input("Duration", min_value=1, step=1)
+            submitted = st.form_submit_button("Take Loan")
+            key = form_key("loan")
+            if submitted:
+                msg = account.take_loan(amount, currency, duration_type, duration, idempotency_key=key)
+                st.success(msg)
+                rotate_key("loan")
+
+    # Read after the form so a new loan shows up in the same run.
+    loans = account.get_loans()
+    by_id = {loan.loan_id: loan for loan in loans}
+
+    with st.expander("Pay Loan"):
+        if loans:
+            # Options are loan ids, so the selection still names the same
+            # loan if another one is paid off between render and click.
+            with st.form("pay_loan_form"):
+                loan_id = st.selectbox("Select Loan", list(by_id), format_func=lambda i: loan_label(by_id[i]))
+                amount = st.number_input("Amount to Pay", min_value=0.0, key="pay_loan_amount")
+                submitted = st.form_submit_button("Pay Loan")
+                key = form_key("pay_loan")
                 if submitted:
-                    msg = account.take_loan(amount, currency, duration_type, duration)
+                    msg = account.pay_loan(loan_id, amount, idempotency_key=key)
                     st.success(msg)
+                    rotate_key("pay_loan")
+                    loans = account.get_loans()
+        else:
+            st.write("No loans to pay.")
 
-        with st.expander("Pay Loan"):
-            loans = account.get_loans()
-            if loans:
-                loan_options = [f"{idx+1}. {str(loan)}" for idx, loan in enumerate(loans)]
-                selected_loan = st.selectbox("Select Loan", loan_options)
-                loan_index = loan_options.index(selected_loan)
-                amount = st.number_input("Amount to Pay", min_value=0.0)
-                if st.button("Pay Loan"):
-                    msg = account.pay_loan(loan_index, amount)
+    with st.expander("My Loans"):
+        if loans:
+            for loan in loans:
+                st.write(f"#{loan.loan_id}. {loan}")
+        else:
+            st.write("No loans taken yet.")
+
+    with st.expander("Repayment Schedule"):
+        if loans:
+            by_id = {loan.loan_id: loan for loan in loans}
+            loan = by_id[st.selectbox("Loan", list(by_id), format_func=lambda i: loan_label(by_id[i]),
+                                      key="schedule_loan")]
+            for number, due, payment, interest, principal, balance_left in loan.schedule():
+                st.write(f"{number}. {due} - Pay {fmt(payment)} (interest {fmt(interest)}, "
+                         f"principal {fmt(principal)}), balance {fmt(balance_left)} {loan.currency}")
+        else:
+            st.write("No loans taken yet.")
+
+    balance.caption(f"Balance: PKR {account.balance}")
+
+
+@st.fragment
+def pin_panel(user):
+    with st.expander("Change PIN"):
+        with st.form("change_pin_form"):
+            old_pin = st.text_input("Old PIN", type="password")
+            new_pin = st.text_input("New PIN", type="password")
+            submitted = st.form_submit_button("Change PIN")
+            key = form_key("change_pin")
+            if submitted:
+                success, msg = user.change_pin(old_pin, new_pin, idempotency_key=key)
+                if success:
                     st.success(msg)
-            else:
-                st.write("No loans to pay.")
+                else:
+                    st.error(msg)
+                rotate_key("change_pin")
 
 
 def admin_menu(atm):
@@ -401,26 +297,105 @@ def admin_menu(atm):
 
     with col1:
         if st.button("View Users"):
-            users = atm.get_users()
-            for uid, name in users:
+            st.session_state.users_offset = 0
+        if "users_offset" in st.session_state:
+            offset = st.session_state.users_offset
+            # One extra to tell whether there is a next page.
+            users = atm.get_users(offset, PAGE_SIZE + 1)
+            for uid, name in users[:PAGE_SIZE]:
                 st.write(f"{uid} - {name}")
+            prev_col, next_col = st.columns(2)
+            if offset and prev_col.button("Previous users"):
+                st.session_state.users_offset = max(0, offset - PAGE_SIZE)
+                st.rerun()
+            if len(users) > PAGE_SIZE and next_col.button("Next users"):
+                st.session_state.users_offset = offset + PAGE_SIZE
+                st.rerun()
 
-        if st.button("View All Transactions"):
-            all_trans = atm.get_all_transactions()
-            for uid, trans in all_trans.items():
-                st.subheader(f"Transactions for {uid}")
-                if trans:
-                    for t in trans:
-                        st.write(t)
-                else:
-                    st.write("No transactions.")
+        transaction_search(atm)
+        metrics_panel()
 
     with col2:
         with st.expander("Freeze User"):
             uid = st.text_input("User ID to Freeze")
-            if st.button("Freeze"):
-                msg = atm.freeze_user(uid)
+            submitted = st.button("Freeze")
+            key = form_key("freeze")
+            if submitted:
+                msg = atm.freeze_user(uid, idempotency_key=key)
                 st.success(msg)
+                rotate_key("freeze")
+
+        with st.expander("Loans Due Today"):
+            due = atm.loans_due()
+            if due:
+                for uid, loan in due:
+                    st.write(f"{uid} - #{loan.loan_id} due {loan.next_due} - {loan}")
+            else:
+                st.write("No loans due.")
+
+        with st.expander("Upcoming Expiries"):
+            expiries = atm.upcoming_expiries()
+            if expiries:
+                for when, label in expiries:
+                    st.write(f"{when:%Y-%m-%d %H:%M:%S} - {label}")
+            else:
+                st.write("Nothing scheduled.")
+
+
+@st.fragment
+def metrics_panel():
+    # Calls, refusals and latency per operation since the server started.
+    with st.expander("Metrics"):
+        summary = METRICS.summary()
+        if not summary:
+            st.write("No operations yet.")
+            return
+        st.dataframe([{"Operation": op, "Calls": s["calls"],
+                       "OK": s["outcomes"].get("ok", 0),
+                       "Refused": ", ".join(f"{name} {n}" for name, n in s["outcomes"].items() if name != "ok"),
+                       "p50 ms": s.get("p50_ms"), "p95 ms": s.get("p95_ms"), "p99 ms": s.get("p99_ms"),
+                       "Max ms": s.get("max_ms")} for op, s in summary.items()],
+                     hide_index=True)
+        st.button("Refresh", key="metrics_refresh")
+
+
+@st.fragment
+def transaction_search(atm):
+    with st.expander("Search Transactions"):
+        with st.form("transaction_query_form"):
+            uid = st.text_input("User ID (blank for all)")
+            kind = st.selectbox("Type", list(TRANSACTION_TYPES))
+            currency = st.selectbox("Currency", ["Any", "PKR", "USD", "EUR"])
+            dates = st.date_input("Date range", value=())
+            min_amount = st.number_input("Min amount (PKR)", min_value=0.0)
+            max_amount = st.number_input("Max amount (PKR, 0 for no limit)", min_value=0.0)
+            if st.form_submit_button("Search"):
+                start = datetime.datetime.combine(dates[0], datetime.time()) if dates else None
+                end = (datetime.datetime.combine(dates[-1], datetime.time()) + datetime.timedelta(days=1)
+                       if dates else None)
+                st.session_state.transaction_query = dict(
+                    user_id=uid.strip(), kind=TRANSACTION_TYPES[kind], start=start, end=end,
+                    currency=None if currency == "Any" else currency,
+                    min_amount=min_amount or None, max_amount=max_amount or None)
+                st.session_state.transaction_cursors = [None]
+
+        query = st.session_state.get("transaction_query")
+        if query is not None:
+            # One cursor per page seen, so the admin can page back too.
+            cursors = st.session_state.transaction_cursors
+            table, next_cursor = query_page(atm, tuple(sorted(query.items())), cursors[-1],
+                                            len(atm.transaction_index))
+            if table.empty:
+                st.write("No transactions.")
+            else:
+                st.dataframe(table, hide_index=True)
+            prev_col, next_col = st.columns(2)
+            if len(cursors) > 1 and prev_col.button("Previous page"):
+                cursors.pop()
+                st.rerun(scope="fragment")
+            if next_cursor is not None and next_col.button("Next page"):
+                cursors.append(next_cursor)
+                st.rerun(scope="fragment")
 
 
 if __name__ == "__main__":
@@ -1,299 +1,84 @@
 # ATM SIMULATION SYSTEM
-
+# Terminal front-end. The bank itself (users, accounts, loans, persistence)
+# is the headless core in bank.py, shared with the Streamlit app; this file
+# only prompts and prints. State is kept in atm_data/, the same journal and
+# snapshot the web app uses, so run one of the two at a time. A deposit,
+# withdrawal or loan is only reported once it is on disk.
+#
+# With --script it runs headless instead: JSON requests in, one per line,
+# JSON results out, for replaying a day's terminal traffic at the speed of
+# the bank rather than of the prompts (see run_script).
+#
+# Run with: python "Vibe Coding.py" [--script FILE|- [--output FILE] [--workers N]]
+
+import argparse
 import datetime
-import hashlib
-from abc import ABC, abstractmethod
-
-
-# ======================================================
-# CURRENCY CONVERTER
-# ======================================================
-class CurrencyConverter:
-    RATES_TO_PKR = {"PKR": 1, "USD": 280, "EUR": 300}
-
-    @classmethod
-    def to_pkr(cls, amount, currency):
-        currency = currency.upper()
-        if currency not in cls.RATES_TO_PKR:
-            raise ValueError("Unsupported currency.")
-        return amount * cls.RATES_TO_PKR[currency]
-
-
-# ======================================================
-# USER CLASS
-# ======================================================
-class User:
-    MAX_ATTEMPTS = 3
-    LOCK_TIME_MINUTES = 2
-
-    def __init__(self, user_id, name, pin, is_admin=False):
-        self.user_id = user_id
-        self.name = name
-        self.is_admin = is_admin
-        self.__pin_hash = self.__hash_pin(pin)
-        self.failed_attempts = 0
-        self.locked_until = None
-        self.daily_withdrawals = {"PKR": 0, "USD": 0, "EUR": 0}
-        self.last_withdrawal_date = datetime.date.today()
-
-    def __hash_pin(self, pin):
-        return hashlib.sha256(pin.encode()).hexdigest()
-
-    def is_locked(self):
-        return (
-            self.locked_until is not None
-            and datetime.datetime.now() < self.locked_until
-        )
-
-    def verify_pin(self, pin):
-        if self.is_locked():
-            print("Account is locked. Try later.")
-            return False
-        if self.__pin_hash == self.__hash_pin(pin):
-            self.failed_attempts = 0
-            return True
-        self.failed_attempts += 1
-        if self.failed_attempts >= self.MAX_ATTEMPTS:
-            self.locked_until = datetime.datetime.now() + datetime.timedelta(minutes=self.LOCK_TIME_MINUTES)
-            print("Account locked for 2 minutes.")
-        return False
-
-    def change_pin(self, old_pin, new_pin):
-        if len(new_pin) != 4 or not new_pin.isdigit():
-            print("PIN must be 4 digits.")
-            return False
-        if self.verify_pin(old_pin):
-            self.__pin_hash = self.__hash_pin(new_pin)
-            print("PIN changed successfully.")
-            return True
-        else:
-            print("Incorrect old PIN.")
-            return False
-
-    def reset_daily_withdrawals(self):
-        if self.last_withdrawal_date != datetime.date.today():
-            self.daily_withdrawals = {"PKR": 0, "USD": 0, "EUR": 0}
-            self.last_withdrawal_date = datetime.date.today()
-
-
-# ======================================================
-# LOAN CLASS
-# ======================================================
-class Loan:
-    def __init__(self, principal, currency, duration_years, start_date, interest_rate=0.03):
-        self.principal = principal
-        self.currency = currency
-        self.duration_years = duration_years
-        self.start_date = start_date
-        self.interest_rate = interest_rate
-        self.remaining_amount = principal * (1 + interest_rate * duration_years)
-
-    def __str__(self):
-        return (f"Loan: {self.principal} {self.currency}, "
-                f"Duration: {self.duration_years:.2f} years, "
-                f"Remaining: {self.remaining_amount:.2f} {self.currency}")
-
-
-# ======================================================
-# ABSTRACT ACCOUNT CLASS
-# ======================================================
-class Account(ABC):
-    DAILY_LIMITS = {"PKR": 20000, "USD": 500, "EUR": 600}
-
-    def __init__(self, balance_pkr):
-        self._balance_pkr = balance_pkr
-        self.transactions = []
-        self.loans = []
-
-    @property
-    def balance(self):
-        return self._balance_pkr
-
-    def _log_transaction(self, message):
-        timestamp = datetime.datetime.now()
-        self.transactions.append(f"{timestamp} - {message}")
-
-    def deposit(self):
-        try:
-            amount = float(input("Enter deposit amount: "))
-            if amount <= 0:
-                print("Deposit amount must be positive.")
-                return
-            currency = input("Enter currency (PKR/USD/EUR): ").upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            self._balance_pkr += amount_pkr
-            self._log_transaction(f"Deposited {amount} {currency} (PKR {amount_pkr})")
-            print(f"Deposit successful. PKR {amount_pkr} added.")
-        except ValueError:
-            print("Invalid input or unsupported currency.")
-
-    @abstractmethod
-    def withdraw(self, user: User):
-        pass
-
-    def take_loan(self):
-        try:
-            amount = float(input("Enter loan amount: "))
-            if amount <= 0:
-                print("Loan amount must be positive.")
-                return
-            currency = input("Enter currency (PKR/USD/EUR): ").upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            duration_type = input("Duration type (months/years): ").lower()
-            duration = int(input(f"Enter number of {duration_type}: "))
-            if duration <= 0:
-                print("Duration must be positive.")
-                return
-            years = duration / 12 if duration_type == "months" else duration
-            interest = amount_pkr * 0.03 * years
-
-            # Create loan
-            loan = Loan(principal=amount, currency=currency, duration_years=years,
-                        start_date=datetime.date.today())
-            self.loans.append(loan)
-            self._balance_pkr += amount_pkr
-            self._log_transaction(f"Loan taken: {amount} {currency} (PKR {amount_pkr}), Duration: {duration} {duration_type}, Interest: PKR {interest:.2f}")
-            print(f"Loan granted! PKR {amount_pkr} added. Interest: PKR {interest:.2f}")
-        except ValueError:
-            print("Invalid input.")
-
-    def check_loans(self):
-        if not self.loans:
-            print("No loans taken yet.")
-        else:
-            print("Current loans:")
-            for idx, loan in enumerate(self.loans, 1):
-                print(f"{idx}. {loan}")
-
-    def pay_loan(self):
-        if not self.loans:
-            print("No loans to pay.")
-            return
-        self.check_loans()
-        try:
-            choice = int(input("Select loan number to pay: "))
-            if choice < 1 or choice > len(self.loans):
-                print("Invalid choice.")
-                return
-            loan = self.loans[choice - 1]
-            amount = float(input(f"Enter amount to pay in {loan.currency}: "))
-            if amount <= 0:
-                print("Amount must be positive.")
-                return
-            amount_pkr = CurrencyConverter.to_pkr(amount, loan.currency)
-            if amount_pkr > self._balance_pkr:
-                print("Insufficient balance to pay this amount.")
-                return
-            if amount > loan.remaining_amount:
-                amount = loan.remaining_amount
-                amount_pkr = CurrencyConverter.to_pkr(amount, loan.currency)
-            self._balance_pkr -= amount_pkr
-            loan.remaining_amount -= amount
-            self._log_transaction(f"Loan payment: {amount} {loan.currency} (PKR {amount_pkr})")
-            print(f"Payment successful. Remaining loan: {loan.remaining_amount:.2f} {loan.currency}")
-            if loan.remaining_amount <= 0:
-                print("Loan fully paid!")
-                self.loans.remove(loan)
-        except ValueError:
-            print("Invalid input.")
-
-
-# ======================================================
-# SAVINGS ACCOUNT
-# ======================================================
-class SavingsAccount(Account):
-    MIN_BALANCE_PKR = 1000
-
-    def withdraw(self, user: User):
+import json
+import sys
+import time
+from collections import deque
+from bank import ATM, User, SavingsAccount, CurrentAccount, CurrencyConverter, METRICS
+from idempotency import KeyReused
+from journal import JournalStorage
+from metrics import serve as serve_metrics
+from transaction_log import DEPOSIT, WITHDRAWAL, LOAN_TAKEN, LOAN_PAYMENT
+from rates import RateService
+from service import ATMService, RequestError, Session, field
+
+
+DATA_DIR = "atm_data"
+RATES_PATH = "rates.json"
+RATES_HISTORY_PATH = "rates_history.jsonl"
+TRANSACTION_TYPES = {"": None, "deposit": DEPOSIT, "withdrawal": WITHDRAWAL,
+                     "loan": LOAN_TAKEN, "payment": LOAN_PAYMENT}
+PAGE_SIZE = 10
+SCRIPT_WINDOW = 64   # scripted requests in flight per worker
+METRICS_PORT = 9108   # Prometheus scrape endpoint on localhost; None turns it off
+
+
+def open_atm():
+    CurrencyConverter.rates = RateService(RATES_PATH, RATES_HISTORY_PATH)
+    CurrencyConverter.rates.watch(User.scheduler)
+    atm = ATM.from_storage(JournalStorage(DATA_DIR))
+    if not atm.users:
+        # Admin
+        atm.add_user(User("admin", "Bank Admin", "9999", is_admin=True), None)
+        # Users
+        atm.add_user(User("101", "Anzar", "1234"), SavingsAccount(10000))
+        atm.add_user(User("102", "Ali", "4321"), CurrentAccount(20000))
+    if METRICS_PORT:
         try:
-            amount = float(input("Enter withdrawal amount: "))
-            if amount <= 0:
-                print("Withdrawal must be positive.")
-                return
-            currency = input("Enter currency (PKR/USD/EUR): ").upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            user.reset_daily_withdrawals()
-
-            if user.daily_withdrawals[currency] + amount > Account.DAILY_LIMITS[currency]:
-                print(f"Daily withdrawal limit exceeded for {currency}.")
-                return
-            if self._balance_pkr - amount_pkr < self.MIN_BALANCE_PKR:
-                print("Minimum balance requirement not met.")
-                return
-
-            self._balance_pkr -= amount_pkr
-            user.daily_withdrawals[currency] += amount
-            self._log_transaction(f"Withdrew {amount} {currency} (PKR {amount_pkr})")
-            print(f"Withdrawal successful. PKR {amount_pkr} deducted.")
-        except ValueError:
-            print("Invalid input.")
-
-
-# ======================================================
-# CURRENT ACCOUNT
-# ======================================================
-class CurrentAccount(Account):
-    def withdraw(self, user: User):
-        try:
-            amount = float(input("Enter withdrawal amount: "))
-            if amount <= 0:
-                print("Withdrawal must be positive.")
-                return
-            currency = input("Enter currency (PKR/USD/EUR): ").upper()
-            amount_pkr = CurrencyConverter.to_pkr(amount, currency)
-            user.reset_daily_withdrawals()
-
-            if user.daily_withdrawals[currency] + amount > Account.DAILY_LIMITS[currency]:
-                print(f"Daily withdrawal limit exceeded for {currency}.")
-                return
-            if self._balance_pkr - amount_pkr < 0:
-                print("Insufficient balance.")
-                return
-
-            self._balance_pkr -= amount_pkr
-            user.daily_withdrawals[currency] += amount
-            self._log_transaction(f"Withdrew {amount} {currency} (PKR {amount_pkr})")
-            print(f"Withdrawal successful. PKR {amount_pkr} deducted.")
-        except ValueError:
-            print("Invalid input.")
-
-
-# ======================================================
-# ATM CLASS
-# ======================================================
-class ATM:
-    def __init__(self):
-        self.users = {}
-        self.accounts = {}
-
-    def add_user(self, user: User, account: Account):
-        self.users[user.user_id] = user
-        self.accounts[user.user_id] = account
-
-    def login(self):
-        print("\nType 'exit' to close the ATM.")
-        user_id = input("User ID: ").strip()
-        if user_id.lower() == "exit":
-            print("Thank you for using the ATM.")
-            exit()
-        if user_id not in self.users:
-            print("User not found.")
-            return
-        user = self.users[user_id]
-        pin = input("PIN: ")
-        if not user.verify_pin(pin):
-            print("Login failed.")
-            return
-        if user.is_admin:
-            self.admin_menu()
-        else:
-            self.user_menu(user)
-
-    # ---------------- USER MENU ----------------
-    def user_menu(self, user: User):
-        account = self.accounts[user.user_id]
-        while True:
-            print(f"""
+            serve_metrics(METRICS, port=METRICS_PORT)
+        except OSError:
+            pass  # port taken, e.g. by the web app
+    return atm
+
+
+def login(atm):
+    print("\nType 'exit' to close the ATM.")
+    user_id = input("User ID: ").strip()
+    if user_id.lower() == "exit":
+        print("Thank you for using the ATM.")
+        raise SystemExit
+    if user_id not in atm.users:
+        print("User not found.")
+        return
+    pin = input("PIN: ")
+    user, msg = atm.login(user_id, pin)
+    if user is None:
+        print(msg)
+        return
+    if user.is_admin:
+        admin_menu(atm)
+    else:
+        user_menu(atm, user)
+
+
+# ---------------- USER MENU ----------------
+def user_menu(atm, user):
+    account = atm.accounts[user.user_id]
+    while True:
+        print(f"""
 Welcome {user.name}
 1. Check Balance (PKR)
 2. Deposit
@@ -305,88 +90,310 @@ Welcome {user.name}
 8. Pay Loan
 9. Logout
 """)
-            choice = input("Select option: ")
-
-            if choice == "1":
-                print(f"Balance: PKR {account.balance}")
-            elif choice == "2":
-                account.deposit()
-            elif choice == "3":
-                account.withdraw(user)
-            elif choice == "4":
-                if account.transactions:
-                    for t in account.transactions[-10:]:
-                        print(t)
-                else:
-                    print("No transactions found.")
-            elif choice == "5":
-                old_pin = input("Enter old PIN: ")
-                new_pin = input("Enter new PIN: ")
-                user.change_pin(old_pin, new_pin)
-            elif choice == "6":
-                account.take_loan()
-            elif choice == "7":
-                account.check_loans()
-            elif choice == "8":
-                account.pay_loan()
-            elif choice == "9":
-                print("Logged out.")
-                break
+        choice = input("Select option: ")
+
+        if choice == "1":
+            print(f"Balance: PKR {account.balance}")
+        elif choice == "2":
+            amount = input("Enter deposit amount: ")
+            currency = input("Enter currency (PKR/USD/EUR): ")
+            print(account.deposit(amount, currency))
+        elif choice == "3":
+            amount = input("Enter withdrawal amount: ")
+            currency = input("Enter currency (PKR/USD/EUR): ")
+            print(account.withdraw(amount, currency, user))
+        elif choice == "4":
+            transactions = account.get_transactions()
+            if transactions:
+                for t in transactions:
+                    print(t)
             else:
-                print("Invalid choice.")
-
-    # ---------------- ADMIN MENU ----------------
-    def admin_menu(self):
-        while True:
-            print("""
+                print("No transactions found.")
+        elif choice == "5":
+            old_pin = input("Enter old PIN: ")
+            new_pin = input("Enter new PIN: ")
+            print(user.change_pin(old_pin, new_pin)[1])
+        elif choice == "6":
+            take_loan(account)
+        elif choice == "7":
+            check_loans(account)
+        elif choice == "8":
+            pay_loan(account)
+        elif choice == "9":
+            print("Logged out.")
+            break
+        else:
+            print("Invalid choice.")
+
+
+def take_loan(account):
+    amount = input("Enter loan amount: ")
+    currency = input("Enter currency (PKR/USD/EUR): ")
+    duration_type = input("Duration type (months/years): ").lower()
+    try:
+        duration = int(input(f"Enter number of {duration_type}: "))
+    except ValueError:
+        print("Invalid input.")
+        return
+    print(account.take_loan(amount, currency, duration_type, duration))
+
+
+def check_loans(account):
+    loans = account.get_loans()
+    if not loans:
+        print("No loans taken yet.")
+        return
+    print("Current loans:")
+    for loan in loans:
+        print(f"#{loan.loan_id}. {loan}")
+
+
+def pay_loan(account):
+    if not account.get_loans():
+        print("No loans to pay.")
+        return
+    check_loans(account)
+    try:
+        loan_id = int(input("Select loan number to pay: ").lstrip("#"))
+    except ValueError:
+        print("Invalid choice.")
+        return
+    amount = input("Enter amount to pay: ")
+    print(account.pay_loan(loan_id, amount))
+
+
+# ---------------- ADMIN MENU ----------------
+def admin_menu(atm):
+    while True:
+        print("""
 ADMIN PANEL
 1. View Users
-2. View Transactions (including loans)
+2. Search Transactions
 3. Freeze User
-4. Logout
+4. Loans Due Today
+5. Metrics
+6. Logout
 """)
-            choice = input("Select option: ")
-            if choice == "1":
-                for u in self.users.values():
-                    print(u.user_id, "-", u.name)
-            elif choice == "2":
-                for uid, account in self.accounts.items():
-                    print(f"\nTransactions for {self.users[uid].name} (UserID: {uid}):")
-                    if account and account.transactions:
-                        for t in account.transactions[-10:]:
-                            print(t)
-                    else:
-                        print("No transactions found.")
-            elif choice == "3":
-                uid = input("User ID to freeze: ")
-                if uid in self.users:
-                    self.users[uid].locked_until = datetime.datetime.now() + datetime.timedelta(days=365)
-                    print("User account frozen.")
-                else:
-                    print("User not found.")
-            elif choice == "4":
+        choice = input("Select option: ")
+        if choice == "1":
+            offset = 0
+            while True:
+                # One extra to tell whether there is a next page.
+                users = atm.get_users(offset, PAGE_SIZE + 1)
+                for uid, name in users[:PAGE_SIZE]:
+                    print(uid, "-", name)
+                offset += PAGE_SIZE
+                if len(users) <= PAGE_SIZE or input("Next page? (y/n): ").strip().lower() != "y":
+                    break
+        elif choice == "2":
+            search_transactions(atm)
+        elif choice == "3":
+            uid = input("User ID to freeze: ")
+            print(atm.freeze_user(uid))
+        elif choice == "4":
+            due = atm.loans_due()
+            if due:
+                for uid, loan in due:
+                    print(f"{uid} - #{loan.loan_id} due {loan.next_due} - {loan}")
+            else:
+                print("No loans due.")
+        elif choice == "5":
+            print_metrics()
+        elif choice == "6":
+            break
+        else:
+            print("Invalid option.")
+
+
+def print_metrics():
+    # Calls, refusals and latency per operation since the ATM was opened.
+    summary = METRICS.summary()
+    if not summary:
+        print("No operations yet.")
+        return
+    print(f"{'operation':<22} {'calls':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  outcomes")
+    for op, s in summary.items():
+        outcomes = ", ".join(f"{name} {n}" for name, n in s["outcomes"].items())
+        if "p50_ms" in s:
+            print(f"{op:<22} {s['calls']:>7} {s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f} "
+                  f"{s['max_ms']:>8.2f}  {outcomes}")
+        else:
+            print(f"{op:<22} {s['calls']:>7} {'':>35}  {outcomes}")
+
+
+def search_transactions(atm):
+    # Blank answers match everything; results come newest first, a page at
+    # a time, through the bank-wide transaction index.
+    try:
+        uid = input("User ID (blank for all): ").strip()
+        start = read_date("From date (YYYY-MM-DD, blank for any): ")
+        end = read_date("To date (YYYY-MM-DD, blank for any): ")
+        kind = TRANSACTION_TYPES[input("Type (deposit/withdrawal/loan/payment, blank for any): ").strip().lower()]
+        currency = input("Currency (PKR/USD/EUR, blank for any): ").strip().upper() or None
+        min_amount = input("Min amount (PKR, blank for none): ").strip() or None
+        max_amount = input("Max amount (PKR, blank for none): ").strip() or None
+        cursor = None
+        while True:
+            hits, cursor = atm.query_transactions(
+                user_id=uid, start=start, end=end + datetime.timedelta(days=1) if end else None, kind=kind,
+                currency=currency, min_amount=min_amount, max_amount=max_amount, cursor=cursor, limit=PAGE_SIZE)
+            if not hits:
+                print("No transactions.")
+            for owner, t in hits:
+                print(f"{owner}: {t}")
+            if cursor is None or input("Next page? (y/n): ").strip().lower() != "y":
                 break
+    except (KeyError, ValueError):
+        print("Invalid input.")
+
+
+def read_date(prompt):
+    text = input(prompt).strip()
+    return datetime.datetime.strptime(text, "%Y-%m-%d") if text else None
+
+
+# ======================================================
+# SCRIPTED MODE
+# ======================================================
+def run_script(atm, source, out, workers=1, interactive=False):
+    # One JSON request per line of source, one JSON response per line of
+    # out, in the same order. Requests are those of the terminal service
+    # (service.py), with the customer's user_id in place of a session
+    # token: a script is trusted like a settlement batch, so no PIN is
+    # needed, though "login" still checks one as a replayed terminal would.
+    # Admin operations take no acting user.
+    #
+    # With one worker requests run strictly in order. With more, different
+    # customers' requests run concurrently and share fsyncs; each
+    # customer's still run in order, and a request without a user_id waits
+    # for everything before it. New loans may then be numbered in a
+    # different order than a one-worker run would number them.
+    # Interactive runs answer each line before reading the next.
+    # Returns (requests, ok).
+    service = ATMService(atm, workers)
+    window = 1 if interactive else workers * SCRIPT_WINDOW
+    pending = deque()   # futures of responses, in input order
+    last = {}           # user_id -> future of their latest request
+    barrier = None      # future of the latest request without a user_id
+    requests = ok = 0
+    try:
+        for line in source:
+            if not line.strip():
+                continue
+            requests += 1
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError
+                # user_id orders each customer's requests below, so it must
+                # be a string, or absent for admin and bank-wide operations.
+                user_id = request.get("user_id")
+                if user_id is not None and not isinstance(user_id, str):
+                    raise ValueError
+            except ValueError:
+                request = None
+            user_id = request.get("user_id") if request else None
+            if request is not None and user_id is None:
+                after = [f for f in (barrier, *last.values()) if f is not None]
             else:
-                print("Invalid option.")
+                after = [f for f in (barrier, last.get(user_id)) if f is not None]
+            future = service.executor.submit(script_request, atm, service, request, after)
+            if request is not None and user_id is None:
+                barrier = future
+                last.clear()
+            elif request is not None:
+                last[user_id] = future
+            pending.append(future)
+            while pending and (pending[0].done() or len(pending) >= window):
+                ok += write_response(out, pending.popleft().result(), interactive)
+        while pending:
+            ok += write_response(out, pending.popleft().result(), interactive)
+    finally:
+        service.executor.shutdown()
+    out.flush()
+    return requests, ok
+
+
+def script_request(atm, service, request, after):
+    # Runs in a worker once the requests it must follow are done; those
+    # were submitted earlier, so they are already running or finished.
+    for future in after:
+        future.result()
+    if request is None:
+        return {"ok": False, "error": "Malformed request."}
+    response = {"id": request.get("id")} if "id" in request else {}
+    try:
+        op = request.get("op")
+        if op == "login":
+            user, msg = atm.login(field(request, "user_id"), field(request, "pin"))
+            if user is None:
+                raise RequestError(msg)
+            result = {"name": user.name, "is_admin": user.is_admin}
+        elif op == "logout":
+            result = {}
+        else:
+            try:
+                handler, needs_session, admin_only = service.operations[op]
+            except (KeyError, TypeError):
+                raise RequestError("Unknown operation.") from None
+            session = None
+            if needs_session and not admin_only:
+                user = atm.users.get(field(request, "user_id"))
+                if user is None:
+                    raise RequestError("User not found.")
+                session = Session(user.user_id, user.is_admin)
+            result = handler(session, request)
+        response.update(ok=True, **result)
+    except (RequestError, KeyReused) as e:
+        response.update(ok=False, error=str(e))
+    except Exception:
+        response.update(ok=False, error="Internal error.")
+    return response
+
+
+def write_response(out, response, flush):
+    out.write(json.dumps(response) + "\n")
+    if flush:
+        out.flush()
+    return response["ok"]
+
+
+def script_mode(args):
+    atm = open_atm()
+    source = sys.stdin if args.script == "-" else open(args.script, encoding="utf-8")
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        requests, ok = run_script(atm, source, out, args.workers, interactive=source.isatty())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+        atm.close()
+    elapsed = time.perf_counter() - start
+    print(f"{requests:,} requests ({requests - ok:,} failed) in {elapsed:.2f} s, "
+          f"{requests / elapsed if elapsed else 0:,.0f}/s", file=sys.stderr)
 
 
 # ======================================================
 # MAIN
 # ======================================================
 if __name__ == "__main__":
-    atm = ATM()
+    parser = argparse.ArgumentParser(description="ATM terminal")
+    parser.add_argument("--script", help="run JSON-lines requests from this file (- for stdin) instead of prompting")
+    parser.add_argument("--output", help="write scripted results here instead of stdout")
+    parser.add_argument("--workers", type=int, default=1, help="scripted requests run at once")
+    args = parser.parse_args()
+    if args.script:
+        script_mode(args)
+        raise SystemExit
 
-    # Admin
-    atm.add_user(User("admin", "Bank Admin", "9999", is_admin=True), None)
-
-    # Users
-    atm.add_user(User("101", "Anzar", "1234"), SavingsAccount(10000))
-    atm.add_user(User("102", "Ali", "4321"), CurrentAccount(20000))
+    atm = open_atm()
 
     while True:
         try:
-            atm.login()
+            login(atm)
         except KeyboardInterrupt:
             print("\nATM session closed safely.")
             break
-
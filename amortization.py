@@ -0,0 +1,103 @@
+# AMORTIZATION
+# Equal-installment repayment schedules with monthly compounding, and the
+# nightly interest accrual that runs over every outstanding loan at once.
+# Amounts are integer minor units; interest is rounded to the nearest minor
+# unit with ties to even, like the rest of the ledger.
+
+import datetime
+from decimal import Decimal
+
+from money import scale
+
+
+def monthly_rate(annual_rate):
+    return Decimal(str(annual_rate)) / 12
+
+
+def installment(principal, annual_rate, months):
+    # principal * r / (1 - (1 + r)^-n), rounded; r = 0 spreads principal evenly.
+    r = monthly_rate(annual_rate)
+    if not r:
+        return -(-principal // months)
+    return scale(principal, r / (1 - (1 + r) ** -months))
+
+
+# ======================================================
+# SCHEDULE
+# ======================================================
+def schedule(principal, annual_rate, months, start_date):
+    # Yields (number, due_date, payment, interest, principal_paid, balance)
+    # one installment at a time. The last installment clears whatever is
+    # left after rounding.
+    from loans import add_months
+    r = monthly_rate(annual_rate)
+    payment = installment(principal, annual_rate, months)
+    balance = principal
+    for number in range(1, months + 1):
+        interest = scale(balance, r)
+        paid = balance if number == months else min(payment - interest, balance)
+        balance -= paid
+        yield number, add_months(start_date, number), paid + interest, interest, paid, balance
+
+
+def total_interest(principal, annual_rate, months, start_date):
+    return sum(row[3] for row in schedule(principal, annual_rate, months, start_date))
+
+
+# ======================================================
+# NIGHTLY ACCRUAL (NumPy)
+# ======================================================
+EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+
+def epoch_day(date):
+    return date.toordinal() - EPOCH
+
+
+def from_epoch_day(day):
+    return datetime.date.fromordinal(int(day) + EPOCH)
+
+
+def anniversaries(start, months):
+    # Vectorized add_months over epoch days: start + months, day clamped to
+    # the end of shorter months.
+    import numpy as np
+    start = np.asarray(start).astype("datetime64[D]")
+    first_of_month = start.astype("datetime64[M]")
+    day = start - first_of_month.astype("datetime64[D]")
+    target = first_of_month + np.asarray(months).astype("timedelta64[M]")
+    last_day = (target + 1).astype("datetime64[D]") - target.astype("datetime64[D]") - 1
+    return (target.astype("datetime64[D]") + np.minimum(day, last_day)).astype("int64")
+
+
+def accrue(balance, accrued, rate, start, through_day, periods, live, until):
+    # Brings every live loan's interest up to epoch day `until`, in place.
+    #   balance, accrued: int64 minor units
+    #   rate: float64 annual rate
+    #   start, through_day: int64 epoch days (loan start, accrued up to)
+    #   periods: int64 months already compounded
+    #   live: bool mask of outstanding loans
+    # `accrued` is the interest earned so far in the current month at rate /
+    # 365 per day; it is recomputed from the start of the month rather than
+    # added to nightly, so one catch-up run gives the same result as many
+    # nightly ones. On each monthly anniversary balance * rate / 12 is
+    # compounded into the balance, which matches schedule(). Each pass of the
+    # loop handles one anniversary, so a nightly run is a single pass and a
+    # catch-up after downtime takes one pass per missed month. Returns the
+    # mask of rows that changed.
+    import numpy as np
+    changed = live & (through_day < until)
+    pending = changed.copy()
+    while pending.any():
+        period_start = anniversaries(start, periods)
+        next_period = anniversaries(start, periods + 1)
+        end = np.minimum(next_period, until)
+        interest = np.rint(np.round(balance * rate * (end - period_start) / 365, 6)).astype("int64")
+        accrued[pending] = interest[pending]
+        through_day[pending] = end[pending]
+        compound = pending & (next_period <= until)
+        balance[compound] += np.rint(np.round(balance[compound] * rate[compound] / 12, 6)).astype("int64")
+        accrued[compound] = 0
+        periods[compound] += 1
+        pending = compound & (through_day < until)
+    return changed
@@ -0,0 +1,1001 @@
+# BANK
+# The ATM domain model: users, accounts, loans and the ATM that holds them,
+# with nothing to do with any front-end. GUI.py (Streamlit) and
+# Vibe Coding.py (the terminal) are both built on it, and batch jobs, the
+# bulk importer and benchmarks import it directly without paying for
+# Streamlit. Optional pieces (NumPy settlement, the importer, SQLite and the
+# PIN hashing worker pool) are only imported when used. Every operation is
+# counted and timed in METRICS (see metrics.py), and mutating calls take an
+# idempotency_key so a retried request is not applied twice (idempotency.py).
+
+import atexit
+import contextlib
+import datetime
+import functools
+import itertools
+import struct
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from array import array
+from transaction_log import (
+    TransactionLog, RECORD, DEPOSIT, WITHDRAWAL, LOAN_TAKEN, LOAN_PAYMENT, NO_LOAN, CURRENCIES, CURRENCY_CODES
+)
+from storage import Storage, loan_row
+import journal
+from residency import Residency, Evicted
+from snapshot import encode_user
+from pin_hashing import PinHasher
+from scheduler import Scheduler
+from money import Money, MAX_BALANCE, to_minor, fmt, checked
+from rates import RateService
+from loans import LoanRegistry, add_months
+from transaction_index import TransactionIndex
+import amortization
+from metrics import Metrics, outcome, reason, OK, ERROR
+from idempotency import IdempotencyCache, fingerprint
+
+
+# ======================================================
+# LOCKING
+# ======================================================
+def synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def durable(method):
+    # The result (the message shown to the customer) is only returned once
+    # what the call wrote is on disk. Goes outside @synchronized so the lock
+    # is not held while waiting, and concurrent calls share one commit.
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.storage.sync()
+        return result
+    return wrapper
+
+
+# ======================================================
+# IDEMPOTENCY
+# ======================================================
+IDEMPOTENCY = IdempotencyCache()
+
+
+def idempotent(scope):
+    # Adds an idempotency_key keyword: a repeat of a key within the cache's
+    # TTL returns the first call's result without running it again, and one
+    # with different arguments raises KeyReused. Keys are per customer (the
+    # `scope` attribute; None for bank-wide calls) and per method, so two
+    # customers' keys never collide and a deposit's key cannot answer a
+    # withdrawal. Goes outside @durable, so a repeat waiting on the first
+    # call returns once that is on disk, and outside @instrumented, so a
+    # repeat is not counted as an operation (IDEMPOTENCY.replays counts them).
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, idempotency_key=None, **kwargs):
+            if idempotency_key is None:
+                return method(self, *args, **kwargs)
+            key = (getattr(self, scope) if scope else None, method.__qualname__, idempotency_key)
+            return IDEMPOTENCY.run(key, lambda: method(self, *args, **kwargs), fingerprint(args, kwargs))
+        return wrapper
+    return decorate
+
+
+# ======================================================
+# INSTRUMENTATION
+# ======================================================
+METRICS = Metrics()
+
+
+def instrumented(name):
+    # Counts each call by outcome and records its latency under `name`.
+    # Goes outside @durable, so the time includes waiting for the disk.
+    operation = METRICS.operation(name)
+    clock = time.perf_counter_ns
+
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return method(*args, **kwargs)
+            start = clock()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException:
+                operation.observe(ERROR, clock() - start)
+                raise
+            operation.observe(outcome(result), clock() - start)
+            return result
+        return wrapper
+    return decorate
+
+
+# ======================================================
+# CURRENCY CONVERTER
+# ======================================================
+class CurrencyConverter:
+    # Versioned rate tables; front-ends replace this with a file-backed service.
+    rates = RateService()
+
+    @classmethod
+    def current(cls):
+        # Callers that convert more than once take one table and keep it, so
+        # a reload in between cannot mix two versions in one operation.
+        return cls.rates.current()
+
+    @classmethod
+    def to_pkr(cls, amount, currency):
+        # amount and result are in minor units (cents -> paisa).
+        return cls.current().to_pkr(amount, currency)
+
+
+# ======================================================
+# USER CLASS
+# ======================================================
+class User:
+    MAX_ATTEMPTS = 3
+    LOCK_TIME_MINUTES = 2
+    pin_hasher = PinHasher()
+    default_storage = Storage()  # until registered with an ATM
+    scheduler = Scheduler()
+    # Advanced by a scheduled event at midnight; withdrawals made on an older
+    # business day no longer count towards the daily limit.
+    business_day = datetime.date.today().toordinal()
+    _rollover_timer = None
+    # Millions of users can be resident, so no per-instance __dict__.
+    __slots__ = ("user_id", "name", "is_admin", "__pin_hash", "failed_attempts", "locked", "locked_until",
+                 "lock_reason", "_unlock_timer", "daily_withdrawals", "last_withdrawal_day", "_lock", "storage")
+
+    def __init__(self, user_id, name, pin, is_admin=False):
+        self.user_id = user_id
+        self.name = name
+        self.is_admin = is_admin
+        self.storage = self.default_storage
+        self.__pin_hash = self.__hash_pin(pin) if pin is not None else None
+        self.failed_attempts = 0
+        self.locked = False
+        self.locked_until = None
+        self.lock_reason = None
+        self._unlock_timer = None
+        # Minor units withdrawn today, indexed like CURRENCIES.
+        self.daily_withdrawals = array("q", [0]) * len(CURRENCIES)
+        self.last_withdrawal_day = User.business_day
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_record(cls, user_id, name, pin_hash, is_admin=False, locked_until=None, lock_reason=None):
+        user = cls(user_id, name, None, bool(is_admin))
+        user.restore(name, pin_hash, is_admin, locked_until, lock_reason)
+        return user
+
+    @synchronized
+    def restore(self, name, pin_hash, is_admin=False, locked_until=None, lock_reason=None):
+        # Applies a stored user record to this object.
+        self.name = name
+        self.is_admin = bool(is_admin)
+        self.__pin_hash = pin_hash
+        until = datetime.datetime.fromisoformat(locked_until) if locked_until else None
+        if until and until > datetime.datetime.now():
+            self.lock_until(until, lock_reason or "locked")
+        elif self.locked:
+            self.scheduler.cancel(self._unlock_timer)
+            self.locked = False
+            self.locked_until = self.lock_reason = self._unlock_timer = None
+
+    @classmethod
+    def schedule_daily_reset(cls):
+        if cls._rollover_timer is not None:
+            return
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        midnight = datetime.datetime.combine(tomorrow, datetime.time())
+        cls._rollover_timer = cls.scheduler.call_at(midnight, cls._roll_business_day, label="daily limits reset")
+
+    @classmethod
+    def _roll_business_day(cls):
+        cls.business_day = datetime.date.today().toordinal()
+        cls._rollover_timer = None
+        cls.schedule_daily_reset()
+
+    def __hash_pin(self, pin):
+        return self.pin_hasher.hash(pin)
+
+    def __check_pin(self, pin):
+        matches, needs_rehash = self.pin_hasher.verify(pin, self.__pin_hash)
+        if needs_rehash:
+            # Transparently move old-format or outdated hashes to the
+            # current algorithm and cost.
+            self.__pin_hash = self.__hash_pin(pin)
+            self.storage.save_user(self)
+        return matches
+
+    @property
+    def pin_hash(self):
+        return self.__pin_hash
+
+    def is_locked(self):
+        return self.locked
+
+    @synchronized
+    def lock_until(self, until, reason="locked"):
+        if self._unlock_timer is not None:
+            self.scheduler.cancel(self._unlock_timer)
+        self.locked = True
+        self.locked_until = until
+        self.lock_reason = reason
+        self._unlock_timer = self.scheduler.call_at(until, self._expire_lock, label=f"{self.user_id} {reason}")
+
+    @synchronized
+    def _expire_lock(self):
+        self.locked = False
+        self.locked_until = self.lock_reason = None
+        self._unlock_timer = None
+        self.storage.save_user(self)
+
+    @synchronized
+    def verify_pin(self, pin):
+        if self.is_locked():
+            return False, "Account is locked. Try later."
+        if self.__check_pin(pin):
+            self.failed_attempts = 0
+            return True, ""
+        self.failed_attempts += 1
+        if self.failed_attempts >= self.MAX_ATTEMPTS:
+            self.lock_until(datetime.datetime.now() + datetime.timedelta(minutes=self.LOCK_TIME_MINUTES))
+            self.storage.save_user(self)
+            return False, "Account locked for 2 minutes."
+        return False, "Incorrect PIN."
+
+    @idempotent("user_id")
+    @instrumented("change_pin")
+    @synchronized
+    def change_pin(self, old_pin, new_pin):
+        if len(new_pin) != 4 or not new_pin.isdigit():
+            return False, "PIN must be 4 digits."
+        success, msg = self.verify_pin(old_pin)
+        if success:
+            self.__pin_hash = self.__hash_pin(new_pin)
+            self.storage.save_user(self)
+            return True, "PIN changed successfully."
+        else:
+            return False, msg
+
+    @synchronized
+    def reset_daily_withdrawals(self):
+        if self.last_withdrawal_day != User.business_day:
+            self.daily_withdrawals = array("q", [0]) * len(CURRENCIES)
+            self.last_withdrawal_day = User.business_day
+
+
+# ======================================================
+# LOAN CLASS
+# ======================================================
+class Loan:
+    _ids = itertools.count(1)
+    ANNUAL_RATE = 0.03
+
+    # principal and remaining_amount are minor units of the loan currency.
+    def __init__(self, principal, currency, duration_years, start_date, interest_rate=None):
+        self.loan_id = next(Loan._ids)
+        self.principal = principal
+        self.currency = currency
+        self.duration_years = duration_years
+        self.start_date = start_date
+        self.interest_rate = self.ANNUAL_RATE if interest_rate is None else interest_rate
+        # Interest is added by the nightly accrual, compounding monthly. Once
+        # the loan is in a LoanRegistry these values live in its columns.
+        self._registry = self._row = None
+        self._remaining = principal
+        self._accrued = 0
+        self._through = start_date
+        # Installments fall on the monthly anniversary of start_date.
+        self.next_due = self.due_after(start_date)
+
+    @classmethod
+    def from_record(cls, loan_id, principal, currency, duration_years, start_date, interest_rate, remaining_amount,
+                    next_due, accrued_interest, accrued_through):
+        loan = cls(principal, currency, duration_years, datetime.date.fromisoformat(start_date), interest_rate)
+        loan.loan_id = loan_id
+        loan._remaining = remaining_amount
+        loan._accrued = accrued_interest
+        loan._through = datetime.date.fromisoformat(accrued_through)
+        loan.next_due = datetime.date.fromisoformat(next_due)
+        return loan
+
+    @property
+    def remaining_amount(self):
+        return self._registry.balance(self._row) if self._registry else self._remaining
+
+    @remaining_amount.setter
+    def remaining_amount(self, value):
+        if self._registry:
+            self._registry.set_balance(self._row, value)
+        else:
+            self._remaining = value
+
+    @property
+    def accrued_interest(self):
+        return self._registry.accrued(self._row) if self._registry else self._accrued
+
+    @property
+    def accrued_through(self):
+        return self._registry.accrued_through(self._row) if self._registry else self._through
+
+    @property
+    def installment(self):
+        return amortization.installment(self.principal, self.interest_rate, self.months)
+
+    def schedule(self):
+        # Streamed: rows are computed as they are read.
+        return amortization.schedule(self.principal, self.interest_rate, self.months, self.start_date)
+
+    @property
+    def months(self):
+        return max(1, round(self.duration_years * 12))
+
+    @property
+    def maturity(self):
+        return add_months(self.start_date, self.months)
+
+    def due_after(self, date):
+        # First installment date after date; an overdue loan stays due at maturity.
+        for month in range(1, self.months + 1):
+            due = add_months(self.start_date, month)
+            if due > date:
+                return due
+        return self.maturity
+
+    def __str__(self):
+        return (f"Loan: {fmt(self.principal)} {self.currency}, "
+                f"Duration: {self.duration_years:.2f} years, "
+                f"Installment: {fmt(self.installment)} {self.currency}, "
+                f"Remaining: {fmt(self.remaining_amount)} {self.currency}")
+
+
+# ======================================================
+# ABSTRACT ACCOUNT CLASS
+# ======================================================
+class Account(ABC):
+    DAILY_LIMITS = {"PKR": 20000, "USD": 500, "EUR": 600}
+    MIN_BALANCE_PKR = 0
+    # Until registered with an ATM.
+    default_storage = Storage()
+    default_loan_registry = LoanRegistry()
+    default_transaction_index = TransactionIndex()
+    __slots__ = ("_balance_pkr", "transactions", "loans", "_lock", "owner_id", "version", "storage",
+                 "loan_registry", "transaction_index")
+
+    def __init__(self, balance_pkr):
+        # Balances are kept in paisa; balance_pkr is given in rupees.
+        self._balance_pkr = to_minor(balance_pkr)
+        self.storage = self.default_storage
+        self.loan_registry = self.default_loan_registry
+        self.transaction_index = self.default_transaction_index
+        self.transactions = TransactionLog()
+        self.loans = {}  # loan_id -> Loan, in the order taken
+        # Guards balance, transactions and loans. When both are needed the
+        # account lock is always taken before the owning user's lock.
+        self._lock = threading.RLock()
+        self.owner_id = None
+        # Bumped on every ledger change; cached views are keyed on it.
+        self.version = 0
+
+    @classmethod
+    def from_record(cls, balance_paisa):
+        account = cls(0)
+        account._balance_pkr = balance_paisa
+        return account
+
+    @property
+    def balance(self):
+        return Money(self._balance_pkr)
+
+    @staticmethod
+    def _check_transaction(balance, kind, amount, currency, amount_pkr, rate_version, loan_id=NO_LOAN):
+        # Packs the record the ledger would store, so a transaction it cannot
+        # hold (an amount out of range, a currency without a code) is refused
+        # with ValueError before anything has changed.
+        checked(balance, MAX_BALANCE)
+        if currency not in CURRENCY_CODES:
+            raise ValueError("Unsupported currency.")
+        try:
+            RECORD.pack(kind, amount, CURRENCY_CODES[currency], amount_pkr, 0, loan_id, rate_version)
+        except struct.error:
+            raise ValueError("Amount too large.") from None
+
+    def _log_transaction(self, balance, kind, amount, currency, amount_pkr, rate_version, loan_id=NO_LOAN):
+        # Records a transaction and sets the balance it leaves.
+        self._check_transaction(balance, kind, amount, currency, amount_pkr, rate_version, loan_id)
+        timestamp = int(time.time())
+        position = len(self.transactions)
+        self.transactions.append(kind, amount, currency, amount_pkr, loan_id, timestamp, rate_version)
+        self._balance_pkr = balance
+        self.version += 1
+        self.transaction_index.add(self.owner_id, position, kind, currency, amount_pkr, timestamp)
+        self.storage.record_transaction(self.owner_id, self._balance_pkr, kind, amount, currency,
+                                        amount_pkr, timestamp, loan_id, rate_version, position)
+
+    def _log_transactions(self, balance, kinds, amounts, currencies, amounts_pkr, rate_version):
+        checked(balance, MAX_BALANCE)
+        timestamp = int(time.time())
+        position = len(self.transactions)
+        self.transactions.extend(kinds, amounts, currencies, amounts_pkr, timestamp=timestamp,
+                                 rate_version=rate_version)
+        self._balance_pkr = balance
+        self.version += 1
+        self.transaction_index.add_many(self.owner_id, position, kinds, currencies, amounts_pkr, timestamp)
+        self.storage.record_transactions(self.owner_id, self._balance_pkr, kinds, amounts, currencies,
+                                         amounts_pkr, timestamp, rate_version, position)
+
+    @idempotent("owner_id")
+    @instrumented("deposit")
+    @durable
+    @synchronized
+    def deposit(self, amount, currency):
+        try:
+            amount = to_minor(amount)
+            if amount <= 0:
+                return "Deposit amount must be positive."
+            currency = currency.upper()
+            rates = CurrencyConverter.current()
+            amount_pkr = rates.to_pkr(amount, currency)
+            self._log_transaction(self._balance_pkr + amount_pkr, DEPOSIT, amount, currency, amount_pkr,
+                                  rates.version)
+            return f"Deposit successful. PKR {fmt(amount_pkr)} added."
+        except ValueError:
+            return "Invalid input or unsupported currency."
+
+    @abstractmethod
+    def withdraw(self, amount, currency, user):
+        pass
+
+    @idempotent("owner_id")
+    @instrumented("take_loan")
+    @durable
+    @synchronized
+    def take_loan(self, amount, currency, duration_type, duration):
+        try:
+            amount = to_minor(amount)
+            if amount <= 0:
+                return "Loan amount must be positive."
+            currency = currency.upper()
+            rates = CurrencyConverter.current()
+            amount_pkr = rates.to_pkr(amount, currency)
+            if duration <= 0:
+                return "Duration must be positive."
+            years = duration / 12 if duration_type == "months" else duration
+
+            # Create loan
+            loan = Loan(principal=amount, currency=currency, duration_years=years,
+                        start_date=datetime.date.today())
+            interest = rates.to_pkr(amortization.total_interest(loan.principal, loan.interest_rate, loan.months,
+                                                                loan.start_date), currency)
+            record = (self._balance_pkr + amount_pkr, LOAN_TAKEN, amount, currency, amount_pkr, rates.version,
+                      loan.loan_id)
+            # Checked before the loan is saved, so a credit the ledger cannot
+            # hold never leaves a loan behind.
+            self._check_transaction(*record)
+            self.loans[loan.loan_id] = loan
+            self.loan_registry.add(self.owner_id, loan)
+            self.storage.save_loan(self.owner_id, loan)
+            self._log_transaction(*record)
+            return f"Loan granted! PKR {fmt(amount_pkr)} added. Interest: PKR {fmt(interest)}"
+        except ValueError:
+            return "Invalid input."
+
+    @synchronized
+    def get_loans(self):
+        return list(self.loans.values())
+
+    @idempotent("owner_id")
+    @instrumented("pay_loan")
+    @durable
+    @synchronized
+    def pay_loan(self, loan_id, amount):
+        if not self.loans:
+            return "No loans to pay."
+        loan = self.loans.get(loan_id)
+        if loan is None:
+            return "Invalid loan selection."
+        try:
+            amount = to_minor(amount)
+            if amount <= 0:
+                return "Amount must be positive."
+            rates = CurrencyConverter.current()
+            amount_pkr = rates.to_pkr(amount, loan.currency)
+            if amount_pkr > self._balance_pkr:
+                return "Insufficient balance to pay this amount."
+
+            def log(paid):
+                paid_pkr = rates.to_pkr(paid, loan.currency)
+                self._log_transaction(self._balance_pkr - paid_pkr, LOAN_PAYMENT, paid, loan.currency,
+                                      paid_pkr, rates.version, loan.loan_id)
+
+            self.loan_registry.repay_capped(loan, amount, log)
+        except ValueError:
+            return "Invalid input."
+        message = f"Payment successful. Remaining loan: {fmt(loan.remaining_amount)} {loan.currency}"
+        if loan.remaining_amount <= 0:
+            message += " Loan fully paid!"
+            del self.loans[loan.loan_id]
+            self.loan_registry.remove(loan.loan_id)
+            self.storage.delete_loan(loan.loan_id)
+        else:
+            today = datetime.date.today()
+            if loan.next_due <= today:
+                self.loan_registry.reschedule(loan, loan.due_after(today))
+            self.storage.save_loan(self.owner_id, loan)
+        return message
+
+    @synchronized
+    def get_transactions(self):
+        return [str(t) for t in self.transactions.last(10)]
+
+    @synchronized
+    def transaction_rows(self):
+        return list(self.transactions.rows())
+
+
+# ======================================================
+# SAVINGS ACCOUNT
+# ======================================================
+class SavingsAccount(Account):
+    MIN_BALANCE_PKR = 1000
+    __slots__ = ()
+
+    @idempotent("owner_id")
+    @instrumented("withdraw")
+    @durable
+    @synchronized
+    def withdraw(self, amount, currency, user):
+        try:
+            amount = to_minor(amount)
+            if amount <= 0:
+                return "Withdrawal must be positive."
+            currency = currency.upper()
+            rates = CurrencyConverter.current()
+            amount_pkr = rates.to_pkr(amount, currency)
+            with user._lock:
+                user.reset_daily_withdrawals()
+
+                if user.daily_withdrawals[CURRENCY_CODES[currency]] + amount > to_minor(Account.DAILY_LIMITS[currency]):
+                    return f"Daily withdrawal limit exceeded for {currency}."
+                if self._balance_pkr - amount_pkr < to_minor(self.MIN_BALANCE_PKR):
+                    return "Minimum balance requirement not met."
+
+                self._log_transaction(self._balance_pkr - amount_pkr, WITHDRAWAL, amount, currency, amount_pkr,
+                                      rates.version)
+                user.daily_withdrawals[CURRENCY_CODES[currency]] += amount
+            return f"Withdrawal successful. PKR {fmt(amount_pkr)} deducted."
+        except ValueError:
+            return "Invalid input."
+
+
+# ======================================================
+# CURRENT ACCOUNT
+# ======================================================
+class CurrentAccount(Account):
+    __slots__ = ()
+
+    @idempotent("owner_id")
+    @instrumented("withdraw")
+    @durable
+    @synchronized
+    def withdraw(self, amount, currency, user):
+        try:
+            amount = to_minor(amount)
+            if amount <= 0:
+                return "Withdrawal must be positive."
+            currency = currency.upper()
+            rates = CurrencyConverter.current()
+            amount_pkr = rates.to_pkr(amount, currency)
+            with user._lock:
+                user.reset_daily_withdrawals()
+
+                if user.daily_withdrawals[CURRENCY_CODES[currency]] + amount > to_minor(Account.DAILY_LIMITS[currency]):
+                    return f"Daily withdrawal limit exceeded for {currency}."
+                if self._balance_pkr - amount_pkr < 0:
+                    return "Insufficient balance."
+
+                self._log_transaction(self._balance_pkr - amount_pkr, WITHDRAWAL, amount, currency, amount_pkr,
+                                      rates.version)
+                user.daily_withdrawals[CURRENCY_CODES[currency]] += amount
+            return f"Withdrawal successful. PKR {fmt(amount_pkr)} deducted."
+        except ValueError:
+            return "Invalid input."
+
+
+# ======================================================
+# OPEN ATMS
+# ======================================================
+# ATMs with scheduled snapshots that have not been closed; each is
+# snapshotted once more at exit. Held weakly, as are the ATMs behind the
+# residency gauges, so a process that opens several does not keep the
+# old ones alive.
+SNAPSHOT_AT_EXIT = weakref.WeakSet()
+
+
+@atexit.register
+def _snapshot_at_exit():
+    for atm in list(SNAPSHOT_AT_EXIT):
+        atm.snapshot()
+
+
+def _residency_gauge(atm, attribute):
+    atm = atm()
+    return getattr(atm.residents, attribute) if atm is not None else 0
+
+
+METRICS.gauge("atm_idempotency_entries", lambda: len(IDEMPOTENCY))
+METRICS.gauge("atm_idempotency_replays_total", lambda: IDEMPOTENCY.replays)
+
+
+# ======================================================
+# ATM CLASS
+# ======================================================
+class ATM:
+    ACCOUNT_TYPES = {"SavingsAccount": SavingsAccount, "CurrentAccount": CurrentAccount}
+    # Users (with their accounts) kept in memory; the least recently used are
+    # written back to storage beyond either limit. None means unbounded.
+    MAX_RESIDENT_USERS = 100_000
+    MAX_RESIDENT_BYTES = None
+    USER_BYTES = 900  # a user and account object, excluding transaction log columns
+
+    def __init__(self, storage=None, max_users=None, max_bytes=None):
+        self.storage = storage or Storage()
+        # Guards the users/accounts registries only; balance changes are
+        # serialized by the per-account locks.
+        self._lock = threading.RLock()
+        # Users in storage are only built when first looked up.
+        self.residents = Residency(
+            self._materialize, self._register, self.storage.user_ids(), self._lock,
+            max_users=max_users or self.MAX_RESIDENT_USERS, max_bytes=max_bytes or self.MAX_RESIDENT_BYTES,
+            sizeof=self._footprint, evict=self._evict)
+        self.storage.on_users_saved(self.residents.saved)
+        self.users = self.residents.users
+        self.accounts = self.residents.accounts
+        self.loans = LoanRegistry()
+        self.transaction_index = TransactionIndex()
+        self._snapshot_lock = threading.Lock()
+        self._timers = {}
+        # Unlock timers of stored locks whose users are not loaded; a user
+        # takes over their lock's timer when they are (see _materialize).
+        self._lock_timers = {}
+        User.schedule_daily_reset()
+        self._schedule_accrual()
+        # Sampled at scrape time; the last ATM opened is the one reported.
+        ref = weakref.ref(self)
+        for name, attribute in (("atm_resident_users", "resident"), ("atm_residency_hits_total", "hits"),
+                                ("atm_residency_misses_total", "misses"),
+                                ("atm_residency_evictions_total", "evictions")):
+            METRICS.gauge(name, functools.partial(_residency_gauge, ref, attribute))
+
+    def _register(self, user: User, account: Account):
+        user.storage = self.storage
+        if account:
+            account.storage = self.storage
+            account.loan_registry = self.loans
+            account.transaction_index = self.transaction_index
+            account.owner_id = user.user_id
+            if account.transactions.spill_path is None:
+                account.transactions.spill_dir = self.storage.spill_directory
+        self.residents.put(user.user_id, user, account)
+
+    def add_user(self, user: User, account: Account):
+        self._register(user, account)
+        self.storage.save_user(user)
+        if account:
+            self.storage.save_account(user.user_id, account)
+        self.residents.trim()
+
+    @classmethod
+    def from_storage(cls, storage, max_users=None, max_bytes=None):
+        atm = cls(storage, max_users, max_bytes)
+        index = storage.load_transaction_index()
+        if index is not None:
+            atm.transaction_index = TransactionIndex.load(index)
+        # Every stored lock is on the scheduler from the start, so the
+        # upcoming expiries are complete without loading the locked users.
+        now = datetime.datetime.now()
+        for user_id, locked_until, reason in storage.load_locks():
+            until = datetime.datetime.fromisoformat(locked_until)
+            if until > now:
+                atm._schedule_stored_lock(user_id, until, reason or "locked")
+        last_loan_id = storage.last_loan_id()
+        for loan_id, user_id, *fields in storage.load_loans():
+            loan = Loan.from_record(loan_id, *fields)
+            atm.loans.add(user_id, loan)
+            last_loan_id = max(last_loan_id, loan_id)
+        # Backends without a stored index: only the index is built here, the
+        # logs themselves are loaded with their users.
+        positions = {}
+        for user_id, kind, _, currency, amount_pkr, timestamp, _, _ in storage.load_transactions():
+            position = positions.get(user_id, 0)
+            positions[user_id] = position + 1
+            atm.transaction_index.add(user_id, position, kind, currency, amount_pkr, timestamp)
+        # Changes journaled since the last snapshot.
+        for event in storage.load_events():
+            atm._apply(*event)
+            if event[0] == journal.LOAN:
+                last_loan_id = max(last_loan_id, event[1][0])
+        Loan._ids = itertools.count(last_loan_id + 1)
+        # Catch up on nights missed while the app was down.
+        atm.accrue_interest()
+        if storage.SNAPSHOT_INTERVAL:
+            atm._schedule_snapshot()
+            # A snapshot on the way out makes the next start replay nothing.
+            SNAPSHOT_AT_EXIT.add(atm)
+        return atm
+
+    def close(self):
+        # Takes the exit snapshot now (the storage is closed before exit
+        # hooks run) and stops the ATM's timers, then closes the storage.
+        if self in SNAPSHOT_AT_EXIT:
+            SNAPSHOT_AT_EXIT.discard(self)
+            self.snapshot()
+        for timer in itertools.chain(self._timers.values(), self._lock_timers.values()):
+            User.scheduler.cancel(timer)
+        self._timers.clear()
+        self._lock_timers.clear()
+        self.storage.close()
+
+    def _schedule_stored_lock(self, user_id, until, reason):
+        with self._lock:
+            if self.residents.peek(user_id) is None:
+                self._lock_timers[user_id] = User.scheduler.call_at(
+                    until, self._expire_stored_lock, user_id, label=f"{user_id} {reason}")
+
+    def _expire_stored_lock(self, user_id):
+        # Nothing to write: a stored lock that has run out reads as unlocked.
+        with self._lock:
+            self._lock_timers.pop(user_id, None)
+
+    def _materialize(self, user_id):
+        # Builds one stored user and their account; called by the users and
+        # accounts maps on lookup when they are not in memory.
+        record = self.storage.load_user(user_id)
+        if record is None:
+            return
+        timer = self._lock_timers.pop(user_id, None)
+        if timer is not None:
+            User.scheduler.cancel(timer)
+        user_row, last_withdrawal_day, daily_withdrawals, account_row, transactions = record
+        user = User.from_record(*user_row)
+        user.last_withdrawal_day = last_withdrawal_day
+        user.daily_withdrawals = array("q", daily_withdrawals)
+        account = None
+        if account_row is not None:
+            _, account_type, balance_paisa = account_row
+            account = self.ACCOUNT_TYPES[account_type].from_record(balance_paisa)
+            account.transactions = TransactionLog.from_bytes(transactions, spill_dir=self.storage.spill_directory)
+            account.loans = self.loans.owned_by(user_id)
+        self._register(user, account)
+
+    def _apply(self, kind, *fields):
+        # Re-applies one journal event. Events the snapshot already reflects
+        # leave the state unchanged: users and loans are stored whole, and
+        # ledger events carry the log position they were written at.
+        if kind == journal.USER:
+            user_id, *record = fields[0]
+            user = self.users.get(user_id)
+            if user is None:
+                self._register(User.from_record(user_id, *record), None)
+            else:
+                user.restore(*record)
+        elif kind == journal.ACCOUNT:
+            user_id, account_type, balance_paisa = fields[0]
+            if self.accounts.get(user_id) is None:
+                self._register(self.users[user_id], self.ACCOUNT_TYPES[account_type].from_record(balance_paisa))
+        elif kind == journal.TRANSACTIONS:
+            user_id, balance_paisa, position, records = fields
+            self._apply_ledger(user_id, balance_paisa, position, list(RECORD.iter_unpack(records)))
+        elif kind == journal.LOAN:
+            loan_id, user_id, *record = fields[0]
+            if loan_id in self.loans:
+                remaining, next_due, accrued, accrued_through = record[5:]
+                self.loans.restore(loan_id, remaining, accrued, datetime.date.fromisoformat(accrued_through))
+                self.loans.reschedule(self.loans.get(loan_id), datetime.date.fromisoformat(next_due))
+            else:
+                loan = Loan.from_record(loan_id, *record)
+                self.loans.add(user_id, loan)
+                account = self._loaded_account(user_id)
+                if account is not None:
+                    account.loans[loan_id] = loan
+        elif kind == journal.LOAN_DELETE:
+            loan_id = fields[0]
+            user_id = self.loans.owner(loan_id)
+            self.loans.remove(loan_id)
+            account = self._loaded_account(user_id)
+            if account is not None:
+                account.loans.pop(loan_id, None)
+        elif kind == journal.LOAN_ACCRUAL:
+            through = datetime.date.fromisoformat(fields[0])
+            for remaining, accrued, loan_id in fields[1]:
+                if loan_id in self.loans:
+                    self.loans.restore(loan_id, remaining, accrued, through)
+
+    def _apply_ledger(self, user_id, balance_paisa, position, records):
+        account, user = self.accounts[user_id], self.users[user_id]
+        log = account.transactions
+        if position == len(log):
+            for kind, amount, code, amount_pkr, timestamp, loan_id, rate_version in records:
+                log.append(kind, amount, CURRENCIES[code], amount_pkr, loan_id, timestamp, rate_version)
+                if kind == WITHDRAWAL and datetime.date.fromtimestamp(timestamp).toordinal() == User.business_day:
+                    user.reset_daily_withdrawals()
+                    user.daily_withdrawals[code] += amount
+            account._balance_pkr = balance_paisa
+            account.version += 1
+        skip = max(0, self.transaction_index.next_position(user_id) - position)
+        if skip < len(records):
+            kinds, _, codes, amounts_pkr, timestamps, _, _ = zip(*records[skip:])
+            self.transaction_index.add_many(user_id, position + skip, kinds, [CURRENCIES[c] for c in codes],
+                                            amounts_pkr, timestamps[0])
+
+    # ---------------- SNAPSHOTS ----------------
+    @instrumented("snapshot")
+    def snapshot(self):
+        # Writes the whole bank to a new snapshot, so the next start only
+        # replays what is journaled after it. Users not in memory are copied
+        # across from storage without being decoded. Returns False when the
+        # storage does not keep snapshots.
+        with self._snapshot_lock:
+            seq = self.storage.begin_snapshot()
+            if seq is None:
+                return False
+            user_ids = sorted(self.users)
+            users = ((user_id, self._encode_resident(user_id)) for user_id in user_ids)
+            loans = [loan_row(owner_id, loan) for owner_id, loan in self.loans.items()]
+            # Taking an id leaves a harmless gap and cannot race with new loans.
+            stored = self.storage.write_snapshot(seq, next(Loan._ids), users, loans, self.transaction_index.dump())
+            self.residents.restore(stored)
+            return True
+
+    def _encode_resident(self, user_id):
+        # Looked up without counting as use, so snapshots leave the LRU order be.
+        entry = self.residents.peek(user_id)
+        return None if entry is None else self._encode(*entry)
+
+    def _encode(self, user, account):
+        with (account._lock if account else contextlib.nullcontext()), user._lock:
+            return encode_user(
+                user.user_id, user.name, user.pin_hash, user.is_admin,
+                user.locked_until.isoformat() if user.locked_until else None,
+                user.last_withdrawal_day, user.daily_withdrawals,
+                type(account).__name__ if account else None, account._balance_pkr if account else 0,
+                account.transactions.to_bytes() if account else b"")
+
+    # ---------------- RESIDENCY ----------------
+    def _evict(self, user_id, user, account):
+        # Writes an evicted user back to storage. Until they are looked up
+        # again their storage is an Evicted stand-in, so a write through
+        # objects someone still holds makes them resident first.
+        with (account._lock if account else contextlib.nullcontext()), user._lock:
+            self.storage.write_back(user_id, self._encode(user, account))
+            ghost = Evicted(user, account, self.storage, self._register)
+            user.storage = ghost
+            if account:
+                account.storage = ghost
+        return ghost
+
+    def _loaded_account(self, user_id):
+        # The account object if one is in memory, evicted or not, without
+        # loading it; accounts built later take their loans from self.loans.
+        held = self.residents.peek(user_id)
+        return held[1] if held else None
+
+    def _footprint(self, user, account):
+        # Rough bytes held in memory, for the max_bytes limit.
+        return self.USER_BYTES + (account.transactions.nbytes() if account else 0)
+
+    def _schedule_snapshot(self):
+        if self.storage.SNAPSHOT_INTERVAL:
+            self._timers["snapshot"] = User.scheduler.call_later(
+                self.storage.SNAPSHOT_INTERVAL, self._start_snapshot, label="snapshot")
+
+    def _start_snapshot(self):
+        # On a thread of its own so timers keep firing while it is written.
+        threading.Thread(target=self._scheduled_snapshot, name="atm-snapshot", daemon=True).start()
+
+    def _scheduled_snapshot(self):
+        if self.snapshot():  # False once the storage is closed
+            self._schedule_snapshot()
+
+    @instrumented("login")
+    def login(self, user_id, pin):
+        user = self.users.get(user_id)
+        if user is None:
+            return None, "User not found."
+        success, msg = user.verify_pin(pin)
+        if success:
+            return user, ""
+        else:
+            return None, msg
+
+    @idempotent(None)
+    @instrumented("process_batch")
+    @durable
+    def process_batch(self, ops):
+        # NumPy is only needed for bulk settlement, so it is imported lazily.
+        from batch import process_batch
+        report = process_batch(self, ops, CurrencyConverter.current())
+        METRICS.count("batch_row", OK, report["accepted"])
+        for _, _, message in report["rejections"]:
+            METRICS.count("batch_row", reason(message))
+        return report
+
+    @instrumented("import_users")
+    def import_users(self, path, chunk_size=None, hasher=None, progress=None):
+        # Streams customers from a CSV or JSON-lines file; see importer.py.
+        from importer import import_users
+        return import_users(self, User, path, chunk_size, hasher, progress)
+
+    def get_users(self, offset=0, limit=None):
+        # One page of (user_id, name), all of them when limit is None. Users
+        # not in memory are named from storage without being loaded, so a
+        # listing leaves the resident set as it was.
+        user_ids = itertools.islice(self.users, offset, None if limit is None else offset + limit)
+        return [(user_id, self._user_name(user_id)) for user_id in user_ids]
+
+    def _user_name(self, user_id):
+        held = self.residents.peek(user_id)
+        return held[0].name if held else self.storage.user_name(user_id)
+
+    @instrumented("get_all_transactions")
+    def get_all_transactions(self):
+        return {uid: account.get_transactions() if account else [] for uid, account in self.accounts.items()}
+
+    @instrumented("query_transactions")
+    def query_transactions(self, user_id=None, start=None, end=None, kind=None, currency=None, min_amount=None,
+                           max_amount=None, cursor=None, limit=None):
+        # start/end: datetimes (end exclusive); amounts in PKR. Returns one
+        # page of (user_id, Transaction), newest first, and the cursor for the
+        # next page (None when there are no more).
+        hits, cursor = self.transaction_index.query(
+            user_id=user_id or None,
+            start=int(start.timestamp()) if start else None,
+            end=int(end.timestamp()) if end else None,
+            kind=kind, currency=currency,
+            min_pkr=to_minor(min_amount) if min_amount is not None else None,
+            max_pkr=to_minor(max_amount) if max_amount is not None else None,
+            cursor=cursor, limit=limit)
+        return [(uid, self.accounts[uid].transactions[position]) for uid, position in hits], cursor
+
+    @idempotent(None)
+    @instrumented("freeze_user")
+    def freeze_user(self, uid):
+        user = self.users.get(uid)
+        if user is not None:
+            user.lock_until(datetime.datetime.now() + datetime.timedelta(days=365), "frozen")
+            self.storage.save_user(user)
+            return "User account frozen."
+        else:
+            return "User not found."
+
+    def _schedule_accrual(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        midnight = datetime.datetime.combine(tomorrow, datetime.time())
+        self._timers["accrual"] = User.scheduler.call_at(midnight, self._nightly_accrual,
+                                                         label="loan interest accrual")
+
+    def _nightly_accrual(self):
+        self.accrue_interest()
+        self._schedule_accrual()
+
+    @instrumented("accrue_interest")
+    def accrue_interest(self, on=None):
+        # Brings every outstanding loan's interest up to the start of `on`.
+        on = on or datetime.date.today()
+        rows = self.loans.accrue(on)
+        self.storage.save_loan_accruals(rows, on)
+        return len(rows)
+
+    def loans_due(self, on=None):
+        # (user_id, loan) pairs with an installment due on or before on.
+        return self.loans.due(on)
+
+    def upcoming_expiries(self, n=10):
+        return [(datetime.datetime.fromtimestamp(when), label) for when, label in User.scheduler.upcoming(n)]
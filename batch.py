@@ -0,0 +1,208 @@
+# BATCH SETTLEMENT
+# Applies end-of-day deposit/withdrawal files in bulk. Operations are
+# grouped by account and validated with NumPy array operations; each
+# account's operations still take effect in file order, exactly as if they
+# had been entered one by one.
+
+import numpy as np
+
+from money import MONEY_DTYPE, MAX_BALANCE, MAX_MINOR, SCALE, Money, to_minor, to_minor_array
+from transaction_log import CURRENCIES, DEPOSIT, WITHDRAWAL
+
+
+# ======================================================
+# REJECTION REASONS
+# ======================================================
+OK = 0
+INVALID_AMOUNT = 1
+INVALID_OPERATION = 2
+UNSUPPORTED_CURRENCY = 3
+UNKNOWN_ACCOUNT = 4
+DAILY_LIMIT = 5
+MIN_BALANCE = 6
+INSUFFICIENT_BALANCE = 7
+AMOUNT_TOO_LARGE = 8
+MALFORMED_ROW = 9
+
+REASONS = {
+    INVALID_AMOUNT: "Amount must be positive.",
+    INVALID_OPERATION: "Unknown operation.",
+    UNSUPPORTED_CURRENCY: "Unsupported currency.",
+    UNKNOWN_ACCOUNT: "Account not found.",
+    DAILY_LIMIT: "Daily withdrawal limit exceeded.",
+    MIN_BALANCE: "Minimum balance requirement not met.",
+    INSUFFICIENT_BALANCE: "Insufficient balance.",
+    AMOUNT_TOO_LARGE: "Amount too large.",
+    MALFORMED_ROW: "Malformed row.",
+}
+
+OPERATIONS = {"deposit": DEPOSIT, "withdraw": WITHDRAWAL}
+
+# Operations of one account are checked this many at a time, which bounds the
+# work repeated after each rejection.
+WINDOW = 1024
+# Largest amount, in minor units before and after conversion, of one line.
+# A window of them added to a balance of at most MAX_BALANCE cannot wrap
+# int64, and float64 holds every one exactly.
+MAX_LINE = (MAX_MINOR - MAX_BALANCE) // WINDOW
+
+
+# ======================================================
+# BATCH PROCESSING
+# ======================================================
+def process_batch(atm, ops, rates):
+    # ops: sequence of (user_id, operation, amount, currency) where operation
+    # is "deposit" or "withdraw". rates: the RateTable used for the whole
+    # batch, so every line converts at the same version. A bad line is
+    # rejected with its reason; it never stops the rest of the batch.
+    ops = list(ops)
+    n = len(ops)
+    report = {"processed": n, "accepted": 0, "rejected": 0, "rejections": [],
+              "deposited_pkr": Money(0), "withdrawn_pkr": Money(0), "rate_version": rates.version}
+    if not n:
+        return report
+
+    # Lines that are not four fields are settled as harmless placeholders
+    # and rejected at the end.
+    malformed = [i for i, op in enumerate(ops) if not isinstance(op, (tuple, list)) or len(op) != 4]
+    for i in malformed:
+        ops[i] = ("", "", 0, "")
+    user_ids, operations, amounts, currencies = zip(*ops)
+    reasons = np.zeros(n, dtype=np.int8)
+    reasons[malformed] = MALFORMED_ROW
+
+    # Currency conversion: map each distinct currency once, then gather.
+    currencies = np.char.upper(_strings(currencies))
+    names, currency_idx = np.unique(currencies, return_inverse=True)
+    codes = np.array([CURRENCIES.index(c) if c in CURRENCIES and c in rates.rates else -1
+                      for c in names])[currency_idx]
+    supported = codes >= 0
+
+    # All arithmetic below is exact int64 minor units (cents / paisa), so
+    # amounts beyond MAX_LINE, before or after conversion, are rejected
+    # rather than rounded or wrapped.
+    values = parse_amounts(amounts)
+    row_rates = np.array([float(rates.rates[c]) if c in rates.rates else 0.0 for c in names])[currency_idx]
+    with np.errstate(invalid="ignore", over="ignore"):
+        invalid = ~np.isfinite(values)
+        too_large = ~invalid & ((values * SCALE > MAX_LINE) | (values * SCALE * row_rates > MAX_LINE))
+    values[invalid | too_large] = 0
+    amounts = to_minor_array(values)
+    # Checked in minor units, so an amount that rounds to nothing (0.004) is
+    # refused as deposit() refuses it.
+    invalid |= ~too_large & (amounts <= 0)
+    amounts_pkr = np.zeros(n, dtype=MONEY_DTYPE)
+    amounts_pkr[supported] = rates.to_pkr_many(amounts[supported], currencies[supported])
+
+    names, operation_idx = np.unique(_strings(operations), return_inverse=True)
+    kinds = np.array([OPERATIONS.get(op.lower(), -1) for op in names])[operation_idx]
+    is_withdrawal = kinds == WITHDRAWAL
+
+    reasons[codes < 0] = UNSUPPORTED_CURRENCY
+    reasons[kinds < 0] = INVALID_OPERATION
+    reasons[invalid] = INVALID_AMOUNT
+    reasons[too_large] = AMOUNT_TOO_LARGE
+    reasons[malformed] = MALFORMED_ROW
+
+    # Group by account, keeping file order inside each group.
+    names, account_idx = np.unique(_strings(user_ids), return_inverse=True)
+    order = np.argsort(account_idx, kind="stable")
+    bounds = np.flatnonzero(np.diff(account_idx[order])) + 1
+    for group in np.split(order, bounds):
+        user_id = user_ids[group[0]]
+        account = atm.accounts.get(user_id) if isinstance(user_id, str) else None
+        if account is None:
+            reasons[group] = UNKNOWN_ACCOUNT
+            continue
+        _settle_account(account, atm.users[user_id], group, kinds, is_withdrawal, codes,
+                        amounts, amounts_pkr, reasons, rates.version)
+
+    reasons[malformed] = MALFORMED_ROW
+    accepted = reasons == OK
+    report["accepted"] = int(accepted.sum())
+    report["rejected"] = n - report["accepted"]
+    report["deposited_pkr"] = Money(amounts_pkr[accepted & ~is_withdrawal].sum())
+    report["withdrawn_pkr"] = Money(amounts_pkr[accepted & is_withdrawal].sum())
+    report["rejections"] = [(int(i), user_ids[i] if reasons[i] != MALFORMED_ROW else None, REASONS[reasons[i]])
+                            for i in np.flatnonzero(~accepted)]
+    return report
+
+
+def _strings(values):
+    # A column as a NumPy string array; a field NumPy cannot turn into one
+    # (a list, say) is converted on its own.
+    try:
+        return np.asarray(values, dtype=str)
+    except ValueError:
+        return np.asarray([str(value) for value in values], dtype=str)
+
+
+def parse_amounts(amounts):
+    # Major-unit amounts -> float64, NaN for any that is not a number.
+    try:
+        return np.asarray(amounts, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([_to_float(amount) for amount in amounts], dtype=np.float64)
+
+
+def _to_float(amount):
+    try:
+        return float(amount)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _settle_account(account, user, group, kinds, is_withdrawal, codes, amounts, amounts_pkr, reasons, rate_version):
+    floor = to_minor(account.MIN_BALANCE_PKR)
+    balance_reason = MIN_BALANCE if floor > 0 else INSUFFICIENT_BALANCE
+    limits = np.array([to_minor(account.DAILY_LIMITS[c]) for c in CURRENCIES], dtype=MONEY_DTYPE)
+
+    with account._lock, user._lock:
+        user.reset_daily_withdrawals()
+        used = np.array(user.daily_withdrawals, dtype=MONEY_DTYPE)
+        balance = account._balance_pkr
+
+        g_withdraw = is_withdrawal[group]
+        g_codes = codes[group]
+        g_amounts = amounts[group]
+        g_pkr = amounts_pkr[group]
+        active = reasons[group] == OK
+        per_currency = g_codes[:, None] == np.arange(len(CURRENCIES))[None, :]
+
+        # Assume every operation in the window succeeds, find the first one
+        # that would break a rule, reject it and continue right after it. In
+        # the common case each window is a single pass.
+        start = 0
+        while start < len(group):
+            window = slice(start, min(start + WINDOW, len(group)))
+            live = active[window]
+            withdrawals = g_withdraw[window] & live
+            delta = np.where(g_withdraw[window], -g_pkr[window], g_pkr[window]) * live
+            running_balance = balance + np.cumsum(delta)
+            spent = used + np.cumsum(per_currency[window] * (g_amounts[window] * withdrawals)[:, None], axis=0)
+            over_limit = withdrawals & (spent > limits).any(axis=1)
+            below_floor = withdrawals & (running_balance < floor)
+            above_cap = live & ~g_withdraw[window] & (running_balance > MAX_BALANCE)
+            violations = np.flatnonzero(over_limit | below_floor | above_cap)
+            if not len(violations):
+                balance = int(running_balance[-1])
+                used = spent[-1]
+                start = window.stop
+                continue
+            first = violations[0]
+            reasons[group[start + first]] = (DAILY_LIMIT if over_limit[first] else
+                                             AMOUNT_TOO_LARGE if above_cap[first] else balance_reason)
+            active[start + first] = False
+            if first:
+                balance = int(running_balance[first - 1])
+                used = spent[first - 1]
+            start += first + 1
+
+        accepted = group[active]
+        if not len(accepted):
+            return
+        account._log_transactions(balance, kinds[accepted].tolist(), amounts[accepted].tolist(),
+                                  [CURRENCIES[c] for c in codes[accepted]], amounts_pkr[accepted].tolist(),
+                                  rate_version)
+        for code in range(len(CURRENCIES)):
+            user.daily_withdrawals[code] = int(used[code])
@@ -0,0 +1,68 @@
+# BULK IMPORT
+# Writes a CSV of customers and imports it into an empty journal-backed bank,
+# reporting rows per second and peak Python memory. Rows carrying an
+# already-hashed PIN measure the importer itself; rows with plain PINs are
+# hashed at the bank's scrypt cost on every core, which is what bounds a real
+# onboarding run, so the time for a million customers is extrapolated from
+# them.
+# Run with: python benchmarks/bulk_import.py [rows] [rows with plain PINs]
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank import ATM, User  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+
+ROWS = 200_000
+PLAIN_ROWS = 2_000
+
+
+def write_csv(path, rows, pin_hash=None):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["user_id", "name", "pin", "pin_hash", "account_type", "balance"])
+        for i in range(rows):
+            writer.writerow([str(1_000_000 + i), f"Customer {i}", f"{i % 10_000:04d}", pin_hash or "",
+                             "savings" if i % 2 else "current", f"{1000 + i % 50_000}.{i % 100:02d}"])
+
+
+def run_case(label, rows, pin_hash=None, hasher=None):
+    directory = tempfile.mkdtemp(prefix="atm-import-")
+    path = os.path.join(directory, "customers.csv")
+    write_csv(path, rows, pin_hash)
+    storage = JournalStorage(os.path.join(directory, "data"))
+    atm = ATM.from_storage(storage)
+    tracemalloc.start()
+    report = atm.import_users(path, hasher=hasher)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    storage.close()
+    shutil.rmtree(directory)
+    rate = report["rows_per_second"]
+    print(f"{label:<26} {rows:>9,} {report['imported']:>9,} {report['elapsed']:>8.1f} {rate:>9,.0f} "
+          f"{peak / 2**20:>8.0f} {1_000_000 / rate / 60:>11.1f}")
+
+
+def run():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROWS
+    plain_rows = int(sys.argv[2]) if len(sys.argv) > 2 else PLAIN_ROWS
+    User.pin_hasher = PinHasher()
+    print(f"{'rows':<26} {'read':>9} {'imported':>9} {'seconds':>8} {'rows/s':>9} {'peak MiB':>8} "
+          f"{'1M minutes':>11}")
+    start = time.perf_counter()
+    run_case("pre-hashed PINs", rows, pin_hash=User.pin_hasher.hash("1234"))
+    run_case(f"scrypt, {os.cpu_count()} workers", plain_rows)
+    User.pin_hasher.shutdown()
+    print(f"total {time.perf_counter() - start:.0f} s")
+
+
+if __name__ == "__main__":
+    run()
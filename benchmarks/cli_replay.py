@@ -0,0 +1,80 @@
+# CLI REPLAY
+# Throughput of the terminal's scripted mode (run_script in
+# `Vibe Coding.py`). Writes a day of synthetic terminal traffic (deposits,
+# withdrawals, balance checks and loans spread over a few hundred customers)
+# as JSON lines and replays it against a fresh journal-backed bank with one
+# worker and with several, reporting requests per second. Money movements
+# wait for their fsync, so one worker is bound by the disk and more workers
+# share each fsync between customers.
+# Run with: python benchmarks/cli_replay.py [requests] [workers,...]
+
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bank import ATM, User, CurrentAccount  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+
+# The terminal's file name is not importable as a module name.
+spec = importlib.util.spec_from_file_location("vibe_coding", os.path.join(ROOT, "Vibe Coding.py"))
+cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cli)
+
+REQUESTS = 5_000
+WORKERS = "1,8,32"
+CUSTOMERS = 500
+
+
+def write_traffic(path, requests, seed=1):
+    rnd = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(requests):
+            op = rnd.choices(("deposit", "withdraw", "balance", "take_loan"), (40, 30, 25, 5))[0]
+            request = {"id": i, "op": op, "user_id": str(rnd.randrange(CUSTOMERS))}
+            if op in ("deposit", "withdraw"):
+                request.update(amount=str(rnd.randint(1, 50)), currency=rnd.choice(("PKR", "USD", "EUR")))
+            elif op == "take_loan":
+                request.update(amount="1000", currency="PKR", duration=12)
+            f.write(json.dumps(request) + "\n")
+
+
+def replay(traffic, workers):
+    directory = tempfile.mkdtemp(prefix="atm-replay-")
+    storage = JournalStorage(directory)
+    atm = ATM.from_storage(storage)
+    for i in range(CUSTOMERS):
+        atm.add_user(User(str(i), f"Customer {i}", "1234"), CurrentAccount(100_000))
+    with open(traffic, encoding="utf-8") as source, open(os.devnull, "w") as out:
+        start = time.perf_counter()
+        requests, ok = cli.run_script(atm, source, out, workers)
+        elapsed = time.perf_counter() - start
+    storage.close()
+    shutil.rmtree(directory)
+    return requests, ok, elapsed
+
+
+def run():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else REQUESTS
+    workers = [int(n) for n in (sys.argv[2] if len(sys.argv) > 2 else WORKERS).split(",")]
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1000,), pool_size=0)
+    traffic = os.path.join(tempfile.gettempdir(), "atm-replay-traffic.jsonl")
+    write_traffic(traffic, requests)
+    print(f"{'workers':>7} {'requests':>9} {'ok':>9} {'seconds':>8} {'req/s':>8}")
+    for n in workers:
+        answered, ok, elapsed = replay(traffic, n)
+        print(f"{n:>7} {answered:>9,} {ok:>9,} {elapsed:>8.2f} {answered / elapsed:>8,.0f}")
+    os.remove(traffic)
+    User.pin_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    run()
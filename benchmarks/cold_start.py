@@ -0,0 +1,74 @@
+# COLD START
+# Builds a snapshot of a bank with many accounts plus a journal tail, then
+# times how long ATM.from_storage takes to come up from it and how long the
+# first login (which loads that one user from the snapshot) takes.
+# Run with: python benchmarks/cold_start.py [accounts] [journal events]
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import snapshot  # noqa: E402
+from bank import ATM, User  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+from transaction_index import TransactionIndex  # noqa: E402
+from transaction_log import RECORD, DEPOSIT  # noqa: E402
+
+ACCOUNTS = 1_000_000
+TAIL = 10_000          # journal events written after the snapshot
+HISTORY = 4            # transactions per account in the snapshot
+
+
+def build(directory, accounts):
+    pin_hash = User.pin_hasher.hash("1234")
+    now = int(time.time())
+    index = TransactionIndex()
+    history = b"".join(RECORD.pack(DEPOSIT, 100_00, 0, 100_00, now, -1, 1) for _ in range(HISTORY))
+    user_ids = sorted(str(100_000 + i) for i in range(accounts))
+    for user_id in user_ids:
+        index.add_many(user_id, 0, [DEPOSIT] * HISTORY, ["PKR"] * HISTORY, [100_00] * HISTORY, now)
+    users = ((user_id, snapshot.encode_user(user_id, f"User {user_id}", pin_hash, False, None, 0, (0, 0, 0),
+                                            "CurrentAccount", HISTORY * 100_00, history))
+             for user_id in user_ids)
+    snapshot.write(os.path.join(directory, "snapshot.bin"), 0, 1, users, [], index.dump())
+    return user_ids
+
+
+def run():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else ACCOUNTS
+    tail = int(sys.argv[2]) if len(sys.argv) > 2 else TAIL
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1000,), pool_size=0)
+    directory = tempfile.mkdtemp(prefix="atm-cold-start-")
+
+    start = time.perf_counter()
+    user_ids = build(directory, accounts)
+    print(f"built snapshot of {accounts:,} accounts in {time.perf_counter() - start:.1f} s "
+          f"({os.path.getsize(os.path.join(directory, 'snapshot.bin')) / 2**20:.0f} MiB)")
+
+    # Journal tail: deposits spread over a few hundred accounts.
+    storage = JournalStorage(directory)
+    atm = ATM.from_storage(storage)
+    for i in range(tail):
+        atm.accounts[user_ids[i % 500]].deposit(1, "PKR")
+    storage.close()
+
+    start = time.perf_counter()
+    storage = JournalStorage(directory)
+    atm = ATM.from_storage(storage)
+    cold = time.perf_counter() - start
+    print(f"cold start with {tail:,} journal events to replay: {cold * 1000:.0f} ms")
+
+    start = time.perf_counter()
+    user, message = atm.login(user_ids[-1], "1234")
+    print(f"first login of an untouched user: {(time.perf_counter() - start) * 1000:.2f} ms "
+          f"({'ok' if user else message})")
+    storage.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,73 @@
+# GROUP COMMIT
+# Deposits from many threads against the journal backend, where every
+# deposit returns only once it is fsynced. Compares one fsync per operation
+# (a single caller) with group commit at a few latency budgets, reporting
+# throughput, fsyncs issued and the acknowledgement latency.
+# Run with: python benchmarks/group_commit.py [threads] [deposits per thread]
+
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank import ATM, User, CurrentAccount  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+
+THREADS = 32
+DEPOSITS = 100
+BUDGETS = (0.0, 0.001, 0.002, 0.005)  # seconds
+
+
+def run_case(threads, deposits, commit_delay):
+    directory = tempfile.mkdtemp(prefix="atm-group-commit-")
+    storage = JournalStorage(directory, commit_delay=commit_delay)
+    atm = ATM.from_storage(storage)
+    for i in range(threads):
+        atm.add_user(User(str(i), f"User {i}", None), CurrentAccount(0))
+    latencies = []
+    barrier = threading.Barrier(threads)
+
+    def customer(user_id):
+        account = atm.accounts[user_id]
+        barrier.wait()
+        for _ in range(deposits):
+            start = time.perf_counter()
+            account.deposit(1, "PKR")
+            latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=customer, args=(str(i),)) for i in range(threads)]
+    syncs = storage.journal.syncs
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    syncs = storage.journal.syncs - syncs
+    storage.close()
+    shutil.rmtree(directory)
+
+    latencies.sort()
+    ops = threads * deposits
+    print(f"{threads:>7} {commit_delay * 1000:>9.1f} {ops / elapsed:>9.0f} {syncs:>7} {ops / max(syncs, 1):>8.1f} "
+          f"{statistics.median(latencies) * 1000:>8.2f} {latencies[int(len(latencies) * 0.99)] * 1000:>8.2f}")
+
+
+def run():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else THREADS
+    deposits = int(sys.argv[2]) if len(sys.argv) > 2 else DEPOSITS
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1000,), pool_size=0)
+    print(f"{'threads':>7} {'budget ms':>9} {'ops/s':>9} {'fsyncs':>7} {'ops/sync':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    run_case(1, deposits * 4, 0.0)   # one fsync per operation
+    for budget in BUDGETS:
+        run_case(threads, deposits, budget)
+
+
+if __name__ == "__main__":
+    run()
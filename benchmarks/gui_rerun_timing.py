@@ -0,0 +1,91 @@
+# GUI RERUN TIMING
+# Measures the server time of one deposit in the Streamlit user menu, first
+# as a full-page rerun (what every click used to cost) and then as a rerun
+# of the cash_panel fragment alone (what a deposit costs now). Uses
+# Streamlit's AppTest, so no browser is needed. Every deposit is the same
+# amount, so the run also checks that identical submits each apply.
+# Run with: python benchmarks/gui_rerun_timing.py [interactions] [history]
+
+import os
+import statistics
+from decimal import Decimal
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+
+import GUI  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+
+INTERACTIONS = 30
+HISTORY = 2000   # transactions already on the account
+
+# A full rerun executes the whole script; a fragment rerun executes only the
+# fragment's function, so rendering that function alone is what it costs.
+DRIVER = """
+import sys
+sys.path.insert(0, {root!r})
+import streamlit as st
+import GUI
+
+atm = GUI.get_atm()
+st.session_state.user = atm.users["101"]
+if {full!r}:
+    GUI.main()
+else:
+    GUI.cash_panel(atm.accounts["101"], atm.users["101"])
+"""
+
+
+def balance(app):
+    return Decimal(next(metric for metric in app.metric if metric.label == "Balance (PKR)").value)
+
+
+def time_deposits(full, interactions):
+    app = AppTest.from_string(DRIVER.format(root=ROOT, full=full), default_timeout=60).run()
+    start_balance = balance(app)
+    timings = []
+    for _ in range(interactions):
+        app.number_input(key="deposit_amount").set_value(1.0)
+        submit = next(button for button in app.button if button.label == "Deposit")
+        submit.click()
+        start = time.perf_counter()
+        app.run()
+        timings.append(time.perf_counter() - start)
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+    applied = balance(app) - start_balance
+    if applied != interactions:
+        raise RuntimeError(f"{interactions} identical deposits of 1.00 added {applied} PKR")
+    return timings
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f"{name:<16} median {statistics.median(timings) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+    return statistics.median(timings)
+
+
+def run():
+    interactions = int(sys.argv[1]) if len(sys.argv) > 1 else INTERACTIONS
+    history = int(sys.argv[2]) if len(sys.argv) > 2 else HISTORY
+
+    # PIN hashing is not what is measured here.
+    GUI.User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1000,), pool_size=0)
+    os.chdir(tempfile.mkdtemp(prefix="atm-gui-timing-"))
+    account = GUI.get_atm().accounts["101"]
+    for _ in range(history):
+        account.deposit(1, "PKR")
+
+    full = report("full rerun", time_deposits(True, interactions))
+    fragment = report("fragment rerun", time_deposits(False, interactions))
+    print(f"fragment reruns take {fragment / full:.0%} of the full-page time")
+
+
+if __name__ == "__main__":
+    run()
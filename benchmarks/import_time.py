@@ -0,0 +1,46 @@
+# IMPORT TIME
+# Starts a fresh interpreter per sample and reports how long importing the
+# headless core (bank) takes compared with the Streamlit app module (GUI),
+# plus the whole process start-up and its peak memory, so short-lived CLI
+# and worker processes can see what each entry point costs them.
+# Run with: python benchmarks/import_time.py [samples]
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLES = 10
+MODULES = ["bank", "GUI"]
+
+# Printed by the child: seconds spent importing, peak RSS in KiB.
+PROBE = ("import time, resource; start = time.perf_counter(); {statement}; "
+         "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+
+
+def sample(statement):
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", PROBE.format(statement=statement)], cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[0]), time.perf_counter() - start, int(out[1])
+
+
+def run_case(label, statement, samples):
+    imports, processes, rss = zip(*(sample(statement) for _ in range(samples)))
+    print(f"{label:<12} {statistics.median(imports) * 1000:>10.1f} {statistics.median(processes) * 1000:>11.1f} "
+          f"{max(rss) / 1024:>8.1f}")
+
+
+def run():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else SAMPLES
+    print(f"{'module':<12} {'import ms':>10} {'process ms':>11} {'peak MiB':>8}")
+    run_case("(nothing)", "pass", samples)
+    for module in MODULES:
+        run_case(module, f"import {module}", samples)
+
+
+if __name__ == "__main__":
+    run()
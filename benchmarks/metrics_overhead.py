@@ -0,0 +1,97 @@
+# METRICS OVERHEAD
+# What it costs to keep the metrics on. Times deposits, withdrawals and
+# logins through the instrumented methods and through the same methods with
+# the instrumentation peeled off (__wrapped__; deposits and withdrawals are
+# taken from under @idempotent first), interleaved in rounds so drift hits
+# both alike, and reports the nanoseconds added per call.
+#
+# The budget is relative: the worst added time as a share of a durable
+# deposit against a journal, which is what a customer waits for, measured on
+# the same machine. Nanoseconds added per call depend on the machine, so
+# they are reported but not gated on; on an in-memory bank they are a much
+# larger share, shown for reference. Exits non-zero over budget.
+# Run with: python benchmarks/metrics_overhead.py [calls per round]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank import ATM, User, Account, SavingsAccount, CurrentAccount  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+
+CALLS = 20_000
+DURABLE_CALLS = 200      # deposits per round against the journal
+ROUNDS = 5
+BUDGET_PERCENT = 1.0     # worst added time, as a share of a durable deposit
+
+
+def timed(call, calls):
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        call()
+    return (time.perf_counter_ns() - start) / calls
+
+
+def compare(plain, instrumented, calls):
+    # Best round of each, the one least disturbed by the machine.
+    off, on = [], []
+    for _ in range(ROUNDS):
+        off.append(timed(plain, calls))
+        on.append(timed(instrumented, calls))
+    return min(off), min(on)
+
+
+def open_bank(storage):
+    atm = ATM(storage)
+    atm.add_user(User("1", "Saver", "1234"), SavingsAccount(10_000_000))
+    atm.add_user(User("2", "Spender", "1234"), CurrentAccount(10_000_000))
+    return atm
+
+
+def run():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else CALLS
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1,), pool_size=0)
+    Account.DAILY_LIMITS = dict.fromkeys(Account.DAILY_LIMITS, 10 ** 9)
+    deposit, withdraw = SavingsAccount.deposit.__wrapped__, CurrentAccount.withdraw.__wrapped__
+    login = ATM.login.__wrapped__
+
+    atm = open_bank(None)
+    saver, spender, account = atm.accounts["1"], atm.users["2"], atm.accounts["2"]
+    cases = {
+        "deposit": (lambda: deposit.__wrapped__(saver, "1", "PKR"), lambda: deposit(saver, "1", "PKR"), calls),
+        "withdraw": (lambda: withdraw.__wrapped__(account, "1", "PKR", spender),
+                     lambda: withdraw(account, "1", "PKR", spender), calls),
+        "login": (lambda: login(atm, "1", "1234"), lambda: atm.login("1", "1234"), calls),
+    }
+    added = {}
+    print(f"{'operation':<18} {'plain ns':>10} {'metered ns':>11} {'added ns':>9} {'share':>7}")
+    for op, (plain, instrumented, n) in cases.items():
+        base, metered = compare(plain, instrumented, n)
+        added[op] = metered - base
+        print(f"{op:<18} {base:>10,.0f} {metered:>11,.0f} {added[op]:>9,.0f} {added[op] / base:>7.1%}")
+
+    directory = tempfile.mkdtemp(prefix="atm-metrics-")
+    storage = JournalStorage(directory)
+    durable = open_bank(storage).accounts["1"]
+    durable_ns = min(timed(lambda: durable.deposit("1", "PKR"), DURABLE_CALLS) for _ in range(ROUNDS))
+    storage.close()
+    shutil.rmtree(directory)
+    User.pin_hasher.shutdown()
+
+    worst = max(added.values())
+    share = worst / durable_ns * 100
+    print(f"{'durable deposit':<18} {durable_ns:>10,.0f}")
+    print(f"\nworst added {worst:,.0f} ns per call, {share:.2f}% of a durable deposit "
+          f"(budget {BUDGET_PERCENT}%)")
+    if share > BUDGET_PERCENT:
+        print("OVER BUDGET")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
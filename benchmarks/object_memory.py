@@ -0,0 +1,126 @@
+# OBJECT MEMORY
+# Bytes of Python memory per resident user and per account, measured with
+# tracemalloc over many objects built the way the ATM loads them. Accounts
+# are measured empty and with a short history, since most customers have
+# only a handful of transactions in memory.
+#
+# Each is measured twice: as the ATM builds it now (__slots__, withdrawal
+# totals in an array, a log that grows with its history) and in the layout
+# it replaced, rebuilt below as Old* classes holding the same fields in a
+# __dict__, withdrawal totals in a dict and a ring allocated at full
+# capacity up front, so the saving can be reproduced.
+# Run with: python benchmarks/object_memory.py [objects]
+
+import gc
+import os
+import sys
+import threading
+import tracemalloc
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank import User, CurrentAccount  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+from transaction_log import DEPOSIT, TransactionLog  # noqa: E402
+
+OBJECTS = 20_000
+HISTORY = 5
+
+
+def measure(build, n):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(n)]
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return held / n
+
+
+# ---------------- PREVIOUS LAYOUT ----------------
+class OldUser:
+    def __init__(self, user_id, name, pin_hash):
+        self.user_id = user_id
+        self.name = name
+        self.is_admin = False
+        self._User__pin_hash = pin_hash
+        self.failed_attempts = 0
+        self.locked = False
+        self.locked_until = None
+        self._unlock_timer = None
+        self.daily_withdrawals = {"PKR": 0, "USD": 0, "EUR": 0}
+        self.last_withdrawal_day = User.business_day
+        self._lock = threading.RLock()
+
+
+class OldTransactionLog:
+    # The ring allocated at full capacity; appends as TransactionLog's.
+    append = TransactionLog.append
+    _spill_oldest = TransactionLog._spill_oldest
+    _reserve = TransactionLog._reserve      # a no-op: the ring is already full size
+    _columns = TransactionLog._columns
+
+    def __init__(self, capacity=TransactionLog.CAPACITY):
+        self.capacity = capacity
+        self.spill_path = None
+        self._kinds = array("b", bytes(capacity))
+        self._amounts = array("q", [0]) * capacity
+        self._currencies = array("b", bytes(capacity))
+        self._amounts_pkr = array("q", [0]) * capacity
+        self._timestamps = array("q", [0]) * capacity
+        self._loan_ids = array("q", [0]) * capacity
+        self._rate_versions = array("I", [0]) * capacity
+        self._start = 0
+        self._size = 0
+        self._flushed = 0
+        self._pending = bytearray()
+
+
+class OldAccount:
+    def __init__(self, balance_paisa):
+        self._balance_pkr = balance_paisa
+        self.transactions = OldTransactionLog()
+        self.loans = {}
+        self._lock = threading.RLock()
+        self.owner_id = None
+        self.version = 0
+
+
+# ---------------- BUILDERS ----------------
+def user(i, pin_hash):
+    return User.from_record(str(100_000 + i), f"User {i}", pin_hash)
+
+
+def old_user(i, pin_hash):
+    return OldUser(str(100_000 + i), f"User {i}", pin_hash)
+
+
+def account(history, cls=CurrentAccount.from_record):
+    account = cls(100_00)
+    for _ in range(history):
+        account.transactions.append(DEPOSIT, 100, "PKR", 100, timestamp=1_700_000_000)
+    return account
+
+
+def run():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else OBJECTS
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1,), pool_size=0)
+    # Every user gets a hash of its own, as real ones do; the string itself
+    # is not what this measures, so it is built outside the measured loop.
+    pin_hashes = [User.pin_hasher.hash(str(i)) for i in range(n)]
+    cases = (
+        ("user", lambda i: old_user(i, pin_hashes[i]), lambda i: user(i, pin_hashes[i])),
+        ("account, no transactions", lambda i: account(0, OldAccount), lambda i: account(0)),
+        (f"account, {HISTORY} transactions", lambda i: account(HISTORY, OldAccount), lambda i: account(HISTORY)),
+    )
+    print(f"{'bytes each':<28} {'before':>8} {'after':>8} {'saved':>7}")
+    for name, old, new in cases:
+        before, after = measure(old, n), measure(new, n)
+        print(f"{name:<28} {before:>8.0f} {after:>8.0f} {1 - after / before:>7.0%}")
+
+
+if __name__ == "__main__":
+    run()
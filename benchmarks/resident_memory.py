@@ -0,0 +1,70 @@
+# RESIDENT MEMORY
+# Logs in customers from a large snapshot, most of them from a small active
+# set, and reports how much Python memory the ATM holds with the resident
+# LRU bounded and unbounded. With a bound, memory follows the active set;
+# without one it follows every customer that has ever been touched.
+# Run with: python benchmarks/resident_memory.py [accounts] [logins]
+
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cold_start import build  # noqa: E402
+from bank import ATM, User  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+
+ACCOUNTS = 200_000
+LOGINS = 100_000
+ACTIVE = 2_000          # customers making most of the logins
+ACTIVE_SHARE = 0.9
+MAX_USERS = 5_000
+
+
+def run_case(directory, user_ids, logins, max_users):
+    rnd = random.Random(1)
+    active = user_ids[:ACTIVE]
+    gc.collect()
+    tracemalloc.start()
+    storage = JournalStorage(directory)
+    atm = ATM.from_storage(storage, max_users=max_users or sys.maxsize)
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for _ in range(logins):
+        user_id = rnd.choice(active) if rnd.random() < ACTIVE_SHARE else rnd.choice(user_ids)
+        user, _ = atm.login(user_id, "1234")
+        atm.accounts[user_id].balance
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    residents = atm.residents
+    print(f"{max_users or 'unbounded':>9} {residents.resident:>9,} {held / 2**20:>9.1f} "
+          f"{residents.hits / max(residents.hits + residents.misses, 1):>8.1%} {residents.evictions:>9,} "
+          f"{logins / elapsed:>9.0f}")
+    storage.close()
+
+
+def run():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else ACCOUNTS
+    logins = int(sys.argv[2]) if len(sys.argv) > 2 else LOGINS
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1,), pool_size=0)
+    directory = tempfile.mkdtemp(prefix="atm-resident-")
+    user_ids = build(directory, accounts)
+    random.Random(0).shuffle(user_ids)
+    print(f"{accounts:,} accounts, {logins:,} logins, {ACTIVE_SHARE:.0%} of them by {ACTIVE:,} active customers")
+    print(f"{'max users':>9} {'resident':>9} {'MiB held':>9} {'hit rate':>8} {'evictions':>9} {'logins/s':>9}")
+    run_case(directory, user_ids, logins, MAX_USERS)
+    run_case(directory, user_ids, logins, None)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,91 @@
+# SERVICE LOAD
+# Starts the asyncio ATM service against a journal-backed bank and opens
+# thousands of terminal connections to it from the same process. All of
+# them stay connected while each logs in and then alternates deposits and
+# balance checks, so the service is holding every connection at once.
+# Reports requests per second and the p50/p99 request latency.
+# Run with: python benchmarks/service_load.py [connections] [requests per connection]
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank import ATM, User, CurrentAccount  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+from service import ATMService  # noqa: E402
+
+CONNECTIONS = 2_000
+REQUESTS = 10
+CUSTOMERS = 500
+
+
+async def terminal(host, port, user_id, requests, latencies, connected, start):
+    reader, writer = await asyncio.open_connection(host, port)
+    connected.append(1)
+    await start.wait()
+
+    async def call(**request):
+        began = time.perf_counter()
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - began)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response
+
+    token = (await call(op="login", user_id=user_id, pin="1234"))["token"]
+    for i in range(requests):
+        if i % 2:
+            await call(op="balance", token=token)
+        else:
+            await call(op="deposit", token=token, amount="1", currency="PKR")
+    await call(op="logout", token=token)
+    writer.close()
+
+
+async def run_case(connections, requests):
+    directory = tempfile.mkdtemp(prefix="atm-service-")
+    storage = JournalStorage(directory)
+    atm = ATM.from_storage(storage)
+    for i in range(CUSTOMERS):
+        atm.add_user(User(str(i), f"User {i}", "1234"), CurrentAccount(0))
+    service = ATMService(atm)
+    host, port = await service.start("127.0.0.1", 0)
+
+    latencies, connected, start = [], [], asyncio.Event()
+    clients = [asyncio.create_task(terminal(host, port, str(i % CUSTOMERS), requests, latencies, connected, start))
+               for i in range(connections)]
+    while len(connected) < connections:
+        await asyncio.sleep(0.01)
+    held = service.connections
+    began = time.perf_counter()
+    start.set()
+    await asyncio.gather(*clients)
+    elapsed = time.perf_counter() - began
+    await service.close()
+    storage.close()
+    shutil.rmtree(directory)
+
+    latencies.sort()
+    print(f"{held:>11,} {len(latencies):>9,} {elapsed:>8.1f} {len(latencies) / elapsed:>8,.0f} "
+          f"{latencies[len(latencies) // 2] * 1000:>8.1f} {latencies[int(len(latencies) * 0.99)] * 1000:>8.1f}")
+
+
+def run():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else CONNECTIONS
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else REQUESTS
+    User.pin_hasher = PinHasher(algorithm="pbkdf2_sha256", cost=(1000,), pool_size=0)
+    print(f"{'connections':>11} {'requests':>9} {'seconds':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    asyncio.run(run_case(connections, requests))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,77 @@
+# CONCURRENCY STRESS TEST
+# Hammers a single shared account from many threads and checks that no
+# money is created or lost and that the account is never overdrawn.
+# Run with: python benchmarks/stress_concurrency.py
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bank import ATM, User, CurrentAccount, SavingsAccount  # noqa: E402
+from money import to_minor  # noqa: E402
+from transaction_log import CURRENCY_CODES  # noqa: E402
+
+THREADS = 16
+DEPOSITS_PER_THREAD = 2000
+WITHDRAWALS_PER_THREAD = 50
+WITHDRAWAL_PKR = 100
+OPENING_BALANCE = 5000
+
+
+def hammer(account, user, barrier, successes):
+    barrier.wait()
+    won = 0
+    for i in range(max(DEPOSITS_PER_THREAD, WITHDRAWALS_PER_THREAD)):
+        if i < DEPOSITS_PER_THREAD:
+            account.deposit(1, "PKR")
+        if i < WITHDRAWALS_PER_THREAD:
+            if "successful" in account.withdraw(WITHDRAWAL_PKR, "PKR", user):
+                won += 1
+    successes.append(won)
+
+
+def run():
+    # Force frequent thread switches so unsynchronized read-modify-write
+    # sequences would actually interleave.
+    sys.setswitchinterval(1e-6)
+
+    atm = ATM()
+    user = User("101", "Stress", "1234")
+    atm.add_user(user, CurrentAccount(OPENING_BALANCE))
+    neighbour = User("102", "Neighbour", "4321")
+    atm.add_user(neighbour, SavingsAccount(OPENING_BALANCE))
+    account = atm.accounts["101"]
+
+    barrier = threading.Barrier(THREADS + 1)
+    successes = []
+    threads = [threading.Thread(target=hammer, args=(account, user, barrier, successes))
+               for _ in range(THREADS)]
+    threads.append(threading.Thread(target=hammer, args=(atm.accounts["102"], neighbour, barrier, [])))
+    for t in threads:
+        t.start()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    withdrawn = sum(successes) * WITHDRAWAL_PKR
+    expected = OPENING_BALANCE + THREADS * DEPOSITS_PER_THREAD - withdrawn
+    ops = (THREADS + 1) * (DEPOSITS_PER_THREAD + WITHDRAWALS_PER_THREAD)
+    print(f"{ops} operations in {elapsed:.2f}s ({ops / elapsed:.0f} ops/s)")
+    print(f"Successful withdrawals: {sum(successes)} (PKR {withdrawn})")
+    print(f"Final balance: PKR {account.balance}, expected PKR {expected}")
+
+    ok = (account.balance == expected
+          and account.balance >= 0
+          and user.daily_withdrawals[CURRENCY_CODES["PKR"]] == to_minor(withdrawn)
+          and withdrawn <= CurrentAccount.DAILY_LIMITS["PKR"]
+          and len(account.transactions) == THREADS * DEPOSITS_PER_THREAD + sum(successes))
+    print("PASS" if ok else "FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run() else 1)
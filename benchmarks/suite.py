@@ -0,0 +1,267 @@
+# BENCHMARK SUITE
+# Latency and throughput of the ATM core as the bank grows. For each size a
+# synthetic bank (half savings, half current accounts, a few transactions
+# each) is written straight to a snapshot, opened through JournalStorage as
+# the app would, and driven with a seeded random mix of operations. Every
+# operation is timed on its own and reported as throughput plus p50/p95/p99
+# latency; get_all_transactions reads every account, so it is run a few
+# times on its own after the mix rather than inside it.
+#
+# Deposits, withdrawals and loans return once fsynced, so with one thread
+# their latency includes the group commit budget (--commit-delay).
+#
+# Results can be written as JSON and compared with an earlier run, which
+# flags operations whose p50 or p99 got slower than the threshold.
+#
+# Run with: python benchmarks/suite.py [--accounts 1000,100000] [--ops N]
+#           [--mix login=20,deposit=25,...] [--threads N] [--json out.json]
+#           [--compare old.json]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot  # noqa: E402
+from bank import ATM, User  # noqa: E402
+from journal import JournalStorage  # noqa: E402
+from pin_hashing import PinHasher  # noqa: E402
+from transaction_index import TransactionIndex  # noqa: E402
+from transaction_log import RECORD, DEPOSIT  # noqa: E402
+
+ACCOUNTS = "1000,10000,100000"
+OPS = 20_000
+MIX = "login=20,deposit=25,savings_withdraw=15,current_withdraw=15,take_loan=10,pay_loan=15"
+HISTORY = 4              # transactions per account in the snapshot
+SCANS = 3                # get_all_transactions calls per size
+SCAN_LIMIT = 100_000     # largest bank get_all_transactions is run on
+FIRST_ID = 10_000_000    # fixed-width ids sort the same as numbers
+PIN = "1234"
+REGRESSION = 0.10        # slowdown flagged by --compare
+
+
+# ======================================================
+# SYNTHETIC BANK
+# ======================================================
+def user_id(i):
+    return str(FIRST_ID + i)
+
+
+def is_savings(i):
+    return i % 2 == 0
+
+
+def build(directory, accounts, history):
+    # Written straight to a snapshot, as a bank of this size would be
+    # after its last snapshot.
+    pin_hash = User.pin_hasher.hash(PIN)
+    now = int(time.time())
+    records = b"".join(RECORD.pack(DEPOSIT, 1000_00, 0, 1000_00, now, -1, 1) for _ in range(history))
+    index = TransactionIndex()
+    for i in range(accounts):
+        index.add_many(user_id(i), 0, [DEPOSIT] * history, ["PKR"] * history, [1000_00] * history, now)
+    users = ((user_id(i), snapshot.encode_user(
+        user_id(i), f"Customer {i}", pin_hash, False, None, 0, (0, 0, 0),
+        "SavingsAccount" if is_savings(i) else "CurrentAccount", history * 1000_00 + 50_000_00, records))
+        for i in range(accounts))
+    snapshot.write(os.path.join(directory, "snapshot.bin"), 0, 1, users, [], index.dump())
+
+
+# ======================================================
+# OPERATIONS
+# ======================================================
+class Driver:
+    # One thread's share of the mix: picks customers at random and keeps
+    # track of the loans it has taken so pay_loan always has one to pay.
+    def __init__(self, atm, accounts, seed):
+        self.atm = atm
+        self.accounts = accounts
+        self.rnd = random.Random(seed)
+        self.loans = []   # (user_id, loan_id)
+
+    def customer(self, savings=None):
+        i = self.rnd.randrange(self.accounts)
+        if savings is not None and is_savings(i) != savings:
+            i = i + 1 if i + 1 < self.accounts else i - 1
+        return user_id(i)
+
+    def prepare(self, op):
+        # Untimed setup; returns the call to time.
+        atm = self.atm
+        if op == "login":
+            uid = self.customer()
+            return lambda: atm.login(uid, PIN)
+        if op == "deposit":
+            account = atm.accounts[self.customer()]
+            return lambda: account.deposit("100", "PKR")
+        if op in ("savings_withdraw", "current_withdraw"):
+            uid = self.customer(savings=op == "savings_withdraw")
+            account, user = atm.accounts[uid], atm.users[uid]
+            return lambda: account.withdraw("10", "PKR", user)
+        if op == "take_loan":
+            uid = self.customer()
+            account = atm.accounts[uid]
+
+            def take_loan():
+                account.take_loan("1000", "PKR", "months", 12)
+                self.loans.append((uid, next(reversed(account.loans))))
+            return take_loan
+        if op == "pay_loan":
+            if not self.loans:
+                self.prepare("take_loan")()
+            uid, loan_id = self.loans.pop(self.rnd.randrange(len(self.loans)))
+            account = atm.accounts[uid]
+            return lambda: account.pay_loan(loan_id, "100")
+        if op == "get_all_transactions":
+            return atm.get_all_transactions
+        raise ValueError(f"unknown operation {op}")
+
+    def run(self, ops, mix, latencies):
+        names, weights = zip(*mix.items())
+        for op in self.rnd.choices(names, weights, k=ops):
+            call = self.prepare(op)
+            start = time.perf_counter_ns()
+            call()
+            latencies.setdefault(op, []).append(time.perf_counter_ns() - start)
+
+
+def summarize(samples):
+    samples.sort()
+    n = len(samples)
+
+    def pct(p):
+        return samples[min(n - 1, int(n * p))] / 1000
+
+    return {"count": n, "ops_per_second": round(n / (sum(samples) / 1e9), 1),
+            "p50_us": round(pct(0.50), 1), "p95_us": round(pct(0.95), 1), "p99_us": round(pct(0.99), 1),
+            "max_us": round(samples[-1] / 1000, 1)}
+
+
+def run_size(accounts, args, mix):
+    directory = tempfile.mkdtemp(prefix="atm-suite-")
+    start = time.perf_counter()
+    build(directory, accounts, args.history)
+    built = time.perf_counter() - start
+
+    start = time.perf_counter()
+    storage = JournalStorage(directory, commit_delay=args.commit_delay)
+    atm = ATM.from_storage(storage)
+    opened = time.perf_counter() - start
+
+    per_thread = [{} for _ in range(args.threads)]
+    drivers = [Driver(atm, accounts, args.seed + i) for i in range(args.threads)]
+    workers = [threading.Thread(target=driver.run, args=(args.ops // args.threads, mix, latencies))
+               for driver, latencies in zip(drivers, per_thread)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    latencies = {}
+    for thread_latencies in per_thread:
+        for op, samples in thread_latencies.items():
+            latencies.setdefault(op, []).extend(samples)
+    if accounts <= args.scan_limit:
+        drivers[0].run(args.scans, {"get_all_transactions": 1}, latencies)
+
+    storage.close()
+    shutil.rmtree(directory)
+    total = sum(len(latencies[op]) for op in mix if op in latencies)
+    return {"accounts": accounts, "build_seconds": round(built, 2), "open_ms": round(opened * 1000, 1),
+            "resident": atm.residents.resident, "mix_seconds": round(elapsed, 3),
+            "mix_ops_per_second": round(total / elapsed, 1),
+            "operations": {op: summarize(samples) for op, samples in sorted(latencies.items())}}
+
+
+# ======================================================
+# REPORTING
+# ======================================================
+def print_result(result):
+    print(f"\n{result['accounts']:,} accounts: built in {result['build_seconds']} s, opened in "
+          f"{result['open_ms']} ms, mix at {result['mix_ops_per_second']:,.0f} ops/s")
+    print(f"  {'operation':<22} {'count':>7} {'ops/s':>10} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9} {'max us':>10}")
+    for op, s in result["operations"].items():
+        print(f"  {op:<22} {s['count']:>7,} {s['ops_per_second']:>10,.0f} {s['p50_us']:>9,.1f} "
+              f"{s['p95_us']:>9,.1f} {s['p99_us']:>9,.1f} {s['max_us']:>10,.1f}")
+
+
+def compare(results, args, path, threshold):
+    # Prints how p50/p99 moved against an earlier run; returns the number of
+    # regressions beyond threshold.
+    with open(path) as f:
+        earlier = json.load(f)
+    before = {r["accounts"]: r for r in earlier["results"]}
+    regressions = 0
+    print(f"\nagainst {path}:")
+    changed = {k: v for k, v in earlier["meta"]["args"].items()
+               if k not in ("accounts", "threshold") and getattr(args, k, v) != v}
+    if changed:
+        print(f"  (that run used different settings: {changed})")
+    for result in results:
+        old = before.get(result["accounts"])
+        if old is None:
+            continue
+        for op, s in result["operations"].items():
+            if op not in old["operations"]:
+                continue
+            changes = {p: s[p] / old["operations"][op][p] - 1 for p in ("p50_us", "p99_us")
+                       if old["operations"][op][p]}
+            flag = any(change > threshold for change in changes.values())
+            regressions += flag
+            print(f"  {result['accounts']:>10,} {op:<22} "
+                  + " ".join(f"{p[:3]} {change:+7.1%}" for p, change in changes.items())
+                  + ("  REGRESSION" if flag else ""))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ATM core latency benchmarks")
+    parser.add_argument("--accounts", default=ACCOUNTS, help="comma-separated bank sizes, e.g. 1000,10000000")
+    parser.add_argument("--ops", type=int, default=OPS, help="operations in the mix per size")
+    parser.add_argument("--mix", default=MIX, help="op=weight pairs")
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--history", type=int, default=HISTORY)
+    parser.add_argument("--scans", type=int, default=SCANS, help="get_all_transactions calls per size")
+    parser.add_argument("--scan-limit", type=int, default=SCAN_LIMIT)
+    parser.add_argument("--commit-delay", type=float, default=None, help="group commit budget in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pin-cost", type=int, default=1000,
+                        help="PBKDF2 iterations for the synthetic PINs; 0 uses the app's scrypt hasher")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier --json output to compare with")
+    parser.add_argument("--threshold", type=float, default=REGRESSION)
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    mix = {op: float(weight) for op, weight in (pair.split("=") for pair in args.mix.split(","))}
+    User.pin_hasher = (PinHasher() if args.pin_cost == 0
+                       else PinHasher(algorithm="pbkdf2_sha256", cost=(args.pin_cost,), pool_size=0))
+    results = []
+    for accounts in (int(n) for n in args.accounts.split(",")):
+        results.append(run_size(accounts, args, mix))
+        print_result(results[-1])
+    if args.json:
+        meta = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                "platform": platform.platform(), "cpus": os.cpu_count(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("json", "compare")}}
+        with open(args.json, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.compare and compare(results, args, args.compare, args.threshold):
+        sys.exit(1)
+    User.pin_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,116 @@
+# IDEMPOTENCY
+# Remembers what mutating calls returned, by the caller's request key, so a
+# retried request (a double-clicked button, a terminal resending after a
+# dropped connection) gets the first call's result back instead of being
+# applied twice. A key names one request: a repeat with the same details
+# returns the first result without touching the ledger, and a key sent again
+# with different details raises KeyReused.
+#
+# Entries expire after a fixed TTL and at most max_entries are kept, the
+# oldest finished one dropped first, so memory stays capped however many
+# retries arrive. An entry whose call is still running is never dropped: a
+# repeat arriving meanwhile must find it, or it would run the call again.
+# Every entry lives for the same TTL, so insertion order is expiry order and
+# expiring is popping from the front of an OrderedDict.
+#
+# A repeat that arrives while the first call is still running waits for it
+# and gets its result. A call that raised is forgotten, so it can be retried.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+TTL = 10 * 60            # seconds a result is kept for repeats
+MAX_ENTRIES = 50_000
+PENDING = object()       # result of a call still running
+FAILED = object()        # result of a call that raised
+
+
+class KeyReused(Exception):
+    def __init__(self):
+        super().__init__("Idempotency key reused for a different request.")
+
+
+def fingerprint(args, kwargs):
+    # What a call was asked to do, to tell a repeat from a key reused for
+    # something else. Kept and compared by value, not by hash: two different
+    # requests may hash alike. Objects without a value of their own (the
+    # withdrawing user) count by type: the key's scope already names them.
+    return _plain((args, sorted(kwargs.items())))
+
+
+def _plain(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_plain, value))
+    if type(value).__hash__ in (None, object.__hash__):
+        return type(value).__name__
+    return value
+
+
+class IdempotencyCache:
+    def __init__(self, ttl=TTL, max_entries=MAX_ENTRIES, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()   # key -> [expires, result, request]
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self.replays = 0                # repeats answered from the cache
+
+    def __len__(self):
+        return len(self._entries)
+
+    def run(self, key, call, request=None):
+        # call() once per key within the TTL; repeats get its result.
+        # request: what the call was asked to do, compared with repeats'.
+        while True:
+            now = self.clock()
+            with self._lock:
+                self._expire(now)
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] != request:
+                    raise KeyReused()
+                if entry is None:
+                    entry = self._entries[key] = [now + self.ttl, PENDING, request]
+                    if len(self._entries) > self.max_entries:
+                        self._evict_finished()
+                    break
+                while entry[1] is PENDING:
+                    self._done.wait()
+                if entry[1] is not FAILED:
+                    self.replays += 1
+                    return entry[1]
+            # The first call raised; this repeat runs it afresh.
+        try:
+            result = call()
+        except BaseException:
+            self._finish(key, entry, FAILED)
+            raise
+        self._finish(key, entry, result)
+        return result
+
+    def _finish(self, key, entry, result):
+        with self._lock:
+            entry[1] = result
+            if result is FAILED and self._entries.get(key) is entry:
+                del self._entries[key]
+            self._done.notify_all()
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            key, (expires, result, _) = next(iter(entries.items()))
+            if expires > now or result is PENDING:
+                break
+            del entries[key]
+
+    def _evict_finished(self):
+        # Drops the oldest entry whose call has returned. Calls still running
+        # are few (one per busy caller), so only they are skipped over; if
+        # every entry is running, the cache stays over its cap until one
+        # returns.
+        for key, (_, result, _) in self._entries.items():
+            if result is not PENDING:
+                del self._entries[key]
+                return
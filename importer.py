@@ -0,0 +1,195 @@
+# BULK IMPORT
+# Onboards customers from a CSV or JSON-lines file without holding the file
+# in memory. Rows are read and validated a chunk at a time; each chunk's PINs
+# are hashed in worker processes while the previous chunk is being added to
+# the bank, and every chunk is fsynced before progress is reported.
+#
+# Columns (CSV header or JSON keys):
+#   user_id, name, pin, account_type, balance   required
+#   is_admin                                   optional (true/false, 1/0)
+#   pin_hash                                   optional, instead of pin
+# account_type is savings, current or empty for no account; balance is the
+# opening balance in PKR. Rows with a pin_hash (exported from another system
+# in one of the formats pin_hashing accepts) skip hashing altogether; a hash
+# pin_hashing cannot parse rejects its row.
+#
+# Run with: python importer.py <file> [data directory]
+
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from money import to_minor
+from pin_hashing import PinHasher, parse as parse_pin_hash
+
+
+CHUNK = 5_000              # rows validated, hashed and added at a time
+SNAPSHOT_ROWS = 250_000    # a snapshot after this many rows keeps the journal short
+MAX_REJECTIONS = 1_000     # rejections kept for the report; all are counted
+
+ACCOUNT_TYPES = {"savings": "SavingsAccount", "current": "CurrentAccount",
+                 "savingsaccount": "SavingsAccount", "currentaccount": "CurrentAccount", "": None}
+TRUE = {"1", "true", "yes", "y"}
+FALSE = {"", "0", "false", "no", "n"}
+
+
+# ======================================================
+# READING
+# ======================================================
+def read_rows(path):
+    # (line number, row dict) for every row of a .csv or .jsonl file.
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except json.JSONDecodeError:
+                        yield line_no, None
+        else:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def parse(row, atm):
+    # (user_id, name, pin, pin_hash, is_admin, account type, balance in
+    # paisa), or raises ValueError with the reason the row is rejected.
+    if not isinstance(row, dict):
+        raise ValueError("Malformed row.")
+    text = {key: str(value).strip() if value is not None else "" for key, value in row.items() if key}
+    user_id, name = text.get("user_id", ""), text.get("name", "")
+    if not user_id:
+        raise ValueError("Missing user_id.")
+    if not name:
+        raise ValueError("Missing name.")
+    pin, pin_hash = text.get("pin", ""), text.get("pin_hash", "")
+    if not pin_hash and (len(pin) != 4 or not pin.isdigit()):
+        raise ValueError("PIN must be 4 digits.")
+    if pin_hash:
+        try:
+            parse_pin_hash(pin_hash)
+        except ValueError:
+            raise ValueError("Invalid pin_hash.") from None
+    admin = text.get("is_admin", "").lower()
+    if admin not in TRUE and admin not in FALSE:
+        raise ValueError("is_admin must be true or false.")
+    account_type = text.get("account_type", "").lower()
+    if account_type not in ACCOUNT_TYPES:
+        raise ValueError("Unknown account type.")
+    account_type = ACCOUNT_TYPES[account_type]
+    balance = to_minor(text.get("balance") or 0)
+    if balance < 0:
+        raise ValueError("Opening balance cannot be negative.")
+    if account_type and balance < to_minor(atm.ACCOUNT_TYPES[account_type].MIN_BALANCE_PKR):
+        raise ValueError("Minimum balance requirement not met.")
+    return user_id, name, pin, pin_hash, admin in TRUE, account_type, balance
+
+
+# ======================================================
+# IMPORT
+# ======================================================
+def import_users(atm, user_cls, path, chunk_size=None, hasher=None, progress=None):
+    # Adds every valid row of path to atm and returns a report like
+    # process_batch's. progress, if given, is called with the running report
+    # after every chunk. hasher defaults to the bank's algorithm and cost with
+    # one worker process per core.
+    chunk_size = chunk_size or CHUNK
+    own_hasher = hasher is None
+    if own_hasher:
+        base = user_cls.pin_hasher
+        hasher = PinHasher(base.algorithm, base.cost, pool_size=os.cpu_count() or 1)
+    report = {"read": 0, "imported": 0, "rejected": 0, "rejections": [], "elapsed": 0.0, "rows_per_second": 0.0}
+    start = time.perf_counter()
+    since_snapshot = 0
+
+    def reject(line_no, user_id, reason):
+        report["rejected"] += 1
+        if len(report["rejections"]) < MAX_REJECTIONS:
+            report["rejections"].append((line_no, user_id, reason))
+
+    def validated(chunk):
+        # Rows that pass, with the pins still to hash; ids are checked
+        # against the bank here and again when added.
+        rows, seen = [], set()
+        for line_no, row in chunk:
+            try:
+                fields = parse(row, atm)
+            except ValueError as e:
+                reject(line_no, row.get("user_id") if isinstance(row, dict) else None, str(e))
+                continue
+            if fields[0] in seen or fields[0] in atm.users:
+                reject(line_no, fields[0], "Duplicate user_id.")
+                continue
+            seen.add(fields[0])
+            rows.append((line_no, fields))
+        return rows
+
+    def hash_pins(rows):
+        pins = [fields[2] for _, fields in rows if not fields[3]]
+        return iter(hasher.hash_many(pins)) if pins else iter(())
+
+    def add(rows, hashes):
+        for line_no, (user_id, name, _, pin_hash, is_admin, account_type, balance) in rows:
+            pin_hash = pin_hash or next(hashes)
+            if user_id in atm.users:  # added since it was validated
+                reject(line_no, user_id, "Duplicate user_id.")
+                continue
+            account = atm.ACCOUNT_TYPES[account_type].from_record(balance) if account_type else None
+            atm.add_user(user_cls.from_record(user_id, name, pin_hash, is_admin), account)
+            report["imported"] += 1
+        atm.storage.sync()
+
+    rows = iter(read_rows(path))
+    # One chunk is hashed in the background while the one before it is added.
+    with ThreadPoolExecutor(max_workers=1) as hashing:
+        pending = None
+        while True:
+            chunk = [row for _, row in zip(range(chunk_size), rows)]
+            report["read"] += len(chunk)
+            valid = validated(chunk)
+            hashed = hashing.submit(hash_pins, valid) if valid else None
+            if pending is not None:
+                add(*pending)
+                since_snapshot += len(pending[0])
+                if since_snapshot >= SNAPSHOT_ROWS:
+                    atm.snapshot()
+                    since_snapshot = 0
+                report["elapsed"] = time.perf_counter() - start
+                report["rows_per_second"] = report["read"] / max(report["elapsed"], 1e-9)
+                if progress:
+                    progress(report)
+            pending = (valid, hashed.result()) if hashed else None
+            if not chunk:
+                break
+    if since_snapshot:
+        atm.snapshot()
+    if own_hasher:
+        hasher.shutdown()
+    report["elapsed"] = time.perf_counter() - start
+    report["rows_per_second"] = report["read"] / max(report["elapsed"], 1e-9)
+    return report
+
+
+def print_progress(report):
+    print(f"{report['read']:>12,} read {report['imported']:>12,} imported {report['rejected']:>9,} rejected "
+          f"{report['rows_per_second']:>9,.0f} rows/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    from bank import ATM
+    from journal import JournalStorage
+
+    if len(sys.argv) < 2:
+        sys.exit("usage: python importer.py <file> [data directory]")
+    storage = JournalStorage(sys.argv[2] if len(sys.argv) > 2 else "atm_data")
+    atm = ATM.from_storage(storage)
+    result = atm.import_users(sys.argv[1], progress=print_progress)
+    for line_no, user_id, reason in result["rejections"]:
+        print(f"line {line_no}: {user_id or '-'}: {reason}")
+    print(f"imported {result['imported']:,} of {result['read']:,} rows in {result['elapsed']:.1f} s, "
+          f"{result['rejected']:,} rejected")
+    atm.close()
@@ -0,0 +1,420 @@
+# JOURNAL
+# Event-sourced persistence. Every state change is appended to an
+# append-only journal as a small binary event, and the whole bank is written
+# to a snapshot (see snapshot.py) from time to time. Startup memory-maps the
+# latest snapshot and replays only the events written after it, so it costs
+# the same however many accounts the bank holds.
+#
+# Each event is framed as (length, crc32) + payload, so a record torn by a
+# crash is detected and cut off on the next start. The journal is split into
+# segments named after their first sequence number; a snapshot starts a new
+# segment, and segments it fully covers are deleted once it is on disk.
+# Every event can be applied twice without effect (see ATM._apply), so
+# replay does not have to know exactly where the snapshot stopped.
+#
+# Appends reach the OS straight away but are only durable once fsynced.
+# Callers that need durability call sync(), which group-commits: the first
+# caller waits up to commit_delay for others to append, then one fsync
+# covers all of them.
+#
+# Users evicted from memory are written back to a scratch file until the
+# next snapshot takes them in. It only saves replaying their journal in
+# memory: after a crash the snapshot and journal alone rebuild everything.
+
+import atexit
+import datetime
+import glob
+import os
+import struct
+import threading
+import time
+import zlib
+
+import snapshot
+from snapshot import Cursor, pack_str
+from storage import Storage, loan_row
+from transaction_log import RECORD, CURRENCY_CODES, NO_LOAN
+
+FRAME = struct.Struct("<II")    # payload length, crc32 of the payload
+EVENT = struct.Struct("<QB")    # sequence number, event type
+FLAG = struct.Struct("<B")
+LEDGER = struct.Struct("<qQ")   # balance after the change, log position of the first record
+LOAN_ID = struct.Struct("<q")
+ACCRUAL = struct.Struct("<qqq")  # remaining_amount, accrued_interest, loan_id
+
+# Event types
+USER = 0            # (user_id, name, pin_hash, is_admin, locked_until, lock_reason)
+ACCOUNT = 1         # (user_id, account_type, balance_pkr)
+TRANSACTIONS = 2    # user_id, balance_pkr, position, packed RECORDs
+LOAN = 3            # Storage.load_loans row
+LOAN_DELETE = 4     # loan_id
+LOAN_ACCRUAL = 5    # accrued_through, [(remaining_amount, accrued_interest, loan_id)]
+
+
+def decode(kind, body):
+    cursor = Cursor(body)
+    if kind == USER:
+        user_id, name, pin_hash = cursor.str(), cursor.str(), cursor.str()
+        (is_admin,) = cursor.unpack(FLAG)
+        locked_until = cursor.str() or None
+        # Events journaled before lock reasons were kept end here.
+        reason = cursor.str() or None if cursor.offset < len(body) else None
+        return USER, (user_id, name, pin_hash, is_admin, locked_until, reason)
+    if kind == ACCOUNT:
+        user_id, account_type = cursor.str(), cursor.str()
+        balance, _ = cursor.unpack(LEDGER)
+        return ACCOUNT, (user_id, account_type, balance)
+    if kind == TRANSACTIONS:
+        user_id = cursor.str()
+        balance, position = cursor.unpack(LEDGER)
+        return TRANSACTIONS, user_id, balance, position, bytes(body[cursor.offset:])
+    if kind == LOAN:
+        return LOAN, snapshot.decode_loan(cursor)
+    if kind == LOAN_DELETE:
+        return LOAN_DELETE, cursor.unpack(LOAN_ID)[0]
+    if kind == LOAN_ACCRUAL:
+        through = cursor.str()
+        return LOAN_ACCRUAL, through, list(ACCRUAL.iter_unpack(body[cursor.offset:]))
+    raise ValueError(f"Unknown journal event type {kind}.")
+
+
+# ======================================================
+# JOURNAL FILES
+# ======================================================
+class Journal:
+    PREFIX = "journal-"
+    SUFFIX = ".log"
+    COMMIT_DELAY = 0.001  # seconds a sync may wait for others to share its fsync
+
+    def __init__(self, directory, commit_delay=None):
+        self.directory = directory
+        self.commit_delay = self.COMMIT_DELAY if commit_delay is None else commit_delay
+        self.seq = 0
+        self.durable = 0      # last sequence number known to be on disk
+        self.syncs = 0        # fsyncs issued, for measuring group commit
+        self._file = None
+        self._lock = threading.Lock()
+        self._synced = threading.Condition()
+        self._syncing = False
+        self._local = threading.local()  # last sequence number appended by each thread
+
+    def _segments(self):
+        # (first sequence number, path), oldest first.
+        names = (name for name in os.listdir(self.directory)
+                 if name.startswith(self.PREFIX) and name.endswith(self.SUFFIX))
+        return sorted((int(name[len(self.PREFIX):-len(self.SUFFIX)]), os.path.join(self.directory, name))
+                      for name in names)
+
+    def _segment_path(self, first):
+        return os.path.join(self.directory, f"{self.PREFIX}{first:020d}{self.SUFFIX}")
+
+    def open(self, after=0):
+        # Reads every intact event, returns the (type, body) of those with a
+        # sequence number above `after`, and opens the journal for appending.
+        # A torn record at the end of the newest segment is truncated away.
+        self.seq = after
+        events = []
+        segments = self._segments()
+        for i, (first, path) in enumerate(segments):
+            self.seq = max(self.seq, first - 1)
+            with open(path, "rb") as segment:
+                data = segment.read()
+            offset = 0
+            while offset + FRAME.size <= len(data):
+                length, crc = FRAME.unpack_from(data, offset)
+                end = offset + FRAME.size + length
+                payload = data[offset + FRAME.size:end]
+                if end > len(data) or zlib.crc32(payload) != crc:
+                    break
+                seq, kind = EVENT.unpack_from(payload)
+                if seq > after:
+                    events.append((kind, memoryview(payload)[EVENT.size:]))
+                self.seq = max(self.seq, seq)
+                offset = end
+            if offset < len(data):
+                if i < len(segments) - 1:
+                    raise ValueError(f"Journal segment {path} is corrupt.")
+                with open(path, "r+b") as segment:
+                    segment.truncate(offset)
+        path = segments[-1][1] if segments else self._segment_path(self.seq + 1)
+        self._file = open(path, "ab")
+        os.fsync(self._file.fileno())
+        self.durable = self.seq
+        return events
+
+    def append(self, kind, body):
+        with self._lock:
+            self.seq += 1
+            payload = EVENT.pack(self.seq, kind) + body
+            self._file.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+            self._local.seq = self.seq
+            return self.seq
+
+    def sync(self, seq=None):
+        # Blocks until every event up to seq (by default the last one this
+        # thread appended) is on disk. One caller at a time leads: it waits
+        # commit_delay, fsyncs everything appended so far and wakes every
+        # caller that fsync covered. The others wait for it.
+        if seq is None:
+            seq = getattr(self._local, "seq", 0)
+        with self._synced:
+            while self.durable < seq:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                self._synced.release()
+                try:
+                    target = self._fsync()
+                finally:
+                    self._synced.acquire()
+                    self._syncing = False
+                    self._synced.notify_all()
+                self.durable = max(self.durable, target)
+
+    def _fsync(self):
+        if self.commit_delay:
+            time.sleep(self.commit_delay)
+        with self._lock:
+            target = self.seq
+            if self._file is None:
+                return target  # closed, which syncs
+            # A duplicate descriptor stays valid if rotate() closes the file;
+            # appends carry on while the fsync runs.
+            fd = os.dup(self._file.fileno())
+        try:
+            os.fsync(fd)
+            self.syncs += 1
+        finally:
+            os.close(fd)
+        return target
+
+    def rotate(self):
+        # Starts a new segment; returns the last sequence number before it,
+        # or None once the journal is closed.
+        with self._lock:
+            if self._file is None:
+                return None
+            self._close_file()
+            self._file = open(self._segment_path(self.seq + 1), "ab")
+            return self.seq
+
+    def drop_through(self, seq):
+        # Deletes segments holding no events after `seq`.
+        segments = self._segments()
+        for (_, path), (following, _) in zip(segments, segments[1:]):
+            if following <= seq + 1:
+                os.remove(path)
+
+    def _close_file(self):
+        # Events in a closed segment count as durable, so it is fsynced first.
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._close_file()
+                self._file = None
+
+
+# ======================================================
+# WRITE-BACK FILE
+# ======================================================
+class WriteBack:
+    # Encoded records of evicted users, appended to a scratch file. Each
+    # snapshot starts a new file (rotate) and deletes the old one once it has
+    # copied the records in (drop).
+    PREFIX = "writeback-"
+
+    def __init__(self, directory):
+        self.directory = directory
+        for name in os.listdir(directory):
+            if name.startswith(self.PREFIX):
+                os.remove(os.path.join(directory, name))
+        self._generation = 0
+        self._records = {}  # user_id -> (file, offset, length)
+        self._lock = threading.Lock()
+        self._file = self._open()
+
+    def _open(self):
+        self._generation += 1
+        return open(os.path.join(self.directory, f"{self.PREFIX}{self._generation}.bin"), "a+b")
+
+    def put(self, user_id, record):
+        with self._lock:
+            offset = self._file.seek(0, os.SEEK_END)
+            self._file.write(record)
+            self._file.flush()
+            self._records[user_id] = (self._file, offset, len(record))
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._records.get(user_id)
+            if entry is None:
+                return None
+            file, offset, length = entry
+            return os.pread(file.fileno(), length, offset)
+
+    def rotate(self):
+        with self._lock:
+            old, self._file = self._file, self._open()
+            return old
+
+    def drop(self, old):
+        # Forgets the records in `old`, which the new snapshot now holds.
+        with self._lock:
+            self._records = {user_id: entry for user_id, entry in self._records.items() if entry[0] is not old}
+            old.close()
+            os.remove(old.name)
+
+
+# ======================================================
+# JOURNAL BACKEND
+# ======================================================
+class JournalStorage(Storage):
+    SNAPSHOT_INTERVAL = 600  # seconds between scheduled snapshots
+
+    def __init__(self, directory="atm_data", commit_delay=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.snapshot = snapshot.Snapshot(self.snapshot_path) if os.path.exists(self.snapshot_path) else None
+        self.journal = Journal(directory, commit_delay)
+        self._tail = self.journal.open(self.snapshot.seq if self.snapshot else 0)
+        # user_id -> (locked_until, reason) of every stored lock, for
+        # load_locks and the next snapshot: the snapshot's, then the journal's.
+        self.locks = {}
+        for user_id, locked_until, reason in (self.snapshot.locks() if self.snapshot else ()):
+            self.locks[user_id] = (locked_until, reason)
+        for kind, body in self._tail:
+            if kind == USER:
+                user_id, _, _, _, locked_until, reason = decode(kind, body)[1]
+                self._note_lock(user_id, locked_until, reason)
+        self.written_back = WriteBack(directory)
+        # Transaction log segments left by the last run; nothing reads them.
+        self.spill_directory = os.path.join(directory, "spill")
+        os.makedirs(self.spill_directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.spill_directory, "atm-tx-*.seg")):
+            os.remove(path)
+        atexit.register(self.close)
+
+    # ---------------- WRITES ----------------
+    def save_user(self, user):
+        locked_until = user.locked_until.isoformat() if user.locked_until else None
+        self.journal.append(USER, b"".join((pack_str(user.user_id), pack_str(user.name), pack_str(user.pin_hash),
+                                            FLAG.pack(bool(user.is_admin)), pack_str(locked_until),
+                                            pack_str(user.lock_reason))))
+        self._note_lock(user.user_id, locked_until, user.lock_reason)
+
+    def _note_lock(self, user_id, locked_until, reason):
+        if locked_until:
+            self.locks[user_id] = (locked_until, reason)
+        else:
+            self.locks.pop(user_id, None)
+
+    def save_account(self, user_id, account):
+        self.journal.append(ACCOUNT, pack_str(user_id) + pack_str(type(account).__name__)
+                            + LEDGER.pack(account.balance.minor, 0))
+
+    def record_transaction(self, user_id, balance_pkr, kind, amount, currency, amount_pkr, timestamp, loan_id,
+                           rate_version, position):
+        self.journal.append(TRANSACTIONS, pack_str(user_id) + LEDGER.pack(balance_pkr, position)
+                            + RECORD.pack(kind, amount, CURRENCY_CODES[currency], amount_pkr, timestamp, loan_id,
+                                          rate_version))
+
+    def record_transactions(self, user_id, balance_pkr, kinds, amounts, currencies, amounts_pkr, timestamp,
+                            rate_version, position):
+        records = b"".join(RECORD.pack(kind, amount, CURRENCY_CODES[currency], amount_pkr, timestamp, NO_LOAN,
+                                       rate_version)
+                           for kind, amount, currency, amount_pkr in zip(kinds, amounts, currencies, amounts_pkr))
+        self.journal.append(TRANSACTIONS, pack_str(user_id) + LEDGER.pack(balance_pkr, position) + records)
+
+    def save_loan(self, user_id, loan):
+        self.journal.append(LOAN, snapshot.encode_loan(loan_row(user_id, loan)))
+
+    def save_loan_accruals(self, rows, accrued_through):
+        if rows:
+            self.journal.append(LOAN_ACCRUAL, pack_str(accrued_through.isoformat())
+                                + b"".join(ACCRUAL.pack(*row) for row in rows))
+
+    def delete_loan(self, loan_id):
+        self.journal.append(LOAN_DELETE, LOAN_ID.pack(loan_id))
+
+    def sync(self):
+        self.journal.sync()
+
+    def write_back(self, user_id, record):
+        self.written_back.put(user_id, record)
+
+    def close(self):
+        self.journal.close()
+
+    # ---------------- SNAPSHOTS ----------------
+    def begin_snapshot(self):
+        # Everything journaled up to the returned sequence number must be in
+        # the snapshot; later events are replayed on top of it.
+        return self.journal.rotate()
+
+    def write_snapshot(self, seq, next_loan_id, users, loans, index):
+        # users: (user_id, record) sorted by id; a record of None means the
+        # user is not in memory, and is taken from the write-back file or
+        # copied from the current snapshot.
+        previous = self.snapshot
+        written_back = self.written_back.rotate()
+        records = ((user_id, record if record is not None else self._stored_record(user_id, previous))
+                   for user_id, record in users)
+        now = datetime.datetime.now()
+        locks = [(user_id, locked_until, reason) for user_id, (locked_until, reason) in list(self.locks.items())
+                 if datetime.datetime.fromisoformat(locked_until) > now]
+        snapshot.write(self.snapshot_path, seq, next_loan_id, records, loans, index, locks)
+        self.snapshot = snapshot.Snapshot(self.snapshot_path)
+        self.written_back.drop(written_back)
+        self.journal.drop_through(seq)
+        return self.snapshot
+
+    def _stored_record(self, user_id, previous):
+        record = self.written_back.get(user_id)
+        return record if record is not None else previous.raw(user_id)
+
+    # ---------------- READS ----------------
+    def user_ids(self):
+        return self.snapshot if self.snapshot is not None else ()
+
+    def load_locks(self):
+        return [(user_id, locked_until, reason) for user_id, (locked_until, reason) in list(self.locks.items())]
+
+    def user_name(self, user_id):
+        record = self.written_back.get(user_id)
+        if record is not None:
+            return snapshot.decode_name(record, 0)
+        return self.snapshot.name(user_id) if self.snapshot is not None else None
+
+    def load_user(self, user_id):
+        record = self.written_back.get(user_id)
+        if record is not None:
+            record = snapshot.decode_user(record, 0)
+        elif self.snapshot is not None:
+            record = self.snapshot.user(user_id)
+        if record is None:
+            return None
+        # User records do not carry the lock reason; the lock index does.
+        user_row, *rest = record
+        lock = self.locks.get(user_id)
+        return (user_row + (lock[1] if lock and lock[0] == user_row[4] else None,), *rest)
+
+    def load_loans(self):
+        return self.snapshot.loans() if self.snapshot is not None else []
+
+    def last_loan_id(self):
+        return self.snapshot.next_loan_id - 1 if self.snapshot is not None else 0
+
+    def load_transaction_index(self):
+        return self.snapshot.index() if self.snapshot is not None else None
+
+    def load_events(self):
+        # The journal tail, decoded; handed out once.
+        events, self._tail = self._tail, []
+        return [decode(kind, body) for kind, body in events]
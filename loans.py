@@ -0,0 +1,213 @@
+# LOAN REGISTRY
+# Bank-wide index of outstanding loans. Loans are found by their stable id in
+# O(1), and a heap ordered by next due date answers "what is due by this
+# date" without scanning every account. Heap entries are never updated in
+# place: rescheduling pushes a new entry and the old one is skipped when it
+# surfaces.
+#
+# Balances and accrual state live in columns (one row per loan) rather than
+# on the Loan objects, so the nightly accrual is one NumPy pass over the
+# whole book.
+
+import calendar
+import datetime
+import heapq
+import threading
+from array import array
+
+from amortization import accrue, epoch_day, from_epoch_day
+
+
+def add_months(date, months):
+    # Same day of month, clamped to the last day of shorter months.
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    return datetime.date(year, month, min(date.day, calendar.monthrange(year, month)[1]))
+
+
+# ======================================================
+# REGISTRY
+# ======================================================
+class LoanRegistry:
+    def __init__(self):
+        self._loans = {}    # loan_id -> (owner_id, loan)
+        self._owned = {}    # owner_id -> {loan_id: loan}
+        self._due = []      # (next_due, loan_id), possibly stale
+        # RLock: Account.pay_loan holds it across a read and an update.
+        self._lock = threading.RLock()
+        # Columns, indexed by loan._row. Rows of removed loans are reused.
+        self._ids = array("q")
+        self._balance = array("q")      # remaining amount, minor units
+        self._accrued = array("q")      # interest accrued since the last compounding
+        self._rate = array("d")         # annual interest rate
+        self._start = array("q")        # start date, epoch days
+        self._through = array("q")      # interest accrued up to, epoch days
+        self._periods = array("q")      # months compounded so far
+        self._live = array("b")
+        self._free = []
+
+    def __len__(self):
+        return len(self._loans)
+
+    def __contains__(self, loan_id):
+        return loan_id in self._loans
+
+    def get(self, loan_id):
+        entry = self._loans.get(loan_id)
+        return entry[1] if entry else None
+
+    def owner(self, loan_id):
+        entry = self._loans.get(loan_id)
+        return entry[0] if entry else None
+
+    def owned_by(self, owner_id):
+        # {loan_id: loan} of one owner, in the order the loans were taken.
+        with self._lock:
+            return dict(sorted(self._owned.get(owner_id, {}).items()))
+
+    def items(self):
+        with self._lock:
+            return list(self._loans.values())
+
+    def add(self, owner_id, loan):
+        with self._lock:
+            self._loans[loan.loan_id] = (owner_id, loan)
+            self._owned.setdefault(owner_id, {})[loan.loan_id] = loan
+            heapq.heappush(self._due, (loan.next_due, loan.loan_id))
+            periods = 0
+            while add_months(loan.start_date, periods + 1) <= loan.accrued_through:
+                periods += 1
+            values = (loan.loan_id, loan._remaining, loan._accrued, loan.interest_rate, epoch_day(loan.start_date),
+                      epoch_day(loan.accrued_through), periods, 1)
+            columns = (self._ids, self._balance, self._accrued, self._rate, self._start, self._through,
+                       self._periods, self._live)
+            if self._free:
+                row = self._free.pop()
+                for column, value in zip(columns, values):
+                    column[row] = value
+            else:
+                row = len(self._live)
+                for column, value in zip(columns, values):
+                    column.append(value)
+            loan._registry, loan._row = self, row
+
+    def remove(self, loan_id):
+        with self._lock:
+            entry = self._loans.pop(loan_id, None)
+            if entry is not None:
+                owner_id, loan = entry
+                owned = self._owned[owner_id]
+                del owned[loan_id]
+                if not owned:
+                    del self._owned[owner_id]
+                # Detach: the loan keeps its last values, the row is recycled.
+                loan._remaining, loan._accrued = loan.remaining_amount, loan.accrued_interest
+                loan._through = loan.accrued_through
+                self._live[loan._row] = 0
+                self._free.append(loan._row)
+                loan._registry = loan._row = None
+            self._compact()
+
+    def restore(self, loan_id, remaining_amount, accrued_interest, accrued_through):
+        # Puts back a loan's balance and accrual state as it was stored.
+        with self._lock:
+            owner_id, loan = self._loans[loan_id]
+            self.remove(loan_id)
+            loan._remaining, loan._accrued, loan._through = remaining_amount, accrued_interest, accrued_through
+            self.add(owner_id, loan)
+
+    # ---------------- BALANCES ----------------
+    def balance(self, row):
+        return self._balance[row]
+
+    def set_balance(self, row, value):
+        with self._lock:
+            self._balance[row] = value
+
+    def repay(self, loan, amount):
+        # Atomic with respect to accrual; returns the new remaining amount.
+        with self._lock:
+            self._balance[loan._row] -= amount
+            return self._balance[loan._row]
+
+    def repay_capped(self, loan, amount, log):
+        # Repays at most what is owed, atomically with respect to accrual, so
+        # the nightly run cannot change the balance between the cap and the
+        # payment. log(amount) records the payment, with the amount actually
+        # taken, before it is applied. Returns that amount.
+        with self._lock:
+            amount = min(amount, self._balance[loan._row])
+            log(amount)
+            self._balance[loan._row] -= amount
+            return amount
+
+    def accrued(self, row):
+        return self._accrued[row]
+
+    def accrued_through(self, row):
+        return from_epoch_day(self._through[row])
+
+    def accrue(self, on=None):
+        # Accrues interest on every outstanding loan up to the start of `on`
+        # (today by default). Returns (remaining_amount, accrued_interest,
+        # loan_id) rows for the loans that changed, ready for storage.
+        import numpy as np
+        until = epoch_day(on or datetime.date.today())
+        with self._lock:
+            if not self._live:
+                return []
+            ids = None
+            views = [np.frombuffer(column, dtype=dtype) for column, dtype in (
+                (self._balance, np.int64), (self._accrued, np.int64), (self._rate, np.float64),
+                (self._start, np.int64), (self._through, np.int64), (self._periods, np.int64))]
+            try:
+                live = np.frombuffer(self._live, dtype=np.int8).astype(bool)
+                changed = accrue(*views, live, until)
+                ids = np.frombuffer(self._ids, dtype=np.int64)
+                rows = list(zip(views[0][changed].tolist(), views[1][changed].tolist(), ids[changed].tolist()))
+            finally:
+                # The columns cannot grow while NumPy still holds a view.
+                del views, ids
+        return rows
+
+    def reschedule(self, loan, next_due):
+        with self._lock:
+            if next_due == loan.next_due:
+                return
+            loan.next_due = next_due
+            if loan.loan_id in self._loans:
+                heapq.heappush(self._due, (next_due, loan.loan_id))
+                self._compact()
+
+    def _current(self, entry):
+        due, loan_id = entry
+        current = self._loans.get(loan_id)
+        return current is not None and current[1].next_due == due
+
+    def _compact(self):
+        # Drops stale entries once they outnumber the live ones.
+        if len(self._due) > 2 * len(self._loans) + 64:
+            self._due = [entry for entry in self._due if self._current(entry)]
+            heapq.heapify(self._due)
+
+    def due(self, on=None, limit=None):
+        # Loans with next_due <= on, earliest first, as (owner_id, loan).
+        # Walks the heap through a second heap of candidate positions, so only
+        # the entries that are actually due are visited.
+        on = on or datetime.date.today()
+        found, seen = [], set()
+        with self._lock:
+            heap = self._due
+            frontier = [(heap[0], 0)] if heap else []
+            while frontier and (limit is None or len(found) < limit):
+                entry, i = heapq.heappop(frontier)
+                if entry[0] > on:
+                    break
+                if entry[1] not in seen and self._current(entry):
+                    seen.add(entry[1])
+                    found.append(self._loans[entry[1]])
+                for child in (2 * i + 1, 2 * i + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child], child))
+        return found
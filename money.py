@@ -0,0 +1,133 @@
+# MONEY
+# Fixed-point money. Every amount in the ledger is an integer number of
+# minor units (paisa for PKR, cents for USD/EUR), so balances and loans
+# add up exactly. Rounding only happens when converting into minor units
+# or applying a rate, always to the nearest minor unit with ties to even
+# (banker's rounding).
+
+import functools
+from decimal import Decimal, ROUND_HALF_EVEN
+
+
+SCALE = 100             # minor units per major unit
+ROUNDING = ROUND_HALF_EVEN
+MONEY_DTYPE = "int64"   # NumPy dtype for arrays of minor units
+MAX_MINOR = 2 ** 63 - 1  # the ledger stores minor units as int64
+MAX_BALANCE = 2 ** 62   # leaves int64 headroom for sums over a balance (see batch.py)
+TOO_LARGE = "Amount too large."
+
+
+# ======================================================
+# SCALAR HELPERS
+# ======================================================
+def to_minor(amount):
+    # Major units (int, float, str or Decimal) -> int minor units.
+    if isinstance(amount, int):
+        return checked(amount * SCALE)
+    try:
+        return checked(int((Decimal(str(amount)) * SCALE).to_integral_value(ROUNDING)))
+    except (ArithmeticError, ValueError) as e:
+        raise ValueError(str(e) if str(e) == TOO_LARGE else "Invalid amount.") from None
+
+
+def scale(minor, factor):
+    # minor * factor, rounded to a whole minor unit.
+    if isinstance(factor, int):
+        return checked(minor * factor)
+    return checked(int((minor * Decimal(str(factor))).to_integral_value(ROUNDING)))
+
+
+def checked(minor, limit=MAX_MINOR):
+    # minor, or ValueError when it is beyond what the ledger can hold.
+    if not -limit <= minor <= limit:
+        raise ValueError(TOO_LARGE)
+    return minor
+
+
+def to_major(minor):
+    return Decimal(minor) / SCALE
+
+
+def fmt(minor):
+    sign = "-" if minor < 0 else ""
+    whole, cents = divmod(abs(minor), SCALE)
+    return f"{sign}{whole}.{cents:02d}"
+
+
+# ======================================================
+# MONEY VALUE
+# ======================================================
+@functools.total_ordering
+class Money:
+    __slots__ = ("minor",)
+
+    def __init__(self, minor=0):
+        self.minor = int(minor)
+
+    @classmethod
+    def from_major(cls, amount):
+        return cls(to_minor(amount))
+
+    @staticmethod
+    def _minor_of(other):
+        return other.minor if isinstance(other, Money) else to_minor(other)
+
+    def __add__(self, other):
+        return Money(self.minor + self._minor_of(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.minor - self._minor_of(other))
+
+    def __rsub__(self, other):
+        return Money(self._minor_of(other) - self.minor)
+
+    def __neg__(self):
+        return Money(-self.minor)
+
+    def __abs__(self):
+        return Money(abs(self.minor))
+
+    def __eq__(self, other):
+        if not isinstance(other, (Money, int, float, Decimal)):
+            return NotImplemented
+        return self.minor == self._minor_of(other)
+
+    def __lt__(self, other):
+        if not isinstance(other, (Money, int, float, Decimal)):
+            return NotImplemented
+        return self.minor < self._minor_of(other)
+
+    def __hash__(self):
+        return hash(self.minor)
+
+    def __float__(self):
+        return self.minor / SCALE
+
+    def __str__(self):
+        return fmt(self.minor)
+
+    def __repr__(self):
+        return f"Money({fmt(self.minor)})"
+
+
+# ======================================================
+# NUMPY PATH
+# ======================================================
+def to_minor_array(amounts):
+    # Major-unit floats -> int64 minor units. The first rounding strips
+    # binary float noise (2.675 is stored as 2.67499...), the second rounds
+    # ties to even, matching to_minor.
+    import numpy as np
+    scaled = np.round(np.asarray(amounts, dtype=np.float64) * SCALE, 6)
+    return np.rint(scaled).astype(MONEY_DTYPE)
+
+
+def scale_array(minor, factors):
+    # Element-wise minor * factor, rounded like scale().
+    import numpy as np
+    factors = np.asarray(factors)
+    if factors.dtype.kind in "iu":
+        return np.asarray(minor, dtype=MONEY_DTYPE) * factors
+    return np.rint(np.round(np.asarray(minor, dtype=np.float64) * factors, 6)).astype(MONEY_DTYPE)
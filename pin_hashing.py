@@ -0,0 +1,126 @@
+# PIN HASHING
+# Salted key derivation for PINs (scrypt or PBKDF2), run in a bounded pool of
+# worker processes so slow hashing never blocks the caller's thread for
+# longer than the hash itself and never uses more than POOL_SIZE cores.
+#
+# Stored formats:
+#   scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>
+#   pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>
+#   <sha256 hex>  (legacy, unsalted; upgraded on the next successful login)
+
+import hashlib
+import hmac
+import os
+import threading
+
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+LEGACY = "sha256"
+# algorithm -> (number of cost parameters, digest bytes)
+FORMATS = {SCRYPT: (3, 64), PBKDF2: (1, 32), LEGACY: (0, 32)}
+
+
+# ======================================================
+# KEY DERIVATION (runs inside worker processes)
+# ======================================================
+def derive(pin, algorithm, params, salt):
+    if algorithm == SCRYPT:
+        n, r, p = params
+        return hashlib.scrypt(pin.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) * 2)
+    if algorithm == PBKDF2:
+        (iterations,) = params
+        return hashlib.pbkdf2_hmac("sha256", pin.encode(), salt, iterations)
+    return hashlib.sha256(pin.encode()).digest()
+
+
+def _hash(pin, algorithm, params):
+    salt = os.urandom(16)
+    digest = derive(pin, algorithm, params, salt)
+    return "$".join([algorithm, *map(str, params), salt.hex(), digest.hex()])
+
+
+def _verify(pin, algorithm, params, salt, expected):
+    return hmac.compare_digest(derive(pin, algorithm, params, salt), expected)
+
+
+def parse(stored):
+    # Raises ValueError for anything not in one of the stored formats, so a
+    # bad hash is caught where it comes in rather than at the next login.
+    if "$" not in stored:
+        algorithm, params, salt, digest = LEGACY, (), b"", bytes.fromhex(stored)
+    else:
+        algorithm, *fields = stored.split("$")
+        if algorithm not in (SCRYPT, PBKDF2) or len(fields) != FORMATS[algorithm][0] + 2:
+            raise ValueError("Unsupported PIN hash format.")
+        *params, salt, digest = fields
+        params, salt, digest = tuple(int(x) for x in params), bytes.fromhex(salt), bytes.fromhex(digest)
+        if not salt:
+            raise ValueError("Unsupported PIN hash format.")
+    if len(digest) != FORMATS[algorithm][1] or any(x < 1 for x in params):
+        raise ValueError("Unsupported PIN hash format.")
+    if algorithm == SCRYPT and (params[0] < 2 or params[0] & (params[0] - 1)):
+        raise ValueError("Unsupported PIN hash format.")  # n must be a power of two
+    return algorithm, params, salt, digest
+
+
+# ======================================================
+# HASHER
+# ======================================================
+class PinHasher:
+    POOL_SIZE = 2
+    SCRYPT_COST = (2 ** 14, 8, 1)   # n, r, p
+    PBKDF2_COST = (200_000,)        # iterations
+    TIMEOUT = 30                    # seconds
+
+    def __init__(self, algorithm=SCRYPT, cost=None, pool_size=None):
+        if algorithm not in (SCRYPT, PBKDF2):
+            raise ValueError("Unsupported PIN hashing algorithm.")
+        self.algorithm = algorithm
+        self.cost = tuple(cost or (self.SCRYPT_COST if algorithm == SCRYPT else self.PBKDF2_COST))
+        # pool_size=0 hashes inline in the calling thread.
+        self.pool_size = self.POOL_SIZE if pool_size is None else pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # Imported here: processes that never hash through the pool
+                # (pool_size=0, or only verifying legacy hashes) start faster.
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn rather than fork: the app runs several threads.
+                self._pool = ProcessPoolExecutor(max_workers=self.pool_size,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _run(self, fn, *args):
+        if not self.pool_size:
+            return fn(*args)
+        return self._executor().submit(fn, *args).result(timeout=self.TIMEOUT)
+
+    def hash(self, pin):
+        return self._run(_hash, pin, self.algorithm, self.cost)
+
+    def hash_many(self, pins):
+        if not self.pool_size:
+            return [self.hash(pin) for pin in pins]
+        chunksize = max(1, len(pins) // (self.pool_size * 4))
+        return list(self._executor().map(_hash, pins, [self.algorithm] * len(pins), [self.cost] * len(pins),
+                                         chunksize=chunksize))
+
+    def verify(self, pin, stored):
+        # Returns (matches, needs_rehash).
+        algorithm, params, salt, expected = parse(stored)
+        if algorithm == LEGACY:
+            matches = hmac.compare_digest(derive(pin, LEGACY, (), b""), expected)
+        else:
+            matches = self._run(_verify, pin, algorithm, params, salt, expected)
+        return matches, matches and (algorithm, params) != (self.algorithm, self.cost)
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
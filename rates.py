@@ -0,0 +1,149 @@
+# EXCHANGE RATES
+# Versioned exchange-rate tables. Rates are read from a JSON file (a stand-in
+# for a rate feed) and every change is published as a new immutable table
+# with the next version number. Readers just take the current table, so a
+# reload never blocks them; a conversion uses one table from start to end
+# and records its version.
+
+import json
+import math
+import os
+import threading
+import time
+
+from money import scale, scale_array
+from transaction_log import CURRENCIES
+
+
+DEFAULT_RATES = {"PKR": 1, "USD": 280, "EUR": 300}
+
+
+# ======================================================
+# RATE TABLE
+# ======================================================
+class RateTable:
+    __slots__ = ("version", "rates", "published_at")
+
+    def __init__(self, version, rates, published_at=None):
+        self.version = version
+        self.rates = dict(rates)
+        self.published_at = published_at or int(time.time())
+
+    def rate(self, currency):
+        try:
+            return self.rates[currency.upper()]
+        except KeyError:
+            raise ValueError("Unsupported currency.") from None
+
+    def to_pkr(self, amount, currency):
+        # amount and result are in minor units.
+        return scale(amount, self.rate(currency))
+
+    def to_pkr_many(self, amounts, currencies):
+        # Vectorized to_pkr: each distinct currency is looked up once.
+        import numpy as np
+        names, index = np.unique(np.char.upper(np.asarray(currencies, dtype=str)), return_inverse=True)
+        rates = np.array([self.rate(name) for name in names])
+        return scale_array(amounts, rates[index])
+
+    def to_json(self):
+        return json.dumps({"version": self.version, "published_at": self.published_at, "rates": self.rates})
+
+
+# ======================================================
+# RATE SERVICE
+# ======================================================
+class RateService:
+    POLL_SECONDS = 5
+
+    def __init__(self, path=None, history_path=None):
+        self.path = path
+        self.history_path = history_path
+        self._history = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        for line in self._read_history():
+            table = RateTable(line["version"], line["rates"], line["published_at"])
+            self._history[table.version] = table
+        if self._history:
+            self._table = self._history[max(self._history)]
+        else:
+            self._table = self._publish_locked(DEFAULT_RATES)
+        self.reload()
+
+    def _read_history(self):
+        if not self.history_path or not os.path.exists(self.history_path):
+            return []
+        with open(self.history_path) as history:
+            return [json.loads(line) for line in history if line.strip()]
+
+    # ---------------- READERS ----------------
+    def current(self):
+        return self._table
+
+    def table(self, version):
+        return self._history[version]
+
+    @property
+    def version(self):
+        return self._table.version
+
+    # ---------------- PUBLISHING ----------------
+    def _publish_locked(self, rates):
+        table = RateTable(max(self._history, default=0) + 1, rates)
+        self._history[table.version] = table
+        if self.history_path:
+            with open(self.history_path, "a") as history:
+                history.write(table.to_json() + "\n")
+        # A single reference assignment: readers see either the old table or
+        # the new one, never a mix.
+        self._table = table
+        return table
+
+    @staticmethod
+    def _valid_rate(rate):
+        return (isinstance(rate, (int, float)) and not isinstance(rate, bool)
+                and math.isfinite(rate) and rate > 0)
+
+    def publish(self, rates):
+        if not isinstance(rates, dict) or not all(isinstance(currency, str) for currency in rates):
+            raise ValueError("Invalid rate table.")
+        rates = {currency.upper(): rate for currency, rate in rates.items()}
+        # The ledger and the daily limits only know CURRENCIES; a table may
+        # leave some out but cannot add new ones.
+        if (rates.get("PKR") != 1 or not all(self._valid_rate(rate) for rate in rates.values())
+                or not rates.keys() <= set(CURRENCIES)):
+            raise ValueError("Invalid rate table.")
+        with self._lock:
+            if rates == self._table.rates:
+                return self._table
+            return self._publish_locked(rates)
+
+    def reload(self):
+        # Publishes the rate file if it changed since the last check.
+        if not self.path or not os.path.exists(self.path):
+            return False
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return False
+        with open(self.path) as feed:
+            data = json.load(feed)
+        self._mtime = mtime
+        previous = self._table
+        if isinstance(data, dict):
+            data = data.get("rates", data)
+        return self.publish(data) is not previous
+
+    def watch(self, scheduler, interval=None):
+        interval = interval or self.POLL_SECONDS
+
+        def poll():
+            try:
+                self.reload()
+            except (OSError, ValueError):
+                pass  # keep serving the last good table
+            finally:
+                # Whatever the file held, the next poll still runs.
+                scheduler.call_later(interval, poll, label="exchange rate reload")
+
+        scheduler.call_later(interval, poll, label="exchange rate reload")
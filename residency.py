@@ -0,0 +1,190 @@
+# RESIDENCY
+# Bounded LRU of the users (each with their account) currently held in
+# memory. Anything else storage knows about is loaded the first time it is
+# looked up, and the least recently used entries are evicted once there are
+# more than max_users of them or their estimated size passes max_bytes, so
+# memory follows the active customers rather than the whole bank.
+#
+# Evicting an entry writes its state back to storage (see ATM._evict) and
+# swaps the objects' storage for an Evicted stand-in. Someone may still hold
+# them (a logged-in session), so the stand-in is remembered weakly: looking
+# the user up again, or writing anything through the old objects, brings the
+# same objects back instead of loading a second copy.
+
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+class Residency:
+    def __init__(self, load, register, stored=(), lock=None, max_users=None, max_bytes=None, sizeof=None,
+                 evict=None):
+        self._load = load            # builds a stored user and registers it
+        self._register = register    # (user, account): makes them resident again through put()
+        self._stored = stored        # sized container of user ids held by storage
+        self._added = set()          # user ids put here that storage may not know yet
+        self._entries = OrderedDict()     # user_id -> (user, account, size), oldest first
+        self._evicting = {}               # user_id -> (user, account) being written back
+        self._ghosts = weakref.WeakValueDictionary()  # user_id -> Evicted, while still referenced
+        self._lock = lock or threading.RLock()
+        self._evict_lock = threading.Lock()
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof or (lambda user, account: 0)
+        self._evict = evict          # (user_id, user, account) -> Evicted
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.users = ResidentView(self, 0)
+        self.accounts = ResidentView(self, 1)
+
+    def _unstored(self):
+        # Storage may list an added user before saved() or restore() drops it.
+        # Sorted, so listings paged by offset see a stable order.
+        return sorted(user_id for user_id in list(self._added) if user_id not in self._stored)
+
+    def __len__(self):
+        return len(self._stored) + len(self._unstored())
+
+    def __iter__(self):
+        yield from self._stored
+        yield from self._unstored()
+
+    def __contains__(self, user_id):
+        return user_id in self._entries or user_id in self._added or user_id in self._stored
+
+    @property
+    def resident(self):
+        return len(self._entries)
+
+    def is_resident(self, user_id):
+        # Entries still being written back count: their stored state may not
+        # be up to date yet.
+        return user_id in self._entries or user_id in self._evicting
+
+    def peek(self, user_id):
+        # (user, account) if in memory, evicted or not, without loading,
+        # reviving or touching it.
+        entry = self._entries.get(user_id) or self._evicting.get(user_id)
+        if entry is None:
+            ghost = self._ghosts.get(user_id)
+            return None if ghost is None else (ghost.user, ghost.account)
+        return entry[:2]
+
+    def get(self, user_id):
+        # (user, account, size), or None for an unknown user.
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            with self._lock:
+                if user_id in self._entries:
+                    self._entries.move_to_end(user_id)
+            return entry
+        with self._lock:
+            if user_id not in self._entries:
+                self.misses += 1
+                ghost = self._evicting.get(user_id) or self._ghosts.get(user_id)
+                if isinstance(ghost, Evicted):
+                    ghost = ghost.user, ghost.account
+                if ghost is not None:
+                    self._register(*ghost)
+                elif user_id in self:
+                    self._load(user_id)
+            entry = self._entries.get(user_id)
+        self.trim()
+        return entry
+
+    def put(self, user_id, user, account):
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old is not None:
+                self.bytes -= old[2]
+            size = self._sizeof(user, account)
+            self._entries[user_id] = (user, account, size)
+            self.bytes += size
+            self._ghosts.pop(user_id, None)
+            if user_id not in self._added and user_id not in self._stored:
+                self._added.add(user_id)
+
+    def trim(self):
+        # Evicts down to the limits. Must not be called while holding an
+        # account lock: writing a victim back takes the victim's locks.
+        # Evictions run one at a time, so the same objects are never being
+        # written back twice at once.
+        with self._evict_lock:
+            while True:
+                with self._lock:
+                    over_users = self.max_users is not None and len(self._entries) > self.max_users
+                    over_bytes = self.max_bytes is not None and self.bytes > self.max_bytes
+                    if self._evict is None or not (over_users or over_bytes) or len(self._entries) <= 1:
+                        return
+                    user_id, (user, account, size) = self._entries.popitem(last=False)
+                    self.bytes -= size
+                    self.evictions += 1
+                    self._evicting[user_id] = (user, account)
+                try:
+                    ghost = self._evict(user_id, user, account)
+                except BaseException:
+                    with self._lock:
+                        del self._evicting[user_id]
+                        self._register(user, account)  # keep it rather than lose it
+                    raise
+                # In one step, so a lookup always finds the objects somewhere.
+                with self._lock:
+                    del self._evicting[user_id]
+                    if user_id not in self._entries:
+                        self._ghosts[user_id] = ghost
+
+    def restore(self, stored):
+        # Points at a new set of stored ids, e.g. after a snapshot was written.
+        with self._lock:
+            self._stored = stored
+            self._added = {user_id for user_id in self._added if user_id not in stored}
+
+    def saved(self, user_ids):
+        # Storage now lists these (see Storage.on_users_saved), so it answers
+        # for them from here on. Called from the storage's writer, which a
+        # lookup holding the lock may be waiting on, so the lock is not
+        # taken; the set update is a single step.
+        self._added -= user_ids
+
+
+class Evicted:
+    # Takes the place of the storage of an evicted user and account. It keeps
+    # both alive together, and the first write through either makes them
+    # resident again before it goes through.
+    def __init__(self, user, account, storage, revive):
+        self.user = user
+        self.account = account
+        self._storage = storage
+        self._revive = revive
+
+    def __getattr__(self, name):
+        self._revive(self.user, self.account)
+        return getattr(self._storage, name)
+
+
+class ResidentView(Mapping):
+    # users or accounts: read-only mapping over a Residency that loads on
+    # lookup. Entries are added through Residency.put.
+    def __init__(self, residency, field):
+        self._residency = residency
+        self._field = field
+
+    def __getitem__(self, user_id):
+        entry = self._residency.get(user_id)
+        if entry is None:
+            raise KeyError(user_id)
+        return entry[self._field]
+
+    def __contains__(self, user_id):
+        return user_id in self._residency
+
+    def __len__(self):
+        return len(self._residency)
+
+    def __iter__(self):
+        return iter(self._residency)
+
+    def is_resident(self, user_id):
+        return self._residency.is_resident(user_id)
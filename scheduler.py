@@ -0,0 +1,187 @@
+# SCHEDULER
+# Hierarchical timing wheel driven by one background thread. Scheduling and
+# cancelling a timer are O(1) no matter how many timers are pending, so
+# per-user events (lock expiry, freezes) scale to millions of users. A
+# timer whose callback raises is logged and the others keep firing: one bad
+# callback must not stop unlocks or the daily-limit reset.
+
+import heapq
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+# ======================================================
+# TIMER
+# ======================================================
+class Timer:
+    __slots__ = ("expires", "callback", "args", "label", "bucket")
+
+    def __init__(self, expires, callback, args, label):
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.label = label
+        self.bucket = None
+
+    @property
+    def active(self):
+        return self.bucket is not None
+
+
+# ======================================================
+# TIMING WHEEL
+# ======================================================
+class TimingWheel:
+    SLOT_BITS = 6   # 64 slots per level
+    LEVELS = 5      # 64^5 ticks, about 34 years at one tick per second
+
+    def __init__(self, current_tick):
+        self.slots = 1 << self.SLOT_BITS
+        self.mask = self.slots - 1
+        self.current_tick = current_tick
+        self.levels = [[set() for _ in range(self.slots)] for _ in range(self.LEVELS)]
+        self.count = 0
+
+    def add(self, timer, cascading=False):
+        # Timers already due fire on the next tick. During a cascade the
+        # current tick has not fired yet, so it can still take them.
+        earliest = self.current_tick if cascading else self.current_tick + 1
+        expires = max(timer.expires, earliest)
+        delta = expires - self.current_tick
+        level = 0
+        while level < self.LEVELS - 1 and delta >= 1 << (self.SLOT_BITS * (level + 1)):
+            level += 1
+        expires = min(expires, self.current_tick + (1 << (self.SLOT_BITS * self.LEVELS)) - 1)
+        bucket = self.levels[level][(expires >> (self.SLOT_BITS * level)) & self.mask]
+        bucket.add(timer)
+        timer.bucket = bucket
+        self.count += 1
+
+    def remove(self, timer):
+        if timer.bucket is not None:
+            timer.bucket.discard(timer)
+            timer.bucket = None
+            self.count -= 1
+
+    def _cascade(self, level):
+        index = (self.current_tick >> (self.SLOT_BITS * level)) & self.mask
+        bucket = self.levels[level][index]
+        self.levels[level][index] = set()
+        for timer in bucket:
+            self.count -= 1
+            self.add(timer, cascading=True)
+
+    def tick(self):
+        # Advances one tick and returns the timers that are now due.
+        self.current_tick += 1
+        level = 1
+        while level < self.LEVELS and self._cascade_needed(level):
+            self._cascade(level)
+            level += 1
+        index = self.current_tick & self.mask
+        due = self.levels[0][index]
+        self.levels[0][index] = set()
+        for timer in due:
+            timer.bucket = None
+        self.count -= len(due)
+        return due
+
+    def _cascade_needed(self, level):
+        return (self.current_tick & ((1 << (self.SLOT_BITS * level)) - 1)) == 0
+
+    def upcoming(self, n):
+        # Every bucket has a known earliest expiry (the start of its slot), so
+        # buckets are visited in that order and merged through a heap; only
+        # the buckets needed to produce n timers are ever opened.
+        buckets = []
+        for level in range(self.LEVELS):
+            shift = self.SLOT_BITS * level
+            base = self.current_tick >> shift
+            for offset in range(1, self.slots + 1):
+                bucket = self.levels[level][(base + offset) & self.mask]
+                if bucket:
+                    buckets.append(((base + offset) << shift, bucket))
+        buckets.sort(key=lambda entry: entry[0])
+        heap, found = [], []
+        for earliest, bucket in buckets:
+            while heap and heap[0][0] <= earliest and len(found) < n:
+                found.append(heapq.heappop(heap)[2])
+            if len(found) >= n:
+                return found
+            for timer in bucket:
+                heapq.heappush(heap, (timer.expires, id(timer), timer))
+        while heap and len(found) < n:
+            found.append(heapq.heappop(heap)[2])
+        return found
+
+
+# ======================================================
+# SCHEDULER THREAD
+# ======================================================
+class Scheduler:
+    TICK_SECONDS = 1.0
+
+    def __init__(self):
+        self._wheel = TimingWheel(self._now_tick())
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _now_tick(self):
+        return int(time.time() / self.TICK_SECONDS)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="atm-scheduler", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.TICK_SECONDS)
+            try:
+                self.advance()
+            except Exception:
+                log.exception("scheduler tick failed")
+
+    def advance(self, now=None):
+        target = self._now_tick() if now is None else int(now / self.TICK_SECONDS)
+        while True:
+            with self._lock:
+                if self._wheel.current_tick >= target:
+                    return
+                due = self._wheel.tick()
+            # Callbacks run outside the wheel lock so they may schedule again.
+            for timer in sorted(due, key=lambda t: t.expires):
+                try:
+                    timer.callback(*timer.args)
+                except Exception:
+                    log.exception("timer %r failed", timer.label or timer.callback)
+
+    def call_at(self, when, callback, *args, label=None):
+        # when: epoch seconds (or a datetime).
+        if hasattr(when, "timestamp"):
+            when = when.timestamp()
+        timer = Timer(int(-(-when // self.TICK_SECONDS)), callback, args, label)
+        with self._lock:
+            self._wheel.add(timer)
+        self.start()
+        return timer
+
+    def call_later(self, delay, callback, *args, label=None):
+        return self.call_at(time.time() + delay, callback, *args, label=label)
+
+    def cancel(self, timer):
+        with self._lock:
+            self._wheel.remove(timer)
+
+    def upcoming(self, n=10):
+        with self._lock:
+            timers = self._wheel.upcoming(n)
+        return [(t.expires * self.TICK_SECONDS, t.label) for t in timers]
+
+    def __len__(self):
+        return self._wheel.count
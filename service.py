@@ -0,0 +1,391 @@
+# ATM SERVICE
+# Network front-end for ATM terminals: newline-delimited JSON over TCP,
+# served by asyncio, so one process on one core holds thousands of open
+# connections. Each request is one JSON object on a line and gets one JSON
+# object back, in order, on the same connection:
+#
+#   {"id": 1, "op": "login", "user_id": "101", "pin": "1234"}
+#   {"id": 1, "ok": true, "token": "...", "name": "Anzar", "is_admin": false}
+#   {"id": 2, "op": "deposit", "token": "...", "amount": "500", "currency": "USD"}
+#   {"id": 2, "ok": true, "message": "Deposit successful. ...", "balance": "150000.00"}
+#
+# ok is false (with an error) only when the request itself could not be
+# served: bad JSON, unknown op, missing fields or an invalid session. A
+# refused withdrawal is still ok; its message says why, as in the other
+# front-ends. Amounts are strings or numbers in major units. Every request
+# is counted and timed in the bank's metrics as "service.<op>", with
+# request errors (not logged in, account locked, ...) as its outcome.
+#
+# Deposits, withdrawals, loans, payments, PIN changes and freezes take an
+# optional "idempotency_key" string. A terminal that resends a request
+# after losing the connection sends the same key and gets the first
+# result back instead of the operation being applied twice.
+#
+# The event loop never runs the bank itself. Every operation goes to a pool
+# of threads, where PIN checks wait on the PinHasher's worker processes and
+# deposits, withdrawals and loans wait for their group-committed fsync, so a
+# slow hash or disk never stalls the other connections.
+#
+# Run with: python service.py [host] [port] [data directory] [metrics port]
+
+import asyncio
+import datetime
+import json
+import secrets
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bank import METRICS
+from idempotency import KeyReused
+from metrics import ERROR, OK, reason
+from money import fmt
+from transaction_log import DEPOSIT, WITHDRAWAL, LOAN_TAKEN, LOAN_PAYMENT, NO_LOAN
+
+
+HOST = "127.0.0.1"
+PORT = 8765
+WORKERS = 32                 # threads running bank operations
+SESSION_TTL = 15 * 60        # seconds a session lives without a request
+MAX_LINE = 64 * 1024         # bytes in one request
+BACKLOG = 4096               # connections waiting to be accepted, for bursts of terminals
+USERS_PAGE = 100
+TRANSACTION_TYPES = {"deposit": DEPOSIT, "withdrawal": WITHDRAWAL, "loan": LOAN_TAKEN, "payment": LOAN_PAYMENT}
+TYPE_NAMES = {kind: name for name, kind in TRANSACTION_TYPES.items()}
+
+
+class RequestError(Exception):
+    # Raised by an operation to answer {"ok": false, "error": str(e)}.
+    pass
+
+
+class Session:
+    __slots__ = ("user_id", "is_admin", "expires")
+
+    def __init__(self, user_id, is_admin):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.expires = time.monotonic() + SESSION_TTL
+
+
+# ======================================================
+# SERVICE
+# ======================================================
+class ATMService:
+    def __init__(self, atm, workers=None):
+        self.atm = atm
+        self.executor = ThreadPoolExecutor(max_workers=workers or WORKERS, thread_name_prefix="atm-service")
+        self.sessions = {}   # token -> Session
+        self.connections = 0
+        self.requests = 0
+        self._server = self._sweeper = None
+        # op -> (handler, needs a session, admin only)
+        self.operations = {
+            "login": (self.login, False, False),
+            "logout": (self.logout, True, False),
+            "balance": (self.balance, True, False),
+            "deposit": (self.deposit, True, False),
+            "withdraw": (self.withdraw, True, False),
+            "transactions": (self.transactions, True, False),
+            "change_pin": (self.change_pin, True, False),
+            "take_loan": (self.take_loan, True, False),
+            "loans": (self.loans, True, False),
+            "pay_loan": (self.pay_loan, True, False),
+            "users": (self.users, True, True),
+            "search": (self.search, True, True),
+            "freeze": (self.freeze, True, True),
+            "loans_due": (self.loans_due, True, True),
+            "metrics": (self.metrics, True, True),
+        }
+
+    # ---------------- SERVER ----------------
+    async def start(self, host=HOST, port=PORT):
+        # Returns the bound (host, port); port 0 picks a free one.
+        self._server = await asyncio.start_server(self._serve, host, port, limit=MAX_LINE, backlog=BACKLOG)
+        self._sweeper = asyncio.get_running_loop().create_task(self._expire_sessions())
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host=HOST, port=PORT):
+        await self.start(host, port)
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # longer than MAX_LINE
+                    writer.write(b'{"ok": false, "error": "Request too large."}\n')
+                    break
+                if not line:
+                    break
+                writer.write(json.dumps(await self.handle(line)).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def handle(self, line):
+        # One request line -> one response dict.
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError
+        except ValueError:
+            return {"ok": False, "error": "Malformed request."}
+        response = {"id": request.get("id")} if "id" in request else {}
+        try:
+            handler, needs_session, admin_only = self.operations[request.get("op")]
+        except (KeyError, TypeError):
+            response.update(ok=False, error="Unknown operation.")
+            return response
+        start = time.perf_counter_ns()
+        try:
+            session = self._session(request, admin_only) if needs_session else None
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, handler, session, request)
+            response.update(ok=True, **result)
+            outcome = OK
+        except (RequestError, KeyReused) as e:
+            response.update(ok=False, error=str(e))
+            outcome = reason(str(e))
+        except Exception:
+            response.update(ok=False, error="Internal error.")
+            outcome = ERROR
+        METRICS.observe("service." + request["op"], outcome, time.perf_counter_ns() - start)
+        return response
+
+    # ---------------- SESSIONS ----------------
+    def _session(self, request, admin_only):
+        session = self.sessions.get(request.get("token"))
+        now = time.monotonic()
+        if session is None or session.expires < now:
+            raise RequestError("Not logged in.")
+        if admin_only and not session.is_admin:
+            raise RequestError("Admins only.")
+        session.expires = now + SESSION_TTL
+        return session
+
+    async def _expire_sessions(self):
+        while True:
+            await asyncio.sleep(60)
+            now = time.monotonic()
+            for token, session in list(self.sessions.items()):
+                if session.expires < now:
+                    self.sessions.pop(token, None)
+
+    # ---------------- OPERATIONS ----------------
+    # Run in the executor: (session, request) -> dict merged into the
+    # response.
+    def login(self, session, request):
+        user, msg = self.atm.login(string_field(request, "user_id"), string_field(request, "pin"))
+        if user is None:
+            raise RequestError(msg)
+        token = secrets.token_urlsafe(24)
+        self.sessions[token] = Session(user.user_id, user.is_admin)
+        return {"token": token, "name": user.name, "is_admin": user.is_admin}
+
+    def logout(self, session, request):
+        self.sessions.pop(request["token"], None)
+        return {}
+
+    def _account(self, session):
+        # Sessions outlive a freeze, so the lock is checked on every use.
+        if self.atm.users[session.user_id].is_locked():
+            raise RequestError("Account is locked.")
+        account = self.atm.accounts.get(session.user_id)
+        if account is None:
+            raise RequestError("No account.")
+        return account
+
+    def balance(self, session, request):
+        return {"balance": str(self._account(session).balance)}
+
+    def deposit(self, session, request):
+        account = self._account(session)
+        message = account.deposit(amount_field(request, "amount"), string_field(request, "currency"),
+                                  idempotency_key=idempotency_key(request))
+        return {"message": message, "balance": str(account.balance)}
+
+    def withdraw(self, session, request):
+        account = self._account(session)
+        message = account.withdraw(amount_field(request, "amount"), string_field(request, "currency"),
+                                   self.atm.users[session.user_id], idempotency_key=idempotency_key(request))
+        return {"message": message, "balance": str(account.balance)}
+
+    def transactions(self, session, request):
+        account = self._account(session)
+        with account._lock:
+            return {"transactions": [transaction_dict(t) for t in account.transactions.last(10)]}
+
+    def change_pin(self, session, request):
+        success, message = self.atm.users[session.user_id].change_pin(
+            string_field(request, "old_pin"), string_field(request, "new_pin"),
+            idempotency_key=idempotency_key(request))
+        return {"changed": success, "message": message}
+
+    def take_loan(self, session, request):
+        account = self._account(session)
+        duration = whole_number(field(request, "duration"), "duration", minimum=1)
+        duration_type = request.get("duration_type", "months")
+        if duration_type not in ("months", "years"):
+            raise RequestError("duration_type must be months or years.")
+        message = account.take_loan(amount_field(request, "amount"), string_field(request, "currency"),
+                                    duration_type, duration,
+                                    idempotency_key=idempotency_key(request))
+        return {"message": message, "balance": str(account.balance)}
+
+    def loans(self, session, request):
+        return {"loans": [loan_dict(loan) for loan in self._account(session).get_loans()]}
+
+    def pay_loan(self, session, request):
+        account = self._account(session)
+        message = account.pay_loan(whole_number(field(request, "loan_id"), "loan_id"),
+                                   amount_field(request, "amount"),
+                                   idempotency_key=idempotency_key(request))
+        return {"message": message, "balance": str(account.balance)}
+
+    def users(self, session, request):
+        # One page of (user_id, name); offset and limit are optional.
+        offset = whole_number(request.get("offset", 0), "offset")
+        limit = min(whole_number(request.get("limit", USERS_PAGE), "limit", minimum=1), USERS_PAGE)
+        return {"users": [list(user) for user in self.atm.get_users(offset, limit)]}
+
+    def search(self, session, request):
+        # Filters as in the admin search; start/end are ISO dates (end
+        # inclusive) and the cursor comes from the previous page.
+        cursor, limit = request.get("cursor"), request.get("limit")
+        min_amount, max_amount = request.get("min_amount"), request.get("max_amount")
+        if cursor is not None:
+            cursor = whole_number(cursor, "cursor")
+        if limit is not None:
+            limit = whole_number(limit, "limit", minimum=1)
+        if min_amount is not None:
+            min_amount = amount(min_amount, "min_amount")
+        if max_amount is not None:
+            max_amount = amount(max_amount, "max_amount")
+        try:
+            start, end = (datetime_field(request, "start"), datetime_field(request, "end", days=1))
+            kind = TRANSACTION_TYPES[text_field(request, "type")] if request.get("type") else None
+            hits, cursor = self.atm.query_transactions(
+                user_id=text_field(request, "user_id"), start=start, end=end, kind=kind,
+                currency=text_field(request, "currency"), min_amount=min_amount,
+                max_amount=max_amount, cursor=cursor, limit=limit)
+        except (KeyError, ValueError):
+            raise RequestError("Invalid search.") from None
+        return {"transactions": [dict(transaction_dict(t), user_id=user_id) for user_id, t in hits],
+                "cursor": cursor}
+
+    def freeze(self, session, request):
+        return {"message": self.atm.freeze_user(string_field(request, "user_id"),
+                                                idempotency_key=idempotency_key(request))}
+
+    def loans_due(self, session, request):
+        return {"loans": [dict(loan_dict(loan), user_id=user_id) for user_id, loan in self.atm.loans_due()]}
+
+    def metrics(self, session, request):
+        # The summary the admin pages show, or "format": "prometheus" for
+        # the scrape text.
+        if request.get("format") == "prometheus":
+            return {"text": METRICS.prometheus()}
+        return {"metrics": METRICS.summary()}
+
+
+# ======================================================
+# ENCODING
+# ======================================================
+def field(request, name):
+    if request.get(name) is None:
+        raise RequestError(f"Missing {name}.")
+    return request[name]
+
+
+def text_field(request, name):
+    # An optional string field.
+    value = request.get(name)
+    if value is not None and not isinstance(value, str):
+        raise RequestError(f"{name} must be a string.")
+    return value
+
+
+def string_field(request, name):
+    # A required string field.
+    value = field(request, name)
+    if not isinstance(value, str):
+        raise RequestError(f"{name} must be a string.")
+    return value
+
+
+def amount_field(request, name):
+    return amount(field(request, name), name)
+
+
+def amount(value, name):
+    # Major units as a string or a number; true and false are neither.
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise RequestError(f"{name} must be a number or a numeric string.")
+    return value
+
+
+def whole_number(value, name, minimum=0):
+    # JSON true and false are ints to Python, but not numbers to a client.
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise RequestError(f"{name} must be a whole number of at least {minimum}.")
+    return value
+
+
+def idempotency_key(request):
+    return text_field(request, "idempotency_key")
+
+
+def datetime_field(request, name, days=0):
+    if not request.get(name):
+        return None
+    return datetime.datetime.combine(datetime.date.fromisoformat(text_field(request, name)), datetime.time()) \
+        + datetime.timedelta(days=days)
+
+
+def transaction_dict(t):
+    return {"timestamp": t.timestamp, "type": TYPE_NAMES[t.kind], "amount": fmt(t.amount),
+            "currency": t.currency, "amount_pkr": fmt(t.amount_pkr),
+            "loan_id": t.loan_id if t.loan_id != NO_LOAN else None,
+            "rate_version": t.rate_version}
+
+
+def loan_dict(loan):
+    return {"loan_id": loan.loan_id, "principal": fmt(loan.principal), "currency": loan.currency,
+            "remaining": fmt(loan.remaining_amount), "installment": fmt(loan.installment),
+            "next_due": loan.next_due.isoformat(), "description": str(loan)}
+
+
+if __name__ == "__main__":
+    from bank import ATM, User, CurrencyConverter
+    from journal import JournalStorage
+    from metrics import serve as serve_metrics
+    from rates import RateService
+
+    host = sys.argv[1] if len(sys.argv) > 1 else HOST
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else PORT
+    CurrencyConverter.rates = RateService("rates.json", "rates_history.jsonl")
+    CurrencyConverter.rates.watch(User.scheduler)
+    atm = ATM.from_storage(JournalStorage(sys.argv[3] if len(sys.argv) > 3 else "atm_data"))
+    if len(sys.argv) > 4:
+        serve_metrics(METRICS, host, int(sys.argv[4]))
+    print(f"serving on {host}:{port}")
+    try:
+        asyncio.run(ATMService(atm).serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
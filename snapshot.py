@@ -0,0 +1,238 @@
+# SNAPSHOT
+# Binary image of the whole bank, written atomically and read back through
+# mmap. User records (user, account, daily limits and transaction history)
+# are stored sorted by user id behind an offset table, so a single user can
+# be found by binary search and decoded without reading the rest of the
+# file. Loans, the transaction index and the locked users (with when their
+# locks run out and why) are stored as their own sections.
+#
+# Layout:
+#   header | user records | user offsets (u64 each) | loan records | index | locks
+#
+# The locks run to the end of the file, so snapshots written before they
+# were added read as having none.
+
+import mmap
+import os
+import struct
+from bisect import bisect_left
+
+MAGIC = b"ATMSNAP1"
+# magic, journal seq, next loan id, users, offsets at, loans at, loans, index at, index length
+HEADER = struct.Struct("<8sQQQQQQQQ")
+LENGTH = struct.Struct("<H")
+OFFSET = struct.Struct("<Q")
+# is_admin, last_withdrawal_day, daily PKR/USD/EUR, has_account, balance, transactions
+USER_FIELDS = struct.Struct("<Bqqqq?qQ")
+# loan_id, principal, duration_years, interest_rate, remaining_amount, accrued_interest
+LOAN_FIELDS = struct.Struct("<qqddqq")
+
+
+# ======================================================
+# CODEC
+# ======================================================
+def pack_str(text):
+    data = (text or "").encode()
+    return LENGTH.pack(len(data)) + data
+
+
+class Cursor:
+    # Sequential reader over a bytes-like buffer.
+    __slots__ = ("buffer", "offset")
+
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.offset = offset
+
+    def str(self):
+        (length,) = LENGTH.unpack_from(self.buffer, self.offset)
+        start = self.offset + LENGTH.size
+        self.offset = start + length
+        return bytes(self.buffer[start:self.offset]).decode()
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.buffer, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def take(self, size):
+        start = self.offset
+        self.offset += size
+        return self.buffer[start:self.offset]
+
+
+def encode_loan(row):
+    # row: (loan_id, user_id, principal, currency, duration_years, start_date,
+    #       interest_rate, remaining_amount, next_due, accrued_interest,
+    #       accrued_through), the same shape Storage.load_loans returns.
+    (loan_id, user_id, principal, currency, duration_years, start_date, interest_rate, remaining_amount,
+     next_due, accrued_interest, accrued_through) = row
+    return b"".join((pack_str(user_id), LOAN_FIELDS.pack(loan_id, principal, duration_years, interest_rate,
+                                                         remaining_amount, accrued_interest),
+                     pack_str(currency), pack_str(start_date), pack_str(next_due), pack_str(accrued_through)))
+
+
+def decode_loan(cursor):
+    user_id = cursor.str()
+    loan_id, principal, duration_years, interest_rate, remaining_amount, accrued_interest = cursor.unpack(LOAN_FIELDS)
+    currency, start_date, next_due, accrued_through = cursor.str(), cursor.str(), cursor.str(), cursor.str()
+    return (loan_id, user_id, principal, currency, duration_years, start_date, interest_rate, remaining_amount,
+            next_due, accrued_interest, accrued_through)
+
+
+def encode_lock(user_id, locked_until, reason):
+    return pack_str(user_id) + pack_str(locked_until) + pack_str(reason)
+
+
+def encode_user(user_id, name, pin_hash, is_admin, locked_until, last_withdrawal_day, daily_withdrawals,
+                account_type, balance, transactions):
+    # daily_withdrawals: (PKR, USD, EUR) minor units; account_type None for
+    # users without an account; transactions: packed transaction_log.RECORDs.
+    from transaction_log import RECORD
+    return b"".join((pack_str(user_id), pack_str(name), pack_str(pin_hash), pack_str(locked_until),
+                     pack_str(account_type),
+                     USER_FIELDS.pack(bool(is_admin), last_withdrawal_day, *daily_withdrawals,
+                                      account_type is not None, balance,
+                                      len(transactions) // RECORD.size),
+                     transactions))
+
+
+def decode_name(buffer, offset):
+    # Just the name of an encoded user, for listings.
+    cursor = Cursor(buffer, offset)
+    cursor.str()
+    return cursor.str()
+
+
+def decode_user(buffer, offset):
+    # Returns (user row, last_withdrawal_day, daily_withdrawals, account row or
+    # None, transactions buffer).
+    from transaction_log import RECORD
+    cursor = Cursor(buffer, offset)
+    user_id, name, pin_hash, locked_until, account_type = (cursor.str() for _ in range(5))
+    is_admin, last_day, pkr, usd, eur, has_account, balance, count = cursor.unpack(USER_FIELDS)
+    transactions = cursor.take(count * RECORD.size)
+    account = (user_id, account_type, balance) if has_account else None
+    return ((user_id, name, pin_hash, is_admin, locked_until or None), last_day, (pkr, usd, eur), account,
+            transactions)
+
+
+# ======================================================
+# WRITER
+# ======================================================
+def write(path, seq, next_loan_id, users, loans, index, locks=()):
+    # users: (user_id, record bytes) sorted by user id; loans: load_loans
+    # rows; index: TransactionIndex.dump() bytes; locks: (user_id,
+    # locked_until, reason). Written to a temporary file and renamed over
+    # the old snapshot only once it is on disk.
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as out:
+        out.write(bytes(HEADER.size))
+        offsets, position = [], HEADER.size
+        for _, record in users:
+            offsets.append(position)
+            out.write(record)
+            position += len(record)
+        offsets_at = position
+        out.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        loans_at = out.tell()
+        n_loans = 0
+        for row in loans:
+            out.write(encode_loan(row))
+            n_loans += 1
+        index_at = out.tell()
+        out.write(index)
+        for lock in locks:
+            out.write(encode_lock(*lock))
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, seq, next_loan_id, len(offsets), offsets_at, loans_at, n_loans, index_at,
+                              len(index)))
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, path)
+    directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+# ======================================================
+# READER
+# ======================================================
+class Snapshot:
+    # Read-only view of a snapshot file. Acts as a sorted, sized container of
+    # user ids; nothing is decoded until asked for.
+    def __init__(self, path):
+        with open(path, "rb") as source:
+            self._map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.seq, self.next_loan_id, self._users, offsets_at, self._loans_at, self._n_loans,
+         self._index_at, self._index_len) = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("Not an ATM snapshot.")
+        self._offsets = memoryview(self._map)[offsets_at:offsets_at + self._users * OFFSET.size].cast("Q")
+        self._records_end = offsets_at
+
+    def _key(self, i):
+        (length,) = LENGTH.unpack_from(self._map, self._offsets[i])
+        start = self._offsets[i] + LENGTH.size
+        return self._map[start:start + length]
+
+    def _find(self, user_id):
+        key = user_id.encode()
+        i = bisect_left(_Keys(self), key)
+        return i if i < self._users and self._key(i) == key else None
+
+    def __len__(self):
+        return self._users
+
+    def __contains__(self, user_id):
+        return self._find(user_id) is not None
+
+    def __iter__(self):
+        for i in range(self._users):
+            yield self._key(i).decode()
+
+    def raw(self, user_id):
+        # The encoded record, for copying into the next snapshot unchanged.
+        i = self._find(user_id)
+        if i is None:
+            return None
+        end = self._offsets[i + 1] if i + 1 < self._users else self._records_end
+        return self._map[self._offsets[i]:end]
+
+    def user(self, user_id):
+        i = self._find(user_id)
+        return None if i is None else decode_user(self._map, self._offsets[i])
+
+    def name(self, user_id):
+        i = self._find(user_id)
+        return None if i is None else decode_name(self._map, self._offsets[i])
+
+    def loans(self):
+        cursor = Cursor(self._map, self._loans_at)
+        return [decode_loan(cursor) for _ in range(self._n_loans)]
+
+    def index(self):
+        return memoryview(self._map)[self._index_at:self._index_at + self._index_len]
+
+    def locks(self):
+        cursor = Cursor(self._map, self._index_at + self._index_len)
+        locks = []
+        while cursor.offset < len(self._map):
+            locks.append((cursor.str(), cursor.str(), cursor.str() or None))
+        return locks
+
+
+class _Keys:
+    # Lets bisect search the sorted user ids without decoding them all.
+    __slots__ = ("snapshot",)
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return self.snapshot._users
+
+    def __getitem__(self, i):
+        return self.snapshot._key(i)
@@ -0,0 +1,472 @@
+# STORAGE
+# Pluggable persistence for the ATM. Storage is the in-memory (no-op)
+# backend; SQLiteStorage keeps users, accounts, loans and transactions in a
+# local SQLite database. Writes are queued and group-committed by a single
+# writer thread; callers that need an operation to be durable before they
+# acknowledge it wait with sync(), which only waits for their own writes.
+#
+# Users are loaded one at a time, when first looked up: user_ids() lists
+# the users storage holds, user_name() names one without loading it,
+# load_user() returns one in the shape of snapshot.decode_user (with the
+# lock reason after locked_until, where the backend keeps it), and
+# write_back() takes the encoded record (snapshot.encode_user) of a user
+# evicted from memory, so a later load_user returns that state.
+# load_locks() lists every stored lock as (user_id, locked_until, reason),
+# so their expiry can be scheduled without loading the users.
+
+import atexit
+import datetime
+import queue
+import threading
+
+from snapshot import decode_name, decode_user
+from transaction_log import RECORD, NO_LOAN, WITHDRAWAL, CURRENCY_CODES
+
+
+# ======================================================
+# IN-MEMORY BACKEND
+# ======================================================
+def loan_row(user_id, loan):
+    # A loan in the shape load_loans returns.
+    return (loan.loan_id, user_id, loan.principal, loan.currency, loan.duration_years, loan.start_date.isoformat(),
+            loan.interest_rate, loan.remaining_amount, loan.next_due.isoformat(), loan.accrued_interest,
+            loan.accrued_through.isoformat())
+
+
+class Storage:
+    SNAPSHOT_INTERVAL = None  # seconds between snapshots, for backends that keep them
+    spill_directory = None    # where transaction logs spill, if not the temporary directory
+
+    def __init__(self):
+        # Nothing is persisted, so evicted users are kept here, encoded.
+        self._written_back = {}
+
+    def save_user(self, user):
+        pass
+
+    def save_account(self, user_id, account):
+        pass
+
+    # position: index of the (first) new record in the account's log.
+    def record_transaction(self, user_id, balance_pkr, kind, amount, currency, amount_pkr, timestamp, loan_id,
+                           rate_version, position):
+        pass
+
+    def record_transactions(self, user_id, balance_pkr, kinds, amounts, currencies, amounts_pkr, timestamp,
+                            rate_version, position):
+        pass
+
+    def save_loan(self, user_id, loan):
+        pass
+
+    def save_loan_accruals(self, rows, accrued_through):
+        pass
+
+    def delete_loan(self, loan_id):
+        pass
+
+    def load_loans(self):
+        return []
+
+    def load_transactions(self):
+        return []
+
+    def user_ids(self):
+        return ()
+
+    def on_users_saved(self, callback):
+        # callback(user_ids) is called once saved users are listed by
+        # user_ids(); backends that only list them after a snapshot never
+        # call it.
+        pass
+
+    def load_locks(self):
+        return []
+
+    def user_name(self, user_id):
+        record = self._written_back.get(user_id)
+        return None if record is None else decode_name(record, 0)
+
+    def load_user(self, user_id):
+        record = self._written_back.pop(user_id, None)
+        return None if record is None else decode_user(record, 0)
+
+    def write_back(self, user_id, record):
+        self._written_back[user_id] = record
+
+    # Backends that keep snapshots hand back the journal written since the
+    # last one.
+    def last_loan_id(self):
+        return 0
+
+    def load_transaction_index(self):
+        return None
+
+    def load_events(self):
+        return []
+
+    def begin_snapshot(self):
+        return None
+
+    def write_snapshot(self, seq, next_loan_id, users, loans, index):
+        return None
+
+    def sync(self):
+        # Returns once everything the calling thread wrote is durable.
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# ======================================================
+# SQLITE BACKEND
+# ======================================================
+# All money columns hold integer minor units (paisa / cents).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    pin_hash TEXT NOT NULL,
+    is_admin INTEGER NOT NULL,
+    locked_until TEXT,
+    lock_reason TEXT
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    user_id TEXT PRIMARY KEY REFERENCES users(user_id),
+    account_type TEXT NOT NULL,
+    balance_pkr INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS loans (
+    loan_id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    principal INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    duration_years REAL NOT NULL,
+    start_date TEXT NOT NULL,
+    interest_rate REAL NOT NULL,
+    remaining_amount INTEGER NOT NULL,
+    next_due TEXT NOT NULL,
+    accrued_interest INTEGER NOT NULL,
+    accrued_through TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    kind INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    amount_pkr INTEGER NOT NULL,
+    timestamp INTEGER NOT NULL,
+    loan_id INTEGER NOT NULL,
+    rate_version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_by_user ON transactions (user_id, id);
+"""
+# Added after the first release; databases created before it get it here.
+LOCK_REASON_COLUMN = "ALTER TABLE users ADD COLUMN lock_reason TEXT"
+LOCKS_INDEX = "CREATE INDEX IF NOT EXISTS users_by_lock ON users (locked_until) WHERE locked_until IS NOT NULL"
+
+# Statements are kept as constants so every connection compiles each one
+# once and reuses it from its statement cache.
+UPSERT_USER = ("INSERT INTO users (user_id, name, pin_hash, is_admin, locked_until, lock_reason) "
+               "VALUES (?, ?, ?, ?, ?, ?) "
+               "ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, pin_hash = excluded.pin_hash, "
+               "is_admin = excluded.is_admin, locked_until = excluded.locked_until, "
+               "lock_reason = excluded.lock_reason")
+UPSERT_ACCOUNT = ("INSERT INTO accounts (user_id, account_type, balance_pkr) VALUES (?, ?, ?) "
+                  "ON CONFLICT(user_id) DO UPDATE SET account_type = excluded.account_type, "
+                  "balance_pkr = excluded.balance_pkr")
+UPDATE_BALANCE = "UPDATE accounts SET balance_pkr = ? WHERE user_id = ?"
+INSERT_TRANSACTION = ("INSERT INTO transactions (user_id, kind, amount, currency, amount_pkr, timestamp, loan_id, "
+                      "rate_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+UPSERT_LOAN = ("INSERT INTO loans (loan_id, user_id, principal, currency, duration_years, start_date, "
+               "interest_rate, remaining_amount, next_due, accrued_interest, accrued_through) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+               "ON CONFLICT(loan_id) DO UPDATE SET remaining_amount = excluded.remaining_amount, "
+               "next_due = excluded.next_due, accrued_interest = excluded.accrued_interest, "
+               "accrued_through = excluded.accrued_through")
+UPDATE_LOAN_ACCRUAL = ("UPDATE loans SET remaining_amount = ?, accrued_interest = ?, accrued_through = ? "
+                       "WHERE loan_id = ?")
+DELETE_LOAN = "DELETE FROM loans WHERE loan_id = ?"
+
+
+class SQLiteStorage(Storage):
+    POOL_SIZE = 4
+    BATCH_SIZE = 512
+    COMMIT_INTERVAL = 0.005  # seconds a write may wait for others to share its commit
+
+    def __init__(self, path="atm.db", pool_size=None, commit_interval=None):
+        self.path = path
+        self.commit_interval = self.COMMIT_INTERVAL if commit_interval is None else commit_interval
+        self._writer_conn = self._connect()
+        # Commits are acknowledged to customers, so they must survive a
+        # power cut, not just a crash of the app.
+        self._writer_conn.execute("PRAGMA synchronous=FULL")
+        self._writer_conn.executescript(SCHEMA)
+        if "lock_reason" not in {row[1] for row in self._writer_conn.execute("PRAGMA table_info(users)")}:
+            self._writer_conn.execute(LOCK_REASON_COLUMN)
+        self._writer_conn.execute(LOCKS_INDEX)
+        self._pool = queue.Queue()
+        for _ in range(pool_size or self.POOL_SIZE):
+            self._pool.put(self._connect())
+        self._writes = queue.Queue()
+        self._idle = threading.Condition()
+        self._unfinished = 0
+        # Writes are numbered as they are queued; the writer commits them in
+        # that order, so one counter tells which are done. Batches that rolled
+        # back are remembered, so sync() can tell their callers.
+        self._queued = 0
+        self._committed = 0
+        self._failed = []  # (first ticket, last ticket, error) per failed batch
+        self._local = threading.local()  # first and last ticket queued since sync()
+        self._evicted = {}  # user_id -> ticket of the last write queued before eviction
+        self._users_saved = None
+        self.last_error = None
+        self._writer = threading.Thread(target=self._write_loop, name="sqlite-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _connect(self):
+        # sqlite3 is only imported by callers that use this backend.
+        import sqlite3
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    # ---------------- WRITES ----------------
+    def _enqueue(self, sql, params):
+        with self._idle:
+            self._unfinished += 1
+            self._queued += 1
+            if getattr(self._local, "first", None) is None:
+                self._local.first = self._queued
+            self._local.ticket = self._queued
+            self._writes.put((sql, params))
+
+    def _write_loop(self):
+        # Any error fails the batch, never the thread: every sync() still
+        # waiting has to be answered.
+        while True:
+            first = self._writes.get()
+            if first is None:
+                return
+            batch = [first]
+            try:
+                while len(batch) < self.BATCH_SIZE:
+                    item = self._writes.get(timeout=self.commit_interval)
+                    if item is None:
+                        self._writes.put(None)
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            try:
+                self._commit(batch)
+                if self._users_saved is not None:
+                    saved = {params[0] for sql, params in batch if sql is UPSERT_USER}
+                    if saved:
+                        self._users_saved(saved)
+            except Exception as exc:
+                self.last_error = exc
+                with self._idle:
+                    self._failed.append((self._committed + 1, self._committed + len(batch), exc))
+            finally:
+                with self._idle:
+                    self._unfinished -= len(batch)
+                    self._committed += len(batch)
+                    self._idle.notify_all()
+
+    def _commit(self, batch):
+        # Only the latest balance of each account matters, so balance updates
+        # are collapsed and applied once at the end of the batch.
+        balances = {}
+        writes = []
+        for sql, params in batch:
+            if sql is UPDATE_BALANCE:
+                balances[params[1]] = params
+            else:
+                writes.append((sql, params))
+        conn = self._writer_conn
+        conn.execute("BEGIN")
+        try:
+            # Consecutive writes of the same statement go through a single
+            # executemany call; the order between statements is preserved.
+            start = 0
+            while start < len(writes):
+                sql = writes[start][0]
+                end = start
+                while end < len(writes) and writes[end][0] == sql:
+                    end += 1
+                conn.executemany(sql, [params for _, params in writes[start:end]])
+                start = end
+            if balances:
+                conn.executemany(UPDATE_BALANCE, balances.values())
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    def save_user(self, user):
+        locked_until = user.locked_until.isoformat() if user.locked_until else None
+        self._enqueue(UPSERT_USER, (user.user_id, user.name, user.pin_hash, int(user.is_admin), locked_until,
+                                    user.lock_reason))
+
+    def save_account(self, user_id, account):
+        self._enqueue(UPSERT_ACCOUNT, (user_id, type(account).__name__, account.balance.minor))
+
+    def record_transaction(self, user_id, balance_pkr, kind, amount, currency, amount_pkr, timestamp, loan_id,
+                           rate_version, position):
+        self._enqueue(UPDATE_BALANCE, (balance_pkr, user_id))
+        self._enqueue(INSERT_TRANSACTION, (user_id, kind, amount, currency, amount_pkr, timestamp, loan_id,
+                                           rate_version))
+
+    def record_transactions(self, user_id, balance_pkr, kinds, amounts, currencies, amounts_pkr, timestamp,
+                            rate_version, position):
+        self._enqueue(UPDATE_BALANCE, (balance_pkr, user_id))
+        for row in zip(kinds, amounts, currencies, amounts_pkr):
+            self._enqueue(INSERT_TRANSACTION, (user_id, *row, timestamp, NO_LOAN, rate_version))
+
+    def save_loan(self, user_id, loan):
+        self._enqueue(UPSERT_LOAN, loan_row(user_id, loan))
+
+    def save_loan_accruals(self, rows, accrued_through):
+        # rows: (remaining_amount, accrued_interest, loan_id)
+        accrued_through = accrued_through.isoformat()
+        for remaining, accrued, loan_id in rows:
+            self._enqueue(UPDATE_LOAN_ACCRUAL, (remaining, accrued, accrued_through, loan_id))
+
+    def delete_loan(self, loan_id):
+        self._enqueue(DELETE_LOAN, (loan_id,))
+
+    def sync(self):
+        # Raises if any write this thread queued since its last sync failed.
+        first, ticket = getattr(self._local, "first", None), getattr(self._local, "ticket", 0)
+        self._local.first = None
+        self._wait_for(ticket)
+        if first is None:
+            return
+        with self._idle:
+            failed = [exc for low, high, exc in self._failed if low <= ticket and first <= high]
+        if failed:
+            raise OSError(f"Write not saved: {failed[-1]}") from failed[-1]
+
+    def _wait_for(self, ticket):
+        with self._idle:
+            while self._committed < ticket:
+                self._idle.wait()
+
+    def write_back(self, user_id, record):
+        # The tables already hold everything but the day's withdrawal totals,
+        # which load_user works out again; it only has to wait for the user's
+        # queued writes to be committed.
+        with self._idle:
+            self._evicted[user_id] = self._queued
+
+    def flush(self):
+        with self._idle:
+            while self._unfinished:
+                self._idle.wait()
+
+    def close(self):
+        if not self._writer.is_alive():
+            return
+        self.flush()
+        self._writes.put(None)
+        self._writer.join()
+
+    # ---------------- READS ----------------
+    def _query(self, sql, params=()):
+        conn = self._pool.get()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self._pool.put(conn)
+
+    def user_ids(self):
+        return _UserIds(self)
+
+    def on_users_saved(self, callback):
+        self._users_saved = callback
+
+    def user_name(self, user_id):
+        self._wait_for(self._evicted.get(user_id, 0))
+        rows = self._query("SELECT name FROM users WHERE user_id = ?", (user_id,))
+        return rows[0][0] if rows else None
+
+    def load_user(self, user_id):
+        self._wait_for(self._evicted.pop(user_id, 0))
+        users = self._query("SELECT user_id, name, pin_hash, is_admin, locked_until, lock_reason FROM users "
+                            "WHERE user_id = ?", (user_id,))
+        if not users:
+            return None
+        accounts = self._query("SELECT user_id, account_type, balance_pkr FROM accounts WHERE user_id = ?",
+                               (user_id,))
+        rows = self._query("SELECT kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version "
+                           "FROM transactions WHERE user_id = ? ORDER BY id", (user_id,))
+        today = datetime.date.today()
+        day_start = datetime.datetime.combine(today, datetime.time()).timestamp()
+        daily_withdrawals = [0, 0, 0]
+        records = []
+        for kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version in rows:
+            code = CURRENCY_CODES[currency]
+            if kind == WITHDRAWAL and timestamp >= day_start:
+                daily_withdrawals[code] += amount
+            records.append(RECORD.pack(kind, amount, code, amount_pkr, timestamp, loan_id, rate_version))
+        return (users[0], today.toordinal(), tuple(daily_withdrawals), accounts[0] if accounts else None,
+                b"".join(records))
+
+    def load_locks(self):
+        # Through users_by_lock, so only locked users are read; locks that
+        # have since run out are left for the caller to skip.
+        return self._query("SELECT user_id, locked_until, lock_reason FROM users WHERE locked_until IS NOT NULL")
+
+    def load_loans(self):
+        return self._query("SELECT loan_id, user_id, principal, currency, duration_years, start_date, "
+                           "interest_rate, remaining_amount, next_due, accrued_interest, accrued_through "
+                           "FROM loans ORDER BY loan_id")
+
+    def load_transactions(self):
+        # Streamed rather than fetched so large histories are never held in
+        # memory all at once.
+        conn = self._pool.get()
+        try:
+            yield from conn.execute("SELECT user_id, kind, amount, currency, amount_pkr, timestamp, loan_id, "
+                                    "rate_version FROM transactions ORDER BY id")
+        finally:
+            self._pool.put(conn)
+
+
+class _UserIds:
+    # SQLiteStorage.user_ids(): answers from the users table rather than
+    # holding every id in memory.
+    PAGE = 1000  # ids read per query while iterating
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __contains__(self, user_id):
+        return bool(self._storage._query("SELECT 1 FROM users WHERE user_id = ?", (user_id,)))
+
+    def __len__(self):
+        return self._storage._query("SELECT COUNT(*) FROM users")[0][0]
+
+    def __iter__(self):
+        # A page at a time, each from where the last one ended, so no
+        # connection is held between pages and a listing that stops early
+        # reads no further.
+        rows = self._storage._query("SELECT user_id FROM users ORDER BY user_id LIMIT ?", (self.PAGE,))
+        while rows:
+            for (user_id,) in rows:
+                yield user_id
+            if len(rows) < self.PAGE:
+                return
+            rows = self._storage._query("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                                        (rows[-1][0], self.PAGE))
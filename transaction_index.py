@@ -0,0 +1,253 @@
+# TRANSACTION INDEX
+# Bank-wide secondary indexes over every account's transaction log, so the
+# admin can query by user, time range, type, currency and amount without
+# walking the accounts. Each logged transaction gets a row number in
+# arrival order; rows carry the columns needed for filtering and a pointer
+# (user, position) back into the owning account's log.
+#
+#   time range  -> bisect over the running maximum of the timestamps, then
+#                  checked against the true timestamp column
+#   user / type / currency -> posting lists of row numbers
+#   amount range -> checked against the amount column
+#
+# Results come back a page at a time with an opaque cursor for the next one.
+# A page walks the shortest posting list that applies, or every row in the
+# time range when none does (an amount range alone, say), so its cost grows
+# with the rows it has to skip. The scan takes the lock for SCAN_CHUNK rows
+# at a time, so a long search never holds up the accounts logging new rows.
+
+import bisect
+import itertools
+import struct
+import threading
+from array import array
+
+from transaction_log import CURRENCY_CODES
+
+# dump(): rows, users, length of the user ids; then the byte length of each
+# user id (u32), the user ids themselves, sorted, and the columns in COLUMNS
+# order with user codes renumbered to match. Ids are length-prefixed rather
+# than separated, as they may contain any character.
+DUMP_HEADER = struct.Struct("<QQQ")
+
+
+class TransactionIndex:
+    PAGE_SIZE = 50
+    SCAN_CHUNK = 4096   # rows checked per hold of the lock while filling a page
+    COLUMNS = ("_users", "_positions", "_timestamps", "_kinds", "_currencies", "_amounts_pkr")
+
+    def __init__(self):
+        self._user_ids = []          # user code -> user_id
+        self._user_codes = {}        # user_id -> user code, for users not in the sorted block
+        self._sorted_users = 0       # leading _user_ids that are sorted (after load)
+        self._users = array("l")     # per row: user code
+        self._positions = array("q")  # per row: index in the account's log
+        self._timestamps = array("q")
+        # Running maximum of _timestamps, for bisection: rows can arrive a
+        # little out of time order, and no row's timestamp is more than
+        # _max_lag below its key. Rebuilt by load(), not dumped.
+        self._time_keys = array("q")
+        self._max_lag = 0
+        self._kinds = array("b")
+        self._currencies = array("b")
+        self._amounts_pkr = array("q")
+        self._by_user = {}           # user code -> array of rows
+        # After load(), per-user postings stay in one sorted block (rows
+        # ordered by user, and each user's start in it) until first used.
+        self._user_block = self._user_starts = None
+        self._by_kind = {}
+        self._by_currency = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    # ---------------- SNAPSHOTS ----------------
+    def dump(self):
+        # User codes are renumbered in user id order, so load() can find a
+        # user by bisection instead of building a dict of every user.
+        import numpy as np
+        with self._lock:
+            order = sorted(range(len(self._user_ids)), key=self._user_ids.__getitem__)
+            encoded = [self._user_ids[code].encode() for code in order]
+            lengths = np.fromiter(map(len, encoded), dtype="<u4", count=len(encoded))
+            ids = b"".join(encoded)
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order))
+            users = rank[np.frombuffer(self._users, dtype=f"i{self._users.itemsize}")]
+            columns = [getattr(self, name).tobytes() for name in self.COLUMNS[1:]]
+        return b"".join([DUMP_HEADER.pack(len(self._positions), len(order), len(ids)), lengths.tobytes(), ids,
+                         users.astype(f"i{self._users.itemsize}").tobytes()] + columns)
+
+    @classmethod
+    def load(cls, buffer):
+        # Columns are copied back as they are; the kind and currency postings
+        # are rebuilt with NumPy and the user postings are left in one block.
+        import numpy as np
+        index = cls()
+        rows, users, length = DUMP_HEADER.unpack_from(buffer)
+        offset = DUMP_HEADER.size
+        ends = np.cumsum(np.frombuffer(buffer, dtype="<u4", count=users, offset=offset), dtype=np.int64).tolist()
+        offset += users * 4
+        spans = zip([0] + ends[:-1], ends)
+        raw = bytes(buffer[offset:offset + length])
+        text = raw.decode()
+        if len(text) == len(raw):  # ASCII: byte offsets are character offsets
+            index._user_ids = [text[start:end] for start, end in spans]
+        else:
+            index._user_ids = [raw[start:end].decode() for start, end in spans]
+        index._sorted_users = users
+        offset += length
+        for name in cls.COLUMNS:
+            column = getattr(index, name)
+            size = rows * column.itemsize
+            column.frombytes(buffer[offset:offset + size])
+            offset += size
+        timestamps = np.frombuffer(index._timestamps, dtype=np.int64)
+        keys = np.maximum.accumulate(timestamps) if rows else timestamps
+        index._time_keys = array("q", keys.tobytes())
+        index._max_lag = int((keys - timestamps).max()) if rows else 0
+        for postings, name in ((index._by_kind, "_kinds"), (index._by_currency, "_currencies")):
+            values = np.frombuffer(getattr(index, name), dtype=np.int8)
+            for key in np.unique(values).tolist():
+                postings[key] = array("q", np.flatnonzero(values == key).astype(np.int64).tobytes())
+        codes = np.frombuffer(index._users, dtype=f"i{index._users.itemsize}")
+        order = np.argsort(codes, kind="stable")
+        starts = np.searchsorted(codes[order], np.arange(users + 1))
+        index._user_block = array("q", order.astype(np.int64).tobytes())
+        index._user_starts = array("q", starts.astype(np.int64).tobytes())
+        return index
+
+    def _code(self, user_id):
+        code = self._user_codes.get(user_id)
+        if code is None and self._sorted_users:
+            i = bisect.bisect_left(self._user_ids, user_id, 0, self._sorted_users)
+            if i < self._sorted_users and self._user_ids[i] == user_id:
+                code = i
+        return code
+
+    def next_position(self, user_id):
+        # Position just after the last indexed record of user_id's log.
+        with self._lock:
+            user = self._code(user_id)
+            rows = self._user_rows(user) if user is not None else None
+            return self._positions[rows[-1]] + 1 if rows else 0
+
+    # ---------------- WRITING ----------------
+    def add(self, user_id, position, kind, currency, amount_pkr, timestamp):
+        self.add_many(user_id, position, (kind,), (currency,), (amount_pkr,), timestamp)
+
+    def add_many(self, user_id, position, kinds, currencies, amounts_pkr, timestamp):
+        # Records consecutive log entries of one account starting at position.
+        with self._lock:
+            user = self._code(user_id)
+            if user is None:
+                user = self._user_codes[user_id] = len(self._user_ids)
+                self._user_ids.append(user_id)
+            # Appends from concurrent accounts may arrive a second out of
+            # order; the timestamp is kept as it is and only its key is
+            # raised, so bisect remains valid.
+            key = timestamp
+            if self._time_keys and key < self._time_keys[-1]:
+                key = self._time_keys[-1]
+                self._max_lag = max(self._max_lag, key - timestamp)
+            row = len(self._positions)
+            n = len(kinds)
+            self._users.extend([user] * n)
+            self._positions.extend(range(position, position + n))
+            self._timestamps.extend([timestamp] * n)
+            self._time_keys.extend([key] * n)
+            self._kinds.extend(kinds)
+            self._currencies.extend(CURRENCY_CODES[c] for c in currencies)
+            self._amounts_pkr.extend(amounts_pkr)
+            rows = self._user_rows(user)
+            if rows is None:
+                rows = self._by_user[user] = array("q")
+            rows.extend(range(row, row + n))
+            for i, (kind, currency) in enumerate(zip(kinds, currencies)):
+                self._posting(self._by_kind, kind).append(row + i)
+                self._posting(self._by_currency, CURRENCY_CODES[currency]).append(row + i)
+
+    def _user_rows(self, user):
+        rows = self._by_user.get(user)
+        if rows is None and self._user_block is not None and user < len(self._user_starts) - 1:
+            rows = self._by_user[user] = self._user_block[self._user_starts[user]:self._user_starts[user + 1]]
+        return rows
+
+    @staticmethod
+    def _posting(postings, key):
+        rows = postings.get(key)
+        if rows is None:
+            rows = postings[key] = array("q")
+        return rows
+
+    # ---------------- QUERYING ----------------
+    def query(self, user_id=None, start=None, end=None, kind=None, currency=None, min_pkr=None, max_pkr=None,
+              cursor=None, limit=None, newest_first=True):
+        # start/end: epoch seconds, end exclusive. Amounts are PKR minor units.
+        # Returns ([(user_id, position), ...], next_cursor); next_cursor is
+        # None on the last page. Pages hold at most PAGE_SIZE rows.
+        limit = min(max(limit or self.PAGE_SIZE, 1), self.PAGE_SIZE)
+        with self._lock:
+            total = len(self._positions)
+            # A row's key is at least its timestamp and at most _max_lag
+            # above it, so every row in [start, end) lies in [lo, hi).
+            lo = 0 if start is None else bisect.bisect_left(self._time_keys, start)
+            hi = total if end is None else bisect.bisect_left(self._time_keys, end + self._max_lag)
+            if cursor is not None:
+                if newest_first:
+                    hi = min(hi, cursor)
+                else:
+                    lo = max(lo, cursor + 1)
+
+            # Walk the shortest posting list that applies; the other filters
+            # are checked against the columns.
+            lists = []
+            if user_id is not None:
+                user = self._code(user_id)
+                rows = self._user_rows(user) if user is not None else None
+                lists.append(rows if rows is not None else array("q"))
+            if kind is not None:
+                lists.append(self._by_kind.get(kind, array("q")))
+            if currency is not None:
+                lists.append(self._by_currency.get(CURRENCY_CODES.get(currency.upper()), array("q")))
+            if lists:
+                rows = min(lists, key=len)
+                first, last = bisect.bisect_left(rows, lo), bisect.bisect_left(rows, hi)
+                candidates = (rows[i] for i in (range(last - 1, first - 1, -1) if newest_first
+                                                else range(first, last)))
+            else:
+                candidates = iter(range(hi - 1, lo - 1, -1) if newest_first else range(lo, hi))
+
+            user = self._code(user_id) if user_id is not None else None
+            code = CURRENCY_CODES.get(currency.upper()) if currency is not None else None
+
+        # Rows are only ever appended, and every candidate is below the hi
+        # taken above, so the scan can drop the lock between chunks and pick
+        # up where it stopped, as a cursor does.
+        page, row, exhausted = [], None, False
+        while len(page) < limit and not exhausted:
+            with self._lock:
+                exhausted = True
+                for row in itertools.islice(candidates, self.SCAN_CHUNK):
+                    exhausted = False
+                    if start is not None and self._timestamps[row] < start:
+                        continue
+                    if end is not None and self._timestamps[row] >= end:
+                        continue
+                    if user is not None and self._users[row] != user:
+                        continue
+                    if kind is not None and self._kinds[row] != kind:
+                        continue
+                    if code is not None and self._currencies[row] != code:
+                        continue
+                    if min_pkr is not None and self._amounts_pkr[row] < min_pkr:
+                        continue
+                    if max_pkr is not None and self._amounts_pkr[row] > max_pkr:
+                        continue
+                    page.append((self._user_ids[self._users[row]], self._positions[row]))
+                    if len(page) == limit:
+                        break
+        with self._lock:
+            more = len(page) == limit and next(candidates, None) is not None
+        return page, row if more else None
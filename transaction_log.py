@@ -0,0 +1,291 @@
+# TRANSACTION LOG
+# Columnar, typed storage for account transactions. Each field lives in its
+# own compact array; text is only rendered when a record is displayed.
+# Only the most recent records stay in memory, older ones are spilled to a
+# segment file on disk and read back on demand. The in-memory ring grows
+# with the log up to its capacity, so short histories stay small.
+#
+# Segments are a cache of the in-memory state, removed when their log is
+# collected. Banks with a journal put them under the storage directory
+# (spill_dir, set per log), where they outlive the process: the snapshot taken on the way
+# out still reads them after atexit has run the finalizers, and the storage
+# clears them on its next start.
+
+import datetime
+import os
+import struct
+import time
+import weakref
+from array import array
+from itertools import repeat
+
+from money import fmt
+
+
+# ======================================================
+# RECORD TYPES
+# ======================================================
+DEPOSIT = 0
+WITHDRAWAL = 1
+LOAN_TAKEN = 2
+LOAN_PAYMENT = 3
+
+CURRENCIES = ("PKR", "USD", "EUR")
+CURRENCY_CODES = {currency: code for code, currency in enumerate(CURRENCIES)}
+
+NO_LOAN = -1
+
+# kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version
+# Amounts are integer minor units (cents / paisa).
+RECORD = struct.Struct("<bqbqqqI")
+
+
+class Transaction:
+    __slots__ = ("kind", "amount", "currency", "amount_pkr", "timestamp", "loan_id", "rate_version")
+
+    def __init__(self, kind, amount, currency, amount_pkr, timestamp, loan_id=NO_LOAN, rate_version=0):
+        self.kind = kind
+        self.amount = amount
+        self.currency = currency
+        self.amount_pkr = amount_pkr
+        self.timestamp = timestamp
+        self.loan_id = loan_id
+        self.rate_version = rate_version
+
+    def message(self):
+        amount, amount_pkr = fmt(self.amount), fmt(self.amount_pkr)
+        if self.kind == DEPOSIT:
+            return f"Deposited {amount} {self.currency} (PKR {amount_pkr})"
+        if self.kind == WITHDRAWAL:
+            return f"Withdrew {amount} {self.currency} (PKR {amount_pkr})"
+        if self.kind == LOAN_TAKEN:
+            return f"Loan taken: {amount} {self.currency} (PKR {amount_pkr}), Loan #{self.loan_id}"
+        return f"Loan payment: {amount} {self.currency} (PKR {amount_pkr}), Loan #{self.loan_id}"
+
+    def __str__(self):
+        return f"{datetime.datetime.fromtimestamp(self.timestamp)} - {self.message()}"
+
+
+# ======================================================
+# RING BUFFER LOG WITH COLD-STORAGE SPILL
+# ======================================================
+# kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version
+_EMPTY_COLUMNS = tuple(array(typecode) for typecode in "bqbqqqI")
+
+
+class TransactionLog:
+    CAPACITY = 64
+    SPILL_BATCH = 32
+    __slots__ = ("capacity", "spill_dir", "spill_path", "_kinds", "_amounts", "_currencies", "_amounts_pkr", "_timestamps",
+                 "_loan_ids", "_rate_versions", "_start", "_size", "_flushed", "_pending", "__weakref__")
+
+    def __init__(self, capacity=None, spill_path=None, spill_dir=None):
+        self.capacity = capacity or self.CAPACITY
+        self.spill_dir = spill_dir  # None: the system temporary directory
+        self.spill_path = spill_path
+        # Allocated as records arrive (see _reserve); the ring only wraps
+        # once it has reached capacity. Until then every empty log shares
+        # the same empty columns.
+        (self._kinds, self._amounts, self._currencies, self._amounts_pkr, self._timestamps, self._loan_ids,
+         self._rate_versions) = _EMPTY_COLUMNS
+        self._start = 0      # ring slot of the oldest in-memory record
+        self._size = 0       # records currently in the ring
+        self._flushed = 0    # records written to the segment file
+        self._pending = bytearray()  # spilled records not yet written
+
+    @classmethod
+    def from_bytes(cls, buffer, capacity=None, spill_dir=None):
+        # Rebuilds a log from packed RECORDs (see to_bytes): the newest fill
+        # the ring, the rest go straight to a segment file.
+        log = cls(capacity, spill_dir=spill_dir)
+        count = len(buffer) // RECORD.size
+        cold = max(0, count - log.capacity) * RECORD.size
+        if cold:
+            log._pending = bytearray(buffer[:cold])
+            log.flush()
+        for kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version in RECORD.iter_unpack(
+                buffer[cold:]):
+            log.append(kind, amount, CURRENCIES[currency], amount_pkr, loan_id, timestamp, rate_version)
+        return log
+
+    def to_bytes(self):
+        # The whole log as packed RECORDs, oldest first.
+        self.flush()
+        data = b""
+        if self._flushed:
+            with open(self.spill_path, "rb") as segment:
+                data = segment.read()
+        # A segment removed or cut short under us would silently drop history.
+        if len(data) != self._flushed * RECORD.size:
+            raise OSError(f"spill segment {self.spill_path} holds {len(data) // RECORD.size} of "
+                          f"{self._flushed} records")
+        return data + b"".join(RECORD.pack(*row) for row in self._ring_rows())
+
+    # ---------------- WRITING ----------------
+    def _columns(self):
+        return (self._kinds, self._amounts, self._currencies, self._amounts_pkr, self._timestamps, self._loan_ids,
+                self._rate_versions)
+
+    def _reserve(self, n):
+        # Grows the ring (doubling, up to capacity) to fit n more records.
+        # Until it is full nothing has been spilled, so _start is still 0.
+        # The columns are replaced rather than extended in place, so the
+        # shared empty ones are never written to.
+        allocated = len(self._kinds)
+        needed = min(self.capacity, self._size + n)
+        if needed > allocated:
+            grow = max(needed, min(self.capacity, 2 * allocated or 4)) - allocated
+            (self._kinds, self._amounts, self._currencies, self._amounts_pkr, self._timestamps, self._loan_ids,
+             self._rate_versions) = (column + array(column.typecode, bytes(column.itemsize * grow))
+                                     for column in self._columns())
+
+    def append(self, kind, amount, currency, amount_pkr, loan_id=NO_LOAN, timestamp=None, rate_version=0):
+        if timestamp is None:
+            timestamp = int(time.time())
+        if self._size == self.capacity:
+            self._spill_oldest()
+        else:
+            self._reserve(1)
+        slot = (self._start + self._size) % self.capacity
+        self._kinds[slot] = kind
+        self._amounts[slot] = amount
+        self._currencies[slot] = CURRENCY_CODES[currency]
+        self._amounts_pkr[slot] = amount_pkr
+        self._timestamps[slot] = timestamp
+        self._loan_ids[slot] = loan_id
+        self._rate_versions[slot] = rate_version
+        self._size += 1
+
+    def extend(self, kinds, amounts, currencies, amounts_pkr, loan_ids=None, timestamp=None, rate_version=0):
+        # Bulk append of column sequences. Records that would be pushed out of
+        # the ring straight away are packed for the segment file directly.
+        n = len(kinds)
+        if timestamp is None:
+            timestamp = int(time.time())
+        if loan_ids is None:
+            loan_ids = [NO_LOAN] * n
+        codes = [CURRENCY_CODES[c] for c in currencies]
+        self._reserve(n)
+        for _ in range(min(self._size, self._size + n - self.capacity)):
+            self._spill_oldest()
+        direct = max(0, n - self.capacity)
+        if direct:
+            self._pending += b"".join(map(RECORD.pack, kinds[:direct], amounts[:direct], codes[:direct],
+                                          amounts_pkr[:direct], repeat(timestamp, direct), loan_ids[:direct],
+                                          repeat(rate_version, direct)))
+            if len(self._pending) >= self.SPILL_BATCH * RECORD.size:
+                self.flush()
+        for i in range(direct, n):
+            slot = (self._start + self._size) % self.capacity
+            self._kinds[slot] = kinds[i]
+            self._amounts[slot] = amounts[i]
+            self._currencies[slot] = codes[i]
+            self._amounts_pkr[slot] = amounts_pkr[i]
+            self._timestamps[slot] = timestamp
+            self._loan_ids[slot] = loan_ids[i]
+            self._rate_versions[slot] = rate_version
+            self._size += 1
+
+    def _spill_oldest(self):
+        slot = self._start
+        self._pending += RECORD.pack(self._kinds[slot], self._amounts[slot], self._currencies[slot],
+                                     self._amounts_pkr[slot], self._timestamps[slot], self._loan_ids[slot],
+                                     self._rate_versions[slot])
+        self._start = (self._start + 1) % self.capacity
+        self._size -= 1
+        if len(self._pending) >= self.SPILL_BATCH * RECORD.size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        if self.spill_path is None:
+            import tempfile
+            fd, self.spill_path = tempfile.mkstemp(prefix="atm-tx-", suffix=".seg", dir=self.spill_dir)
+            os.close(fd)
+            weakref.finalize(self, os.remove, self.spill_path).atexit = self.spill_dir is None
+        with open(self.spill_path, "ab") as segment:
+            segment.write(self._pending)
+        self._flushed += len(self._pending) // RECORD.size
+        self._pending = bytearray()
+
+    # ---------------- READING ----------------
+    def nbytes(self):
+        # Memory held by the in-memory part: the ring plus unwritten spill.
+        return sum(column.itemsize * len(column) for column in self._columns()) + len(self._pending)
+
+    @property
+    def spilled(self):
+        return self._flushed + len(self._pending) // RECORD.size
+
+    def _record(self, slot):
+        return Transaction(self._kinds[slot], self._amounts[slot], CURRENCIES[self._currencies[slot]],
+                           self._amounts_pkr[slot], self._timestamps[slot], self._loan_ids[slot],
+                           self._rate_versions[slot])
+
+    @staticmethod
+    def _unpack(buffer):
+        return [Transaction(kind, amount, CURRENCIES[currency], amount_pkr, timestamp, loan_id, rate_version)
+                for kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version
+                in RECORD.iter_unpack(buffer)]
+
+    def _read_spilled(self, start, stop):
+        records = []
+        if start < self._flushed:
+            with open(self.spill_path, "rb") as segment:
+                segment.seek(start * RECORD.size)
+                records += self._unpack(segment.read((min(stop, self._flushed) - start) * RECORD.size))
+        if stop > self._flushed:
+            begin = max(start, self._flushed) - self._flushed
+            records += self._unpack(self._pending[begin * RECORD.size:(stop - self._flushed) * RECORD.size])
+        return records
+
+    def _range(self, start, stop):
+        spilled = self.spilled
+        records = self._read_spilled(start, min(stop, spilled)) if start < spilled else []
+        for i in range(max(start, spilled), stop):
+            records.append(self._record((self._start + i - spilled) % self.capacity))
+        return records
+
+    def __len__(self):
+        return self.spilled + self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self._range(0, len(self))[index]
+            return self._range(start, max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self._range(index, index + 1)[0]
+
+    def __iter__(self):
+        for kind, amount, currency, amount_pkr, timestamp, loan_id, rate_version in self.rows():
+            yield Transaction(kind, amount, CURRENCIES[currency], amount_pkr, timestamp, loan_id, rate_version)
+
+    def rows(self):
+        # Raw record tuples, oldest first, with currencies as codes. Cheaper
+        # than building Transaction objects when filling a table.
+        self.flush()
+        if self._flushed:
+            with open(self.spill_path, "rb") as segment:
+                while True:
+                    chunk = segment.read(RECORD.size * 1024)
+                    if not chunk:
+                        break
+                    yield from RECORD.iter_unpack(chunk)
+        yield from self._ring_rows()
+
+    def _ring_rows(self):
+        for i in range(self._size):
+            slot = (self._start + i) % self.capacity
+            yield (self._kinds[slot], self._amounts[slot], self._currencies[slot], self._amounts_pkr[slot],
+                   self._timestamps[slot], self._loan_ids[slot], self._rate_versions[slot])
+
+    def last(self, n=10):
+        if n > self._size:
+            return self[-n:] if n < len(self) else self[:]
+        return [self._record((self._start + self._size - n + i) % self.capacity) for i in range(n)]